@@ -0,0 +1,240 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_db_connection
+from cache import invalidate
+from metrics import external_call, track
+from advice_cache import canonical_inputs, fingerprint, get_cached_advice, store_advice
+
+ADVICE_WORKERS = int(os.environ.get("AI_ADVICE_WORKERS", 2))
+ADVICE_QUEUE_SIZE = int(os.environ.get("AI_ADVICE_QUEUE_SIZE", 100))
+ADVICE_TIMEOUT = float(os.environ.get("AI_ADVICE_TIMEOUT", 20))
+ADVICE_RETRIES = int(os.environ.get("AI_ADVICE_RETRIES", 2))
+ADVICE_RETRY_BACKOFF = float(os.environ.get("AI_ADVICE_RETRY_BACKOFF", 1.5))
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+# The OpenAI SDK takes longer to import than the rest of the app together,
+# so it is loaded on the first advice job rather than at worker boot.
+_client = None
+_async_client = None
+_client_failed = False
+_client_lock = threading.Lock()
+
+
+def ai_advice_enabled():
+    return bool(OPENAI_API_KEY) and not _client_failed
+
+
+def get_openai_client():
+    global _client, _client_failed
+    if _client is None and ai_advice_enabled():
+        with _client_lock:
+            if _client is None and not _client_failed:
+                try:
+                    from openai import OpenAI
+                    # Retries are handled by the advice queue so a slow call
+                    # cannot multiply past ADVICE_TIMEOUT inside the SDK.
+                    _client = OpenAI(api_key=OPENAI_API_KEY, timeout=ADVICE_TIMEOUT, max_retries=0)
+                except Exception as e:
+                    print(f"OpenAI initialization warning: {e}")
+                    _client_failed = True
+    return _client
+
+
+def get_async_openai_client():
+    # Built on first use inside the ASGI app's event loop.
+    global _async_client, _client_failed
+    if _async_client is None and ai_advice_enabled():
+        try:
+            from openai import AsyncOpenAI
+            _async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=ADVICE_TIMEOUT, max_retries=0)
+        except Exception as e:
+            print(f"OpenAI initialization warning: {e}")
+            _client_failed = True
+    return _async_client
+
+
+def cached_ai_advice(glucose, medication_taken, stress_level, symptoms, risk_level, cur=None):
+    if not ai_advice_enabled():
+        return None
+    canonical = canonical_inputs(glucose, medication_taken, stress_level, symptoms, risk_level)
+    return get_cached_advice(fingerprint(canonical), cur)
+
+
+def generate_ai_advice(glucose, medication_taken, stress_level, symptoms, risk_level):
+    client = get_openai_client()
+    if client is None:
+        return get_default_advice(glucose, risk_level)
+
+    canonical = canonical_inputs(glucose, medication_taken, stress_level, symptoms, risk_level)
+    key = fingerprint(canonical)
+    advice = get_cached_advice(key)
+    if advice is not None:
+        return advice
+
+    with external_call("openai.chat"):
+        response = client.chat.completions.create(**advice_request(canonical))
+
+    advice = response.choices[0].message.content
+    if advice:
+        store_advice(key, canonical, advice)
+    return advice
+
+
+async def generate_ai_advice_async(glucose, medication_taken, stress_level, symptoms, risk_level):
+    # Event-loop version used by the ASGI app: the OpenAI call is awaited,
+    # and the cache's blocking DB work runs in a thread.
+    client = get_async_openai_client()
+    if client is None:
+        return get_default_advice(glucose, risk_level)
+
+    canonical = canonical_inputs(glucose, medication_taken, stress_level, symptoms, risk_level)
+    key = fingerprint(canonical)
+    advice = await asyncio.to_thread(get_cached_advice, key)
+    if advice is not None:
+        return advice
+
+    with external_call("openai.chat"):
+        response = await client.chat.completions.create(**advice_request(canonical))
+
+    advice = response.choices[0].message.content
+    if advice:
+        await asyncio.to_thread(store_advice, key, canonical, advice)
+    return advice
+
+
+def advice_request(canonical):
+    # The prompt is built from the bucketed inputs so the cached answer is
+    # valid for every reading that maps to the same fingerprint.
+    prompt = f"""
+You are a healthcare AI assistant for rural diabetes management in Cameroon. Provide personalized advice.
+
+Patient Data:
+- Glucose Level: {canonical['glucose']} mg/dL
+- Medication Taken: {'Yes' if canonical['medication_taken'] else 'No'}
+- Stress Level: {canonical['stress_level']}
+- Symptoms: {', '.join(canonical['symptoms']) or 'None reported'}
+- Risk Level: {canonical['risk_level']}
+
+Provide:
+1. Immediate actions (1-2 sentences)
+2. Dietary recommendations using local foods (fufu, yam, beans, plantain, etc.)
+3. Lifestyle advice
+4. When to seek urgent care
+
+Keep advice practical, culturally relevant, and concise.
+"""
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 300,
+    }
+
+
+def get_default_advice(glucose, risk_level):
+    if glucose < 70:
+        return "⚠️ Low blood sugar detected. Take 15g fast-acting carbs. Rest 15 min and retest. Seek medical care if symptoms persist."
+    elif glucose > 250:
+        return "🚨 Very high blood sugar. Drink water, take meds, avoid heavy meals. Seek medical care if very unwell."
+    elif glucose > 180:
+        return "📊 Blood sugar high. Reduce portions, choose boiled yam/beans. Walk 20 min. Take meds as prescribed."
+    else:
+        return "✅ Good reading. Maintain diet, meds, and physical activity."
+
+
+# -------------------- Background advice queue -------------------- #
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Like the DB pool, executor threads do not survive fork(), so each
+    # gunicorn worker lazily starts its own.
+    global _executor, _executor_pid, _slots
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=ADVICE_WORKERS,
+                                           thread_name_prefix="ai-advice")
+            _executor_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(ADVICE_QUEUE_SIZE)
+    return _executor, _slots
+
+
+def advice_update(assessment_id, advice, status):
+    # (sql, params) storing a job's outcome; returns the patient_id.
+    if advice is None:
+        return ("UPDATE risk_assessments SET advice_status = %s WHERE id = %s RETURNING patient_id",
+                (status, assessment_id))
+    return ("UPDATE risk_assessments SET ai_advice = %s, advice_status = %s WHERE id = %s RETURNING patient_id",
+            (advice, status, assessment_id))
+
+
+def _set_advice(assessment_id, advice, status):
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(*advice_update(assessment_id, advice, status))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+    if row and advice is not None:
+        # Patient readings responses embed ai_advice.
+        invalidate(f"patient:{row['patient_id']}")
+
+
+def _advice_job(slots, assessment_id, glucose, medication_taken, stress_level, symptoms, risk_level):
+    try:
+        with track("job:advice"):
+            _run_advice_job(assessment_id, glucose, medication_taken, stress_level, symptoms, risk_level)
+    except Exception as e:
+        print(f"AI advice job error for assessment {assessment_id}: {e}")
+    finally:
+        slots.release()
+
+
+def _run_advice_job(assessment_id, glucose, medication_taken, stress_level, symptoms, risk_level):
+    advice = None
+    for attempt in range(ADVICE_RETRIES + 1):
+        try:
+            advice = generate_ai_advice(glucose, medication_taken, stress_level,
+                                        symptoms, risk_level)
+            break
+        except Exception as e:
+            print(f"AI advice attempt {attempt + 1} failed for assessment {assessment_id}: {e}")
+            if attempt < ADVICE_RETRIES:
+                time.sleep(ADVICE_RETRY_BACKOFF * (2 ** attempt))
+    if advice:
+        _set_advice(assessment_id, advice, "ready")
+    else:
+        _set_advice(assessment_id, None, "failed")
+
+
+def enqueue_ai_advice(assessment_id, glucose, medication_taken, stress_level, symptoms, risk_level):
+    # Returns False when AI advice is disabled or the queue is full; the
+    # caller keeps the rule-based advice already stored on the assessment.
+    if not ai_advice_enabled():
+        return False
+    executor, slots = _get_executor()
+    if not slots.acquire(blocking=False):
+        return False
+    try:
+        executor.submit(_advice_job, slots, assessment_id, glucose, medication_taken,
+                        stress_level, symptoms, risk_level)
+    except RuntimeError:
+        slots.release()
+        return False
+    return True
+
+
+def shutdown_advice_queue(wait=True):
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=wait)
+        _executor = None
+        _executor_pid = None
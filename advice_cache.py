@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+from db import get_db_connection
+
+CACHE_MEMORY_SIZE = int(os.environ.get("AI_ADVICE_CACHE_SIZE", 512))
+CACHE_MEMORY_TTL = float(os.environ.get("AI_ADVICE_CACHE_MEMORY_TTL", 3600))
+CACHE_DB_TTL_DAYS = int(os.environ.get("AI_ADVICE_CACHE_TTL_DAYS", 30))
+CACHE_PURGE_EVERY = int(os.environ.get("AI_ADVICE_CACHE_PURGE_EVERY", 200))
+CACHE_HIT_FLUSH_EVERY = int(os.environ.get("AI_ADVICE_CACHE_HIT_FLUSH_EVERY", 50))
+CACHE_HIT_FLUSH_SECONDS = float(os.environ.get("AI_ADVICE_CACHE_HIT_FLUSH_SECONDS", 60))
+
+# Bump when the advice prompt changes so old entries stop matching.
+PROMPT_VERSION = 1
+
+# (upper bound exclusive, label) — boundaries follow the risk rules.
+GLUCOSE_BUCKETS = [
+    (54, "<54"),
+    (70, "54-69"),
+    (100, "70-99"),
+    (140, "100-139"),
+    (181, "140-180"),
+    (251, "181-250"),
+    (301, "251-300"),
+    (400, "301-399"),
+]
+
+_NO_SYMPTOMS = {"", "none", "no", "nil", "n/a", "na", "rien", "aucun"}
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+# Database hits not yet added to ai_advice_cache.hit_count.
+_pending_hits = Counter()
+_last_flush = time.monotonic()
+_flushing = False
+
+
+def glucose_bucket(glucose):
+    for upper, label in GLUCOSE_BUCKETS:
+        if glucose < upper:
+            return label
+    return ">=400"
+
+
+def normalize_symptoms(symptoms):
+    if not symptoms:
+        return []
+    text = unicodedata.normalize("NFKD", str(symptoms).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    # "n/a" before "/" is taken as a separator.
+    text = re.sub(r"\bn/a\b", "na", text)
+    parts = re.split(r"[,;/\n]|\band\b|\bet\b", text)
+    cleaned = set()
+    for part in parts:
+        part = re.sub(r"[^a-z0-9 ]", " ", part)
+        part = " ".join(part.split())
+        if part not in _NO_SYMPTOMS:
+            cleaned.add(part)
+    return sorted(cleaned)
+
+
+def canonical_inputs(glucose, medication_taken, stress_level, symptoms, risk_level):
+    return {
+        "glucose": glucose_bucket(float(glucose)),
+        "medication_taken": bool(medication_taken),
+        "stress_level": (stress_level or "None").strip().title(),
+        "symptoms": normalize_symptoms(symptoms),
+        "risk_level": risk_level,
+    }
+
+
+def fingerprint(canonical):
+    payload = json.dumps({"v": PROMPT_VERSION, **canonical}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def _memory_get(key):
+    with _lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        advice, stored_at = entry
+        if time.monotonic() - stored_at > CACHE_MEMORY_TTL:
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return advice
+
+
+def _memory_put(key, advice):
+    with _lock:
+        _memory[key] = (advice, time.monotonic())
+        _memory.move_to_end(key)
+        while len(_memory) > CACHE_MEMORY_SIZE:
+            _memory.popitem(last=False)
+            _counters["evictions"] += 1
+
+
+def _db_get(cur, key):
+    # A plain read: the lookup runs inside the reading's transaction, and
+    # bumping hit_count here would hold the row lock until it commits,
+    # serializing concurrent readings with the same fingerprint.
+    cur.execute("""
+        SELECT advice FROM ai_advice_cache
+        WHERE fingerprint = %s
+          AND created_at >= NOW() - %s * INTERVAL '1 day'
+    """, (key, CACHE_DB_TTL_DAYS))
+    row = cur.fetchone()
+    return row["advice"] if row else None
+
+
+def _take_pending_hits():
+    global _last_flush
+    with _lock:
+        hits = dict(_pending_hits)
+        _pending_hits.clear()
+        _last_flush = time.monotonic()
+    return hits
+
+
+def _write_hits(cur, hits):
+    # Fingerprints in sorted order so concurrent flushes lock rows alike.
+    keys = sorted(hits)
+    cur.execute("""
+        UPDATE ai_advice_cache c
+        SET hit_count = c.hit_count + h.n, last_hit_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::char(64)[], %s::int[]) AS h(fingerprint, n)
+        WHERE c.fingerprint = h.fingerprint
+    """, (keys, [hits[k] for k in keys]))
+
+
+def flush_hit_counts():
+    # Adds the pending hits to ai_advice_cache in one statement on its own
+    # connection. Counts are advisory, so a failed flush drops them.
+    global _flushing
+    try:
+        hits = _take_pending_hits()
+        if not hits:
+            return
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            _write_hits(cur, hits)
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        print(f"AI advice cache hit count warning: {e}")
+    finally:
+        with _lock:
+            _flushing = False
+
+
+def _record_hit(key):
+    # Hits are batched and written by a background thread once
+    # CACHE_HIT_FLUSH_EVERY have accumulated or CACHE_HIT_FLUSH_SECONDS
+    # have passed, never on the caller's connection.
+    global _flushing
+    with _lock:
+        _pending_hits[key] += 1
+        due = (sum(_pending_hits.values()) >= CACHE_HIT_FLUSH_EVERY
+               or time.monotonic() - _last_flush >= CACHE_HIT_FLUSH_SECONDS)
+        if not due or _flushing:
+            return
+        _flushing = True
+    threading.Thread(target=flush_hit_counts, name="ai-advice-hits", daemon=True).start()
+
+
+def get_cached_advice(key, cur=None):
+    advice = _memory_get(key)
+    if advice is not None:
+        _count("memory_hits")
+        return advice
+
+    try:
+        if cur is not None:
+            # Savepoint so a cache failure cannot abort the caller's transaction.
+            with cur.connection.transaction():
+                advice = _db_get(cur, key)
+        else:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                advice = _db_get(c, key)
+                conn.commit()
+                c.close()
+    except Exception as e:
+        print(f"AI advice cache lookup warning: {e}")
+        advice = None
+
+    if advice is None:
+        _count("misses")
+        return None
+    _count("db_hits")
+    _record_hit(key)
+    _memory_put(key, advice)
+    return advice
+
+
+def store_advice(key, canonical, advice):
+    _memory_put(key, advice)
+    with _lock:
+        _counters["stores"] += 1
+        purge = _counters["stores"] % CACHE_PURGE_EVERY == 0
+    try:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO ai_advice_cache (fingerprint, inputs, advice)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (fingerprint) DO UPDATE
+                SET advice = EXCLUDED.advice, created_at = CURRENT_TIMESTAMP, hit_count = 0
+            """, (key, json.dumps(canonical), advice))
+            hits = _take_pending_hits()
+            if hits:
+                _write_hits(cur, hits)
+            if purge:
+                cur.execute("DELETE FROM ai_advice_cache WHERE created_at < NOW() - %s * INTERVAL '1 day'",
+                            (CACHE_DB_TTL_DAYS,))
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        print(f"AI advice cache store warning: {e}")
+
+
+def cache_stats():
+    with _lock:
+        stats = dict(_counters)
+        stats["memory_entries"] = len(_memory)
+        stats["pending_hits"] = sum(_pending_hits.values())
+    lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["memory_hits"] + stats["db_hits"]) / lookups, 4) if lookups else 0
+    return stats
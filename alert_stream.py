@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import queue
+import threading
+
+import psycopg
+
+from db import DATABASE_URL, get_db_connection
+
+# Server-Sent Events for high-risk alerts. The alert worker (alerts.py)
+# announces each batch of new, escalated and resolved alerts with one
+# NOTIFY; one LISTEN connection per worker fans the events out to that
+# worker's open streams, so a connected dashboard costs no queries until
+# something happens.
+#
+# Events carry ids from alert_event_counter, which only grow and are
+# committed in order. A stream's SSE ids follow them, so a reconnecting
+# client is told to resync exactly when events were sent while it was away.
+ALERT_CHANNEL = "arch_alerts"
+ALERT_STREAM_MAX_CLIENTS = int(os.environ.get("ALERT_STREAM_MAX_CLIENTS", 16))
+ALERT_STREAM_MAX_SECONDS = float(os.environ.get("ALERT_STREAM_MAX_SECONDS", 300))
+ALERT_STREAM_HEARTBEAT = float(os.environ.get("ALERT_STREAM_HEARTBEAT", 15))
+ALERT_STREAM_QUEUE_SIZE = 100
+RECONNECT_BACKOFF = 2.0
+
+# Each stream holds a worker thread, so the number open at once per worker
+# is capped like exports are.
+stream_slots = threading.BoundedSemaphore(ALERT_STREAM_MAX_CLIENTS)
+
+_CLOSE = object()
+
+
+# Change in open alerts per event kind. A reminder is a repeat high reading
+# for a patient whose alert is already open.
+OPEN_ALERT_DELTA = {"new": 1, "reminder": 0, "escalated": 0, "resolved": -1}
+
+
+def decode_events(payload):
+    return json.loads(payload)["events"]
+
+
+def scope_event(event, role, user_id):
+    # What one subscriber sees of an alert, or None if it is not theirs.
+    # Admins count every open alert; CHVs count those of patients they have
+    # seen (one per patient) and list the readings they took themselves.
+    kind = event.get("kind", "new")
+    delta = OPEN_ALERT_DELTA.get(kind, 0)
+    if role == "admin":
+        return {"event_id": event["event_id"], "alert_id": event["alert_id"], "kind": kind,
+                "patient": event["patient"], "delta": {"active_alerts": delta}}
+    if user_id != event.get("chv_id") and user_id not in (event.get("chv_ids") or []):
+        return None
+    return {
+        "event_id": event["event_id"],
+        "alert_id": event["alert_id"],
+        "kind": kind,
+        "patient": event["patient"] if user_id == event.get("chv_id") and kind in ("new", "reminder") else None,
+        "delta": {"high_risk_count": delta},
+    }
+
+
+def scope_events(events, role, user_id):
+    # One subscriber's share of a NOTIFY batch. A batch with nothing for
+    # them still moves their stream's id on, so a later reconnect does not
+    # resync for events they were never going to see.
+    scoped = [item for item in (scope_event(e, role, user_id) for e in events) if item is not None]
+    return scoped or [{"event_id": max(e["event_id"] for e in events)}]
+
+
+class AlertBroker:
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def _ensure_listener(self):
+        # The listener thread does not survive fork(), so each gunicorn
+        # worker starts its own on first subscription.
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self._listen, name="alert-listener", daemon=True)
+                self.pid = os.getpid()
+                self.thread.start()
+
+    def subscribe(self, role, user_id):
+        self._ensure_listener()
+        q = queue.Queue(ALERT_STREAM_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers[q] = (role, user_id)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.pop(q, None)
+
+    def publish(self, events):
+        if not events:
+            return
+        with self.lock:
+            subscribers = list(self.subscribers.items())
+        for q, (role, user_id) in subscribers:
+            try:
+                for item in scope_events(events, role, user_id):
+                    q.put_nowait(item)
+            except queue.Full:
+                # A stalled client is dropped; it resyncs on reconnect.
+                self.unsubscribe(q)
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(_CLOSE)
+
+    def _listen(self):
+        while not self.stopping.is_set():
+            try:
+                with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {ALERT_CHANNEL}")
+                    while not self.stopping.is_set():
+                        for notify in conn.notifies(timeout=ALERT_STREAM_HEARTBEAT):
+                            try:
+                                self.publish(decode_events(notify.payload))
+                            except (ValueError, KeyError) as e:
+                                print(f"Alert stream warning, bad payload: {e}")
+            except Exception as e:
+                print(f"Alert listener error, reconnecting: {e}")
+                # Events sent while disconnected are lost; tell streams to
+                # reload their stats.
+                self.publish_resync()
+                time.sleep(RECONNECT_BACKOFF)
+
+    def publish_resync(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait({"resync": True})
+            except queue.Full:
+                pass
+
+    def stop(self):
+        self.stopping.set()
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.subscribers.clear()
+        for q in subscribers:
+            try:
+                q.put_nowait(_CLOSE)
+            except queue.Full:
+                pass
+
+
+broker = AlertBroker()
+
+
+LATEST_EVENT_ID_SQL = "SELECT COALESCE(MAX(last_event_id), 0) AS last_id FROM alert_event_counter"
+
+
+def latest_event_id():
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(LATEST_EVENT_ID_SQL)
+        last_id = cur.fetchone()["last_id"]
+        cur.close()
+    return last_id
+
+
+def sse_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def sse_item(item):
+    # A queued item as SSE. Id-only messages update the client's
+    # Last-Event-ID without firing an event.
+    if "alert_id" not in item:
+        return f"id: {item['event_id']}\n\n".encode("utf-8")
+    return sse_event("alert", item, item["event_id"])
+
+
+def alert_stream(role, user_id, last_event_id):
+    # Streams are closed after ALERT_STREAM_MAX_SECONDS so threads recycle;
+    # EventSource reconnects on its own with Last-Event-ID, and a client
+    # that missed events meanwhile is told to resync.
+    q = broker.subscribe(role, user_id)
+    try:
+        last_id = latest_event_id()
+        yield b"retry: 3000\n\n"
+        yield sse_event("ready", {"last_event_id": last_id}, last_id)
+        if last_event_id is not None and last_event_id != last_id:
+            yield sse_event("resync", {})
+
+        deadline = time.monotonic() + ALERT_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                item = q.get(timeout=ALERT_STREAM_HEARTBEAT)
+            except queue.Empty:
+                yield b": keepalive\n\n"
+                continue
+            if item is _CLOSE:
+                break
+            if item.get("resync"):
+                # Events may have been lost; the stats reload covers them.
+                yield sse_event("resync", {}, latest_event_id())
+            else:
+                yield sse_item(item)
+    finally:
+        broker.unsubscribe(q)
+
+
+def shutdown_alert_stream():
+    broker.stop()
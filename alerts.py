@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import signal
+import threading
+from datetime import datetime
+
+import psycopg
+
+from alert_stream import ALERT_CHANNEL
+from cache import invalidate
+from db import DATABASE_URL, get_db_connection
+from payloads import to_utc
+
+# High-risk readings are queued in alert_queue inside the reading's own
+# transaction, and this worker turns them into alerts. Each patient has at
+# most one open (pending or escalated) alert: further high readings add to
+# its occurrences, and dashboards are only told again once ALERT_DEDUP_HOURS
+# have passed since the last notification. Alerts left pending for
+# ALERT_ESCALATE_HOURS are escalated. Notifications go out as one NOTIFY per
+# batch rather than one per alert.
+#
+# chv_open_alerts keeps each CHV's open and escalated alert counts (patients
+# they have taken readings for) so the dashboard reads one row. A CHV who
+# sees a patient after their alert opened is picked up by the periodic
+# recount.
+#
+# Run one or more workers beside the web processes (SKIP LOCKED keeps them
+# from taking the same rows):
+#   python alerts.py            # process the queue until stopped
+#   python alerts.py --rebuild  # recount chv_open_alerts
+ALERT_QUEUE_CHANNEL = "arch_alert_queue"
+ALERT_BATCH_SIZE = int(os.environ.get("ALERT_BATCH_SIZE", 200))
+ALERT_DEDUP_HOURS = float(os.environ.get("ALERT_DEDUP_HOURS", 24))
+ALERT_ESCALATE_HOURS = float(os.environ.get("ALERT_ESCALATE_HOURS", 48))
+ALERT_POLL_SECONDS = float(os.environ.get("ALERT_POLL_SECONDS", 10))
+ALERT_RECOUNT_SECONDS = float(os.environ.get("ALERT_RECOUNT_SECONDS", 300))
+ALERT_COUNTS_LOCK_ID = 74210004
+RECONNECT_BACKOFF = 2.0
+
+# pg_notify payloads must stay under 8000 bytes.
+NOTIFY_MAX_BYTES = 7000
+
+OPEN_ALERT_SQL = "status IN ('pending', 'escalated')"
+
+
+def _lock_counts(cur, exclusive=False):
+    # Queue batches, escalations and resolutions adjust chv_open_alerts
+    # side by side (shared); a recount excludes them so it cannot overwrite
+    # an adjustment it did not see.
+    cur.execute(f"SELECT {'pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'}(%s)",
+                (ALERT_COUNTS_LOCK_ID,))
+
+
+def _adjust_open_counts(cur, patient_ids, open_delta, escalated_delta=0):
+    # Adds the deltas once per open alert a CHV counts among patient_ids.
+    # Rows are created and locked in chv_id order so concurrent workers
+    # cannot deadlock on them.
+    if not patient_ids:
+        return
+    params = {"patients": list(patient_ids), "open": open_delta, "escalated": escalated_delta}
+    cur.execute("""
+        INSERT INTO chv_open_alerts (chv_id)
+        SELECT DISTINCT chv_id FROM chv_patients WHERE patient_id = ANY(%(patients)s) ORDER BY chv_id
+        ON CONFLICT (chv_id) DO NOTHING
+    """, params)
+    cur.execute("""
+        SELECT chv_id FROM chv_open_alerts
+        WHERE chv_id IN (SELECT chv_id FROM chv_patients WHERE patient_id = ANY(%(patients)s))
+        ORDER BY chv_id
+        FOR UPDATE
+    """, params)
+    cur.execute("""
+        UPDATE chv_open_alerts c
+        SET open_count = GREATEST(c.open_count + d.n * %(open)s, 0),
+            escalated_count = GREATEST(c.escalated_count + d.n * %(escalated)s, 0)
+        FROM (SELECT chv_id, COUNT(*) AS n FROM chv_patients
+              WHERE patient_id = ANY(%(patients)s) GROUP BY chv_id) d
+        WHERE c.chv_id = d.chv_id
+    """, params)
+
+
+def _notify(cur, alerts):
+    # alerts: [(alert_id, kind)]; kind is new, reminder, escalated or
+    # resolved. Delivered to the alert streams when the transaction commits.
+    # Each event takes the next id from alert_event_counter, whose row lock
+    # is held until then, so call this last in the transaction.
+    if not alerts:
+        return
+    cur.execute("UPDATE alert_event_counter SET last_event_id = last_event_id + %s RETURNING last_event_id",
+                (len(alerts),))
+    first_id = cur.fetchone()["last_event_id"] - len(alerts) + 1
+    cur.execute("""
+        SELECT x.kind, x.n, alert_event(x.id) AS event
+        FROM unnest(%s::int[], %s::text[]) WITH ORDINALITY AS x(id, kind, n)
+        ORDER BY x.n
+    """, ([a for a, _ in alerts], [k for _, k in alerts]))
+    chunk, size = [], 0
+    for row in cur.fetchall():
+        event = {**row["event"], "kind": row["kind"], "event_id": first_id + row["n"] - 1}
+        # json_build_object writes timestamps without an offset; send them
+        # like the JSON APIs do.
+        patient = event.get("patient") or {}
+        if patient.get("reading_time"):
+            reading_time = to_utc(datetime.fromisoformat(patient["reading_time"]))
+            patient["reading_time"] = reading_time.isoformat(timespec="seconds")
+        encoded = json.dumps(event, default=str)
+        if chunk and size + len(encoded) > NOTIFY_MAX_BYTES:
+            cur.execute("SELECT pg_notify(%s, %s)", (ALERT_CHANNEL, '{"events": [' + ", ".join(chunk) + "]}"))
+            chunk, size = [], 0
+        chunk.append(encoded)
+        size += len(encoded) + 2
+    cur.execute("SELECT pg_notify(%s, %s)", (ALERT_CHANNEL, '{"events": [' + ", ".join(chunk) + "]}"))
+
+
+def process_queue(cur, batch_size=ALERT_BATCH_SIZE):
+    # Turns up to batch_size queued events into alerts in the caller's
+    # transaction and returns how many were taken.
+    cur.execute("""
+        SELECT id, patient_id, risk_assessment_id, message, created_at, reading_time
+        FROM alert_queue
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (batch_size,))
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+
+    # An alert's age (created_at, which escalation keys on) and last_seen_at
+    # are queue times, so a backdated offline sync is not escalated at
+    # once. The message and assessment come from the newest reading by
+    # reading time, since synced readings can arrive out of order.
+    per_patient = {}
+    for row in rows:
+        entry = per_patient.setdefault(row["patient_id"], {"first": row["created_at"], "last": row["created_at"],
+                                                           "latest": row, "count": 0})
+        entry["count"] += 1
+        entry["first"] = min(entry["first"], row["created_at"])
+        entry["last"] = max(entry["last"], row["created_at"])
+        if row["reading_time"] >= entry["latest"]["reading_time"]:
+            entry["latest"] = row
+    patient_ids = sorted(per_patient)
+
+    _lock_counts(cur)
+    # One upsert per batch; the partial unique index on open alerts is what
+    # folds repeats into the patient's existing alert.
+    cur.execute(f"""
+        INSERT INTO alerts (patient_id, risk_assessment_id, alert_type, message, occurrences,
+                            created_at, last_seen_at, notified_at)
+        SELECT p, a, 'high_risk', m, n, t0, t, CURRENT_TIMESTAMP
+        FROM unnest(%s::int[], %s::int[], %s::text[], %s::int[], %s::timestamp[], %s::timestamp[])
+             AS x(p, a, m, n, t0, t)
+        ON CONFLICT (patient_id) WHERE {OPEN_ALERT_SQL} DO UPDATE SET
+            occurrences = alerts.occurrences + EXCLUDED.occurrences,
+            risk_assessment_id = EXCLUDED.risk_assessment_id,
+            message = EXCLUDED.message,
+            last_seen_at = GREATEST(alerts.last_seen_at, EXCLUDED.last_seen_at),
+            notified_at = CASE WHEN alerts.notified_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+                               THEN CURRENT_TIMESTAMP ELSE alerts.notified_at END
+        RETURNING id, patient_id, xmax = 0 AS created, notified_at = CURRENT_TIMESTAMP AS notify
+    """, (patient_ids,
+          [per_patient[p]["latest"]["risk_assessment_id"] for p in patient_ids],
+          [per_patient[p]["latest"]["message"] for p in patient_ids],
+          [per_patient[p]["count"] for p in patient_ids],
+          [per_patient[p]["first"] for p in patient_ids],
+          [per_patient[p]["last"] for p in patient_ids],
+          ALERT_DEDUP_HOURS))
+    upserted = cur.fetchall()
+
+    _adjust_open_counts(cur, [r["patient_id"] for r in upserted if r["created"]], 1)
+    cur.execute("DELETE FROM alert_queue WHERE id = ANY(%s)", ([r["id"] for r in rows],))
+    _notify(cur, [(r["id"], "new" if r["created"] else "reminder") for r in upserted if r["notify"]])
+    return len(rows)
+
+
+def escalate_alerts(cur, batch_size=ALERT_BATCH_SIZE):
+    # Escalates alerts pending for longer than ALERT_ESCALATE_HOURS and
+    # returns how many.
+    _lock_counts(cur)
+    cur.execute("""
+        UPDATE alerts SET status = 'escalated', escalated_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM alerts
+            WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, patient_id
+    """, (ALERT_ESCALATE_HOURS, batch_size))
+    escalated = cur.fetchall()
+    _adjust_open_counts(cur, [r["patient_id"] for r in escalated], 0, 1)
+    _notify(cur, [(r["id"], "escalated") for r in escalated])
+    return len(escalated)
+
+
+def resolve_alert(cur, alert_id, chv_id=None):
+    # Resolves an open alert; with chv_id, only one for a patient that CHV
+    # has seen. Returns the alert's id, patient_id and previous_status, or
+    # None if there was nothing to resolve.
+    _lock_counts(cur)
+    cur.execute(f"""
+        WITH target AS (
+            SELECT id, status FROM alerts a
+            WHERE a.id = %(id)s AND a.{OPEN_ALERT_SQL}
+              AND (%(chv_id)s::int IS NULL OR EXISTS (
+                  SELECT 1 FROM chv_patients cp WHERE cp.chv_id = %(chv_id)s AND cp.patient_id = a.patient_id))
+            FOR UPDATE
+        )
+        UPDATE alerts SET status = 'resolved', resolved_at = CURRENT_TIMESTAMP
+        FROM target
+        WHERE alerts.id = target.id
+        RETURNING alerts.id, alerts.patient_id, target.status AS previous_status
+    """, {"id": alert_id, "chv_id": chv_id})
+    resolved = cur.fetchone()
+    if resolved is None:
+        return None
+    _adjust_open_counts(cur, [resolved["patient_id"]], -1,
+                        -1 if resolved["previous_status"] == "escalated" else 0)
+    _notify(cur, [(resolved["id"], "resolved")])
+    return resolved
+
+
+def rebuild_open_alerts(cur):
+    # Recomputes chv_open_alerts from the open alerts. Rows are updated in
+    # place rather than truncated, so dashboard reads never wait on it.
+    _lock_counts(cur, exclusive=True)
+    cur.execute(f"""
+        WITH counts AS (
+            SELECT cp.chv_id, COUNT(*) AS open_count,
+                   COUNT(*) FILTER (WHERE a.status = 'escalated') AS escalated_count
+            FROM alerts a
+            JOIN chv_patients cp ON cp.patient_id = a.patient_id
+            WHERE a.{OPEN_ALERT_SQL}
+            GROUP BY cp.chv_id
+        ), upserted AS (
+            INSERT INTO chv_open_alerts (chv_id, open_count, escalated_count)
+            SELECT chv_id, open_count, escalated_count FROM counts ORDER BY chv_id
+            ON CONFLICT (chv_id) DO UPDATE SET
+                open_count = EXCLUDED.open_count, escalated_count = EXCLUDED.escalated_count
+            WHERE (chv_open_alerts.open_count, chv_open_alerts.escalated_count)
+                  IS DISTINCT FROM (EXCLUDED.open_count, EXCLUDED.escalated_count)
+        )
+        UPDATE chv_open_alerts SET open_count = 0, escalated_count = 0
+        WHERE chv_id NOT IN (SELECT chv_id FROM counts) AND (open_count <> 0 OR escalated_count <> 0)
+    """)
+
+
+class AlertWorker:
+    def __init__(self):
+        self.stopping = threading.Event()
+        self.next_recount = 0
+
+    def run_once(self):
+        # Drains the queue, escalates and, when due, recounts. Returns
+        # whether anything changed.
+        changed = False
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            while not self.stopping.is_set():
+                taken = process_queue(cur)
+                conn.commit()
+                changed = changed or bool(taken)
+                if taken < ALERT_BATCH_SIZE:
+                    break
+            while not self.stopping.is_set():
+                escalated = escalate_alerts(cur)
+                conn.commit()
+                changed = changed or bool(escalated)
+                if escalated < ALERT_BATCH_SIZE:
+                    break
+            if time.monotonic() >= self.next_recount:
+                rebuild_open_alerts(cur)
+                conn.commit()
+                self.next_recount = time.monotonic() + ALERT_RECOUNT_SECONDS
+                changed = True
+            cur.close()
+        if changed:
+            invalidate("alerts", "admin")
+        return changed
+
+    def run(self):
+        # New queue rows wake the worker through a NOTIFY from alert_queue's
+        # trigger; the poll timeout drives escalation.
+        while not self.stopping.is_set():
+            try:
+                with psycopg.connect(DATABASE_URL, autocommit=True) as listen_conn:
+                    listen_conn.execute(f"LISTEN {ALERT_QUEUE_CHANNEL}")
+                    while not self.stopping.is_set():
+                        self.run_once()
+                        for _ in listen_conn.notifies(timeout=ALERT_POLL_SECONDS, stop_after=1):
+                            pass
+            except Exception as e:
+                print(f"Alert worker error, retrying: {e}")
+                self.stopping.wait(RECONNECT_BACKOFF)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def start_alert_worker():
+    # In-process worker for the development server.
+    worker = AlertWorker()
+    threading.Thread(target=worker.run, name="alert-worker", daemon=True).start()
+    return worker
+
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            rebuild_open_alerts(cur)
+            conn.commit()
+            cur.close()
+        print("Open alert counts rebuilt")
+        sys.exit(0)
+    worker = AlertWorker()
+    # Finish the current batch on SIGTERM; anything not committed stays
+    # queued for the next worker.
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    print("Alert worker started")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
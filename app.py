@@ -1,154 +1,86 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from datetime import datetime
-import psycopg
-from psycopg.rows import dict_row
 import secrets
-import json
-from contextlib import contextmanager
+from psycopg_pool import PoolTimeout
+from db import get_db_connection, pool_stats
+from advice import ai_advice_enabled, cached_ai_advice, enqueue_ai_advice
+from advice_cache import cache_stats
+from migrations import run_migrations
+from partitions import ensure_partitions
+from search import normalize_name, search_patients as run_patient_search
+from features import FEATURE_MAX_DAYS, FEATURE_WINDOWS, RECORD_FEATURES_SQL, features_params, fetch_features
+from rollups import record_reading
+from geo import fetch_geo_series, parse_geo_filters
+from readings import (ENQUEUE_ALERT_SQL, INSERT_ASSESSMENT_SQL, INSERT_READING_SQL,
+                      SET_ADVICE_STATUS_SQL, alert_params, assess_reading, assessment_params,
+                      invalidation_tags, reading_params)
+from sync import SYNC_MAX_BATCH, ingest_readings
+from cache import cached_response, invalidate, response_cache_stats
+from timeseries import (BUCKET_UNITS, READING_FIELDS, READINGS_PAGE_SIZE, SERIES_DEFAULT_POINTS,
+                        fetch_readings_page, fetch_series, reading_columns)
+from payloads import OrjsonProvider, columnar, compress_response, parse_fields
+from export import EXPORT_FORMATS, export_slots, export_stream, parquet_available, parse_filters
+from alert_stream import alert_stream, stream_slots
+from alerts import resolve_alert, start_alert_worker
+from metrics import instrument_app, metrics_authorized, render_metrics, statement_stats
+from auth import (auth_stats, authenticate, current_user, hash_password, load_secret_key, login_user,
+                  requires_login, revoke_sessions)
 
 
 
 app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", secrets.token_hex(32))
+app.secret_key = load_secret_key(app.instance_path)
+app.json = OrjsonProvider(app)
+# Registered first so it runs after every other after_request hook.
+app.after_request(compress_response)
 CORS(app)
+instrument_app(app, current_user)
 
-openai_client = None
-if os.environ.get("OPENAI_API_KEY"):
-    try:
-        from openai import OpenAI
-        openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    except Exception as e:
-        print(f"OpenAI initialization warning: {e}")
-        openai_client = None
-
-DATABASE_URL = os.environ.get("DATABASE_URL")
-
-@contextmanager
-def get_db_connection():
-    conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
-    try:
-        yield conn
-    finally:
-        conn.close()
+DEFAULT_USERS = [
+    ("admin", "admin123", "System Administrator", "admin", "admin@arch.cm", "Central"),
+    ("chv_demo", "chv123", "Demo CHV Worker", "chv", "chv@arch.cm", "Bafoussam"),
+]
 
 def init_db():
+    # Schema, partitions and default users. Run once per deploy with
+    # `flask --app app init-db` (the procfile release step), not on every
+    # worker boot.
     with get_db_connection() as conn:
+        run_migrations(conn)
         cur = conn.cursor()
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(255) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                full_name VARCHAR(255) NOT NULL,
-                role VARCHAR(50) NOT NULL,
-                email VARCHAR(255),
-                phone VARCHAR(50),
-                district VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS patients (
-                id SERIAL PRIMARY KEY,
-                patient_id VARCHAR(50) UNIQUE NOT NULL,
-                full_name VARCHAR(255) NOT NULL,
-                age INTEGER,
-                gender VARCHAR(10),
-                village VARCHAR(255),
-                district VARCHAR(255),
-                phone VARCHAR(50),
-                emergency_contact VARCHAR(50),
-                diabetes_type VARCHAR(20),
-                diagnosis_date DATE,
-                registered_by INTEGER REFERENCES users(id),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS glucose_readings (
-                id SERIAL PRIMARY KEY,
-                patient_id INTEGER REFERENCES patients(id),
-                chv_id INTEGER REFERENCES users(id),
-                glucose_level FLOAT NOT NULL,
-                reading_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                medication_taken BOOLEAN,
-                diet_description TEXT,
-                stress_level VARCHAR(50),
-                food_availability VARCHAR(50),
-                symptoms TEXT,
-                notes TEXT
-            )
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS risk_assessments (
-                id SERIAL PRIMARY KEY,
-                reading_id INTEGER REFERENCES glucose_readings(id),
-                patient_id INTEGER REFERENCES patients(id),
-                risk_level VARCHAR(20) NOT NULL,
-                risk_score FLOAT,
-                ai_advice TEXT,
-                warning_flags TEXT,
-                referral_recommended BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS alerts (
-                id SERIAL PRIMARY KEY,
-                patient_id INTEGER REFERENCES patients(id),
-                risk_assessment_id INTEGER REFERENCES risk_assessments(id),
-                alert_type VARCHAR(50),
-                message TEXT,
-                status VARCHAR(20) DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                resolved_at TIMESTAMP
-            )
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS visit_summaries (
-                id SERIAL PRIMARY KEY,
-                patient_id INTEGER REFERENCES patients(id),
-                chv_id INTEGER REFERENCES users(id),
-                visit_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                summary TEXT,
-                recommendations TEXT,
-                follow_up_date DATE
-            )
-        """)
-
-        # Seed default users
-        admin_hash = generate_password_hash("admin123")
-        cur.execute("""
-            INSERT INTO users (username, password_hash, full_name, role, email, district)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (username) DO NOTHING
-        """, ("admin", admin_hash, "System Administrator", "admin", "admin@arch.cm", "Central"))
-
-        chv_hash = generate_password_hash("chv123")
-        cur.execute("""
-            INSERT INTO users (username, password_hash, full_name, role, email, district)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (username) DO NOTHING
-        """, ("chv_demo", chv_hash, "Demo CHV Worker", "chv", "chv@arch.cm", "Bafoussam"))
+        ensure_partitions(cur)
+
+        # Seed default users; passwords are only hashed for missing ones.
+        cur.execute("SELECT username FROM users WHERE username = ANY(%s)",
+                    ([u[0] for u in DEFAULT_USERS],))
+        existing = {row["username"] for row in cur.fetchall()}
+        for username, password, full_name, role, email, district in DEFAULT_USERS:
+            if username in existing:
+                continue
+            cur.execute("""
+                INSERT INTO users (username, password_hash, full_name, role, email, district)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (username) DO NOTHING
+            """, (username, hash_password(password), full_name, role, email, district))
 
         conn.commit()
         cur.close()
 
+@app.cli.command("init-db")
+def init_db_command():
+    """Apply migrations, create upcoming partitions and seed default users."""
+    init_db()
+    print("Database initialized")
+
 # -------------------- ROUTES -------------------- #
 
 @app.route("/")
 def index():
-    if "user_id" in session:
-        role = session.get("role")
+    user = current_user()
+    if user is not None:
+        role = user["role"]
         if role == "chv":
             return redirect(url_for("chv_dashboard"))
         elif role == "admin":
@@ -161,17 +93,9 @@ def login():
     username = data.get("username")
     password = data.get("password")
 
-    with get_db_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-        cur.close()
-
-    if user and check_password_hash(user["password_hash"], password):
-        session["user_id"] = user["id"]
-        session["username"] = user["username"]
-        session["full_name"] = user["full_name"]
-        session["role"] = user["role"]
+    user = authenticate(username, password)
+    if user is not None:
+        login_user(user)
         return jsonify({"success": True, "role": user["role"]})
 
     return jsonify({"success": False, "message": "Invalid credentials"}), 401
@@ -182,40 +106,33 @@ def logout():
     return redirect(url_for("index"))
 
 @app.route("/chv-dashboard")
+@requires_login("chv", page=True)
 def chv_dashboard():
-    if "user_id" not in session or session.get("role") != "chv":
-        return redirect(url_for("index"))
     return render_template("chv_dashboard.html")
 
 @app.route("/admin-dashboard")
+@requires_login("admin", page=True)
 def admin_dashboard():
-    if "user_id" not in session or session.get("role") != "admin":
-        return redirect(url_for("index"))
-    return render_template("admin_dashboard.html")
+    return render_template("admin_dashboard.html", parquet_export=parquet_available())
 
 @app.route("/patient-registration")
+@requires_login(page=True)
 def patient_registration():
-    if "user_id" not in session:
-        return redirect(url_for("index"))
     return render_template("patient_registration.html")
 
 @app.route("/patient-dashboard/<int:patient_id>")
+@requires_login(page=True)
 def patient_dashboard(patient_id):
-    if "user_id" not in session:
-        return redirect(url_for("index"))
     return render_template("patient_dashboard.html", patient_id=patient_id)
 
 @app.route("/glucose-input/<int:patient_id>")
+@requires_login(page=True)
 def glucose_input(patient_id):
-    if "user_id" not in session:
-        return redirect(url_for("index"))
     return render_template("glucose_input.html", patient_id=patient_id)
 
 @app.route("/api/register-patient", methods=["POST"])
+@requires_login()
 def register_patient():
-    if "user_id" not in session:
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-
     data = request.json
     patient_id = f"ARCH-{datetime.now().strftime('%Y%m%d')}-{secrets.token_hex(3).upper()}"
 
@@ -223,41 +140,43 @@ def register_patient():
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO patients (patient_id, full_name, age, gender, village, district, phone, 
-                                  emergency_contact, diabetes_type, diagnosis_date, registered_by)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                                  emergency_contact, diabetes_type, diagnosis_date, registered_by,
+                                  search_name)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             RETURNING id, patient_id
         """, (patient_id, data.get("full_name"), data.get("age"), data.get("gender"),
               data.get("village"), data.get("district"), data.get("phone"),
               data.get("emergency_contact"), data.get("diabetes_type"),
-              data.get("diagnosis_date"), session["user_id"]))
+              data.get("diagnosis_date"), g.user["id"],
+              normalize_name(data.get("full_name"))))
         result = cur.fetchone()
         conn.commit()
         cur.close()
 
+    invalidate("admin")
     return jsonify({"success": True, "patient": result})
 
 @app.route("/api/search-patients")
+@requires_login()
 def search_patients():
-    if "user_id" not in session:
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-
     query = request.args.get("q", "")
+    scope = request.args.get("scope", "all")
+    if scope not in ("all", "district", "mine"):
+        return jsonify({"success": False, "message": "Invalid scope"}), 400
     with get_db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT id, patient_id, full_name, age, gender, village, phone
-            FROM patients
-            WHERE full_name ILIKE %s OR patient_id ILIKE %s
-            LIMIT 20
-        """, (f"%{query}%", f"%{query}%"))
-        patients = cur.fetchall()
+        patients, next_cursor = run_patient_search(
+            cur, query, g.user["id"], scope=scope,
+            district=request.args.get("district"),
+            cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", 20, type=int))
         cur.close()
-    return jsonify({"patients": patients})
+    return jsonify({"patients": patients, "next_cursor": next_cursor})
 
 @app.route("/api/patient/<int:patient_id>")
+@requires_login()
+@cached_response(tags=lambda patient_id: [f"patient:{patient_id}"])
 def get_patient(patient_id):
-    if "user_id" not in session:
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
     with get_db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM patients WHERE id = %s", (patient_id,))
@@ -267,187 +186,155 @@ def get_patient(patient_id):
 
 # -------------------- Glucose Reading -------------------- #
 @app.route("/api/glucose-reading", methods=["POST"])
+@requires_login()
 def add_glucose_reading():
-    if "user_id" not in session:
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-
     data = request.json
     with get_db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO glucose_readings (patient_id, chv_id, glucose_level, medication_taken,
-                                          diet_description, stress_level, food_availability, symptoms, notes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (data.get("patient_id"), session["user_id"], data.get("glucose_level"),
-              data.get("medication_taken"), data.get("diet_description"),
-              data.get("stress_level"), data.get("food_availability"),
-              data.get("symptoms"), data.get("notes")))
-        reading = cur.fetchone()
-        reading_id = reading["id"]
-
-        risk_data = generate_risk_assessment(data.get("patient_id"), data.get("glucose_level"),
-                                             data.get("medication_taken"), data.get("stress_level"),
-                                             data.get("symptoms"), cur)
-
-        cur.execute("""
-            INSERT INTO risk_assessments (reading_id, patient_id, risk_level, risk_score,
-                                          ai_advice, warning_flags, referral_recommended)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (reading_id, data.get("patient_id"), risk_data["risk_level"],
-              risk_data["risk_score"], risk_data["advice"],
-              json.dumps(risk_data["warnings"]), risk_data["referral_needed"]))
+        cur.execute(INSERT_READING_SQL, reading_params(data, g.user["id"]))
+        reading_id = cur.fetchone()["id"]
+
+        cur.execute(RECORD_FEATURES_SQL, features_params(data))
+        risk_data = assess_reading(data, cur.fetchall())
+
+        advice_status = "pending" if ai_advice_enabled() else "default"
+        if advice_status == "pending":
+            cached = cached_ai_advice(data.get("glucose_level"), data.get("medication_taken"),
+                                      data.get("stress_level"), data.get("symptoms"),
+                                      risk_data["risk_level"], cur)
+            if cached is not None:
+                risk_data["advice"] = cached
+                advice_status = "ready"
+        cur.execute(INSERT_ASSESSMENT_SQL, assessment_params(reading_id, data, risk_data, advice_status))
         assessment = cur.fetchone()
 
         if risk_data["risk_level"] == "High":
-            cur.execute("""
-                INSERT INTO alerts (patient_id, risk_assessment_id, alert_type, message)
-                VALUES (%s, %s, %s, %s)
-            """, (data.get("patient_id"), assessment["id"], "high_risk",
-                  f"High-risk patient detected. Glucose: {data.get('glucose_level')} mg/dL"))
+            cur.execute(ENQUEUE_ALERT_SQL, alert_params(data, assessment["id"], g.user["id"]))
+
+        record_reading(cur, g.user["id"], data.get("patient_id"), risk_data["risk_level"])
 
         conn.commit()
+
+        if advice_status == "pending" and not enqueue_ai_advice(
+                assessment["id"], float(data.get("glucose_level")), data.get("medication_taken"),
+                data.get("stress_level"), data.get("symptoms"), risk_data["risk_level"]):
+            advice_status = "default"
+            cur.execute(SET_ADVICE_STATUS_SQL, (advice_status, assessment["id"]))
+            conn.commit()
         cur.close()
 
+    invalidate(*invalidation_tags(data, g.user["id"]))
+    risk_data["assessment_id"] = assessment["id"]
+    risk_data["advice_status"] = advice_status
     return jsonify({"success": True, "risk_assessment": risk_data})
 
-# -------------------- Risk Assessment -------------------- #
-def generate_risk_assessment(patient_id, glucose_level, medication_taken, stress_level, symptoms, cur):
-    glucose = float(glucose_level)
-    risk_score = 0
-    warnings = []
-
-    if glucose < 70:
-        risk_score += 40
-        warnings.append("Hypoglycemia detected")
-    elif glucose > 250:
-        risk_score += 50
-        warnings.append("Severe hyperglycemia")
-    elif glucose > 180:
-        risk_score += 30
-        warnings.append("Hyperglycemia detected")
-
-    if not medication_taken:
-        risk_score += 20
-        warnings.append("Medication not taken")
-
-    if stress_level in ["High", "Very High"]:
-        risk_score += 15
-
-    cur.execute("""
-        SELECT glucose_level, reading_time
-        FROM glucose_readings
-        WHERE patient_id = %s
-        ORDER BY reading_time DESC
-        LIMIT 5
-    """, (patient_id,))
-    recent_readings = cur.fetchall()
-    if len(recent_readings) >= 3:
-        high_count = sum(1 for r in recent_readings if r["glucose_level"] > 180)
-        if high_count >= 3:
-            risk_score += 25
-            warnings.append("Consistently high readings")
-
-    if risk_score >= 70:
-        risk_level = "High"
-        referral_needed = True
-    elif risk_score >= 40:
-        risk_level = "Medium"
-        referral_needed = False
-    else:
-        risk_level = "Low"
-        referral_needed = False
-
-    if os.environ.get("OPENAI_API_KEY"):
-        try:
-            advice = generate_ai_advice(glucose, medication_taken, stress_level, symptoms, risk_level)
-        except:
-            advice = get_default_advice(glucose, risk_level)
-    else:
-        advice = get_default_advice(glucose, risk_level)
-
-    return {
-        "risk_level": risk_level,
-        "risk_score": risk_score,
-        "advice": advice,
-        "warnings": warnings,
-        "referral_needed": referral_needed
-    }
+@app.route("/api/glucose-readings/batch", methods=["POST"])
+@requires_login()
+def sync_glucose_readings():
+    data = request.json or {}
+    readings = data.get("readings")
+    if not isinstance(readings, list):
+        return jsonify({"success": False, "message": "readings must be a list"}), 400
+    if len(readings) > SYNC_MAX_BATCH:
+        return jsonify({"success": False, "message": f"At most {SYNC_MAX_BATCH} readings per batch"}), 413
+
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        results = ingest_readings(cur, g.user["id"], readings)
+        conn.commit()
+        cur.close()
 
-def generate_ai_advice(glucose, medication_taken, stress_level, symptoms, risk_level):
-    if not openai_client:
-        return get_default_advice(glucose, risk_level)
-
-    prompt = f"""
-You are a healthcare AI assistant for rural diabetes management in Cameroon. Provide personalized advice.
-
-Patient Data:
-- Glucose Level: {glucose} mg/dL
-- Medication Taken: {'Yes' if medication_taken else 'No'}
-- Stress Level: {stress_level}
-- Symptoms: {symptoms}
-- Risk Level: {risk_level}
-
-Provide:
-1. Immediate actions (1-2 sentences)
-2. Dietary recommendations using local foods (fufu, yam, beans, plantain, etc.)
-3. Lifestyle advice
-4. When to seek urgent care
-
-Keep advice practical, culturally relevant, and concise.
-"""
-
-    response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=300
-    )
-
-    return response.choices[0].message.content
-
-def get_default_advice(glucose, risk_level):
-    if glucose < 70:
-        return "⚠️ Low blood sugar detected. Take 15g fast-acting carbs. Rest 15 min and retest. Seek medical care if symptoms persist."
-    elif glucose > 250:
-        return "🚨 Very high blood sugar. Drink water, take meds, avoid heavy meals. Seek medical care if very unwell."
-    elif glucose > 180:
-        return "📊 Blood sugar high. Reduce portions, choose boiled yam/beans. Walk 20 min. Take meds as prescribed."
-    else:
-        return "✅ Good reading. Maintain diet, meds, and physical activity."
+    created = [r for r in results if r["status"] == "created"]
+    if created:
+        invalidate(*{f"patient:{r['patient_id']}" for r in created}, f"chv:{g.user['id']}", "admin")
+
+    return jsonify({"success": True, "results": results})
+
+@app.route("/api/risk-assessment/<int:assessment_id>/advice")
+@requires_login()
+def get_risk_advice(assessment_id):
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT ai_advice, advice_status FROM risk_assessments WHERE id = %s",
+                    (assessment_id,))
+        row = cur.fetchone()
+        cur.close()
+    if not row:
+        return jsonify({"success": False, "message": "Not found"}), 404
+    return jsonify({"success": True, "status": row["advice_status"], "advice": row["ai_advice"]})
 
 # -------------------- Stats Endpoints -------------------- #
 @app.route('/api/patient/<int:patient_id>/readings')
+@requires_login()
+@cached_response(tags=lambda patient_id: [f"patient:{patient_id}"])
 def get_patient_readings(patient_id):
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-
     # Get 'days' parameter from query string, default 30
     days = request.args.get('days', 30, type=int)
 
+    limit = request.args.get('limit', READINGS_PAGE_SIZE, type=int)
+    # ?fields=glucose_level,risk_level narrows each reading; ?format=columns
+    # sends one array per field instead of one object per reading.
     try:
-        # Use psycopg v3 with dict_row for dict-like rows
-        with psycopg.connect(DATABASE_URL, row_factory=psycopg.rows.dict_row) as conn:
-            with conn.cursor() as cur:
-                cur.execute('''
-                    SELECT gr.*, ra.risk_level, ra.risk_score, ra.ai_advice
-                    FROM glucose_readings gr
-                    LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id
-                    WHERE gr.patient_id = %s
-                      AND gr.reading_time >= NOW() - %s * INTERVAL '1 day'
-                    ORDER BY gr.reading_time DESC
-                ''', (patient_id, days))
+        fields = parse_fields(request.args.get('fields'), READING_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    layout = request.args.get('format', 'rows')
+    if layout not in ('rows', 'columns'):
+        return jsonify({'success': False, 'message': 'format must be rows or columns'}), 400
 
-                readings = cur.fetchall()
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                readings, next_cursor = fetch_readings_page(cur, patient_id, days, limit,
+                                                            request.args.get('cursor'), fields)
 
-        return jsonify({'success': True, 'readings': readings})
+        if layout == 'columns':
+            readings = columnar(readings, reading_columns(fields))
+        return jsonify({'success': True, 'readings': readings, 'next_cursor': next_cursor})
 
     except Exception as e:
         # Catch errors and return JSON
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/patient/<int:patient_id>/readings/series')
+@requires_login()
+@cached_response(tags=lambda patient_id: [f"patient:{patient_id}"])
+def get_patient_reading_series(patient_id):
+    days = request.args.get('days', 30, type=int)
+    method = request.args.get('method', 'lttb')
+    bucket = request.args.get('bucket', 'auto')
+    layout = request.args.get('format', 'rows')
+    if method not in ('lttb', 'buckets') or bucket not in BUCKET_UNITS or layout not in ('rows', 'columns'):
+        return jsonify({'success': False, 'message': 'Invalid method, bucket or format'}), 400
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            summary, series = fetch_series(cur, patient_id, days, method,
+                                           request.args.get('points', SERIES_DEFAULT_POINTS, type=int),
+                                           bucket)
+
+    if layout == 'columns':
+        series = columnar(series, ["t", "glucose"] if method == "lttb" else ["t", "n", "min", "mean", "max"])
+    return jsonify({'success': True, 'summary': summary, 'series': series})
+
+@app.route('/api/patient/<int:patient_id>/features')
+@requires_login()
+@cached_response(tags=lambda patient_id: [f"patient:{patient_id}"])
+def get_patient_features(patient_id):
+    # Precomputed trend features; ?windows=7,30,90 (days) picks the windows.
+    try:
+        windows = sorted({int(w) for w in request.args.get('windows', '').split(',') if w.strip()}) \
+            or list(FEATURE_WINDOWS)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid windows'}), 400
+    if len(windows) > 5 or not all(1 <= w <= FEATURE_MAX_DAYS for w in windows):
+        return jsonify({'success': False, 'message': f'Up to 5 windows of 1-{FEATURE_MAX_DAYS} days'}), 400
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            features = fetch_features(cur, patient_id, windows)
 
+    return jsonify({'success': True, 'features': features})
 
 
 
@@ -457,78 +344,121 @@ def get_patient_readings(patient_id):
 
 
 
+
+
+CHV_STATS_FIELDS = ("total_patients", "tests_today", "high_risk_count", "escalated_count", "high_risk_patients")
+
 @app.route("/api/chv/stats")
+@requires_login("chv")
+@cached_response(tags=lambda: [f"chv:{g.user['id']}", "alerts"], vary_user=True)
 def chv_stats():
-    if "user_id" not in session or session.get("role") != "chv":
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
+    # ?fields=total_patients,tests_today returns only those counts and skips
+    # the high-risk list query when it is not asked for.
+    try:
+        fields = parse_fields(request.args.get("fields"), CHV_STATS_FIELDS) or CHV_STATS_FIELDS
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
+    high_risk_patients = []
     with get_db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(DISTINCT patient_id) as total_patients FROM glucose_readings WHERE chv_id = %s", (session["user_id"],))
-        stats = cur.fetchone()
-        cur.execute("SELECT COUNT(*) as tests_today FROM glucose_readings WHERE chv_id = %s AND DATE(reading_time) = CURRENT_DATE", (session["user_id"],))
-        today = cur.fetchone()
         cur.execute("""
-            SELECT COUNT(DISTINCT a.patient_id) as high_risk_count
-            FROM alerts a
-            JOIN glucose_readings gr ON gr.patient_id = a.patient_id
-            WHERE gr.chv_id = %s AND a.status = 'pending'
-            AND a.created_at >= NOW() - INTERVAL '7 days'
-        """, (session["user_id"],))
-        alerts = cur.fetchone()
-        cur.execute("""
-            SELECT p.id, p.patient_id, p.full_name, p.village, ra.risk_level,
-                   gr.glucose_level, gr.reading_time
-            FROM patients p
-            JOIN glucose_readings gr ON gr.patient_id = p.id
-            JOIN risk_assessments ra ON ra.reading_id = gr.id
-            WHERE gr.chv_id = %s AND ra.risk_level = 'High'
-            AND gr.reading_time >= NOW() - INTERVAL '7 days'
-            ORDER BY gr.reading_time DESC
-            LIMIT 10
-        """, (session["user_id"],))
-        high_risk_patients = cur.fetchall()
+            SELECT ct.patient_count as total_patients, dcs.reading_count as tests_today,
+                   coa.open_count as high_risk_count, coa.escalated_count
+            FROM (SELECT %s::int AS chv_id) me
+            LEFT JOIN chv_totals ct ON ct.chv_id = me.chv_id
+            LEFT JOIN daily_chv_stats dcs ON dcs.chv_id = me.chv_id AND dcs.day = CURRENT_DATE
+            LEFT JOIN chv_open_alerts coa ON coa.chv_id = me.chv_id
+        """, (g.user["id"],))
+        stats = cur.fetchone()
+        if "high_risk_patients" in fields:
+            cur.execute("""
+                SELECT p.id, p.patient_id, p.full_name, p.village, ra.risk_level,
+                       gr.glucose_level, gr.reading_time
+                FROM patients p
+                JOIN glucose_readings gr ON gr.patient_id = p.id
+                JOIN risk_assessments ra ON ra.reading_id = gr.id AND ra.created_at >= gr.reading_time
+                WHERE gr.chv_id = %s AND ra.risk_level = 'High'
+                AND gr.reading_time >= NOW() - INTERVAL '7 days'
+                ORDER BY gr.reading_time DESC
+                LIMIT 10
+            """, (g.user["id"],))
+            high_risk_patients = cur.fetchall()
         cur.close()
 
-    return jsonify({
+    response = {
         "total_patients": stats["total_patients"] or 0,
-        "tests_today": today["tests_today"] or 0,
-        "high_risk_count": alerts["high_risk_count"] or 0,
+        "tests_today": stats["tests_today"] or 0,
+        "high_risk_count": stats["high_risk_count"] or 0,
+        "escalated_count": stats["escalated_count"] or 0,
         "high_risk_patients": high_risk_patients
-    })
+    }
+    return jsonify({field: response[field] for field in fields})
+
+@app.route("/api/alerts/stream")
+@requires_login("chv", "admin")
+def stream_alerts():
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({"success": False, "message": "Too many open alert streams, please retry"}), 503
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+    response = Response(alert_stream(g.user["role"], g.user["id"], last_event_id),
+                        mimetype="text/event-stream")
+    response.call_on_close(stream_slots.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/api/alerts/<int:alert_id>/resolve", methods=["POST"])
+@requires_login("chv", "admin")
+def resolve_patient_alert(alert_id):
+    # CHVs can resolve alerts for patients they have taken readings for.
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        resolved = resolve_alert(cur, alert_id, None if g.user["role"] == "admin" else g.user["id"])
+        conn.commit()
+        cur.close()
+    if resolved is None:
+        return jsonify({"success": False, "message": "No open alert found"}), 404
+
+    invalidate("alerts", "admin")
+    return jsonify({"success": True, "alert_id": resolved["id"]})
 
 @app.route("/api/admin/stats")
+@requires_login("admin")
+@cached_response(tags=lambda: ["admin"])
 def admin_stats():
-    if "user_id" not in session or session.get("role") != "admin":
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-
     with get_db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT COUNT(*) as total_patients FROM patients")
         patients = cur.fetchone()
         cur.execute("SELECT COUNT(*) as total_chvs FROM users WHERE role = %s", ("chv",))
         chvs = cur.fetchone()
-        cur.execute("SELECT COUNT(*) as total_readings FROM glucose_readings WHERE reading_time >= NOW() - INTERVAL '30 days'")
+        cur.execute("""
+            SELECT COALESCE(SUM(reading_count), 0) as total_readings,
+                   COALESCE(SUM(high_count), 0) as high, COALESCE(SUM(medium_count), 0) as medium,
+                   COALESCE(SUM(low_count), 0) as low
+            FROM daily_chv_stats
+            WHERE day >= CURRENT_DATE - 30
+        """)
         readings = cur.fetchone()
-        cur.execute("SELECT COUNT(*) as active_alerts FROM alerts WHERE status = 'pending'")
+        cur.execute("""
+            SELECT COUNT(*) as active_alerts, COUNT(*) FILTER (WHERE status = 'escalated') as escalated_alerts
+            FROM alerts
+            WHERE status IN ('pending', 'escalated')
+        """)
         alerts = cur.fetchone()
         cur.execute("""
-            SELECT u.full_name, u.district, COUNT(DISTINCT gr.patient_id) as patient_count,
-                   COUNT(gr.id) as reading_count
+            SELECT u.full_name, u.district, COALESCE(ct.patient_count, 0) as patient_count,
+                   COALESCE(ct.reading_count, 0) as reading_count
             FROM users u
-            LEFT JOIN glucose_readings gr ON gr.chv_id = u.id
+            LEFT JOIN chv_totals ct ON ct.chv_id = u.id
             WHERE u.role = 'chv'
-            GROUP BY u.id, u.full_name, u.district
             ORDER BY reading_count DESC
         """)
         chv_performance = cur.fetchall()
-        cur.execute("""
-            SELECT ra.risk_level, COUNT(*) as count
-            FROM risk_assessments ra
-            WHERE ra.created_at >= NOW() - INTERVAL '30 days'
-            GROUP BY ra.risk_level
-        """)
-        risk_distribution = cur.fetchall()
+        risk_distribution = [{"risk_level": level, "count": readings[key]}
+                             for level, key in (("High", "high"), ("Medium", "medium"), ("Low", "low"))
+                             if readings[key]]
         cur.close()
 
     return jsonify({
@@ -536,12 +466,104 @@ def admin_stats():
         "total_chvs": chvs["total_chvs"],
         "total_readings": readings["total_readings"],
         "active_alerts": alerts["active_alerts"],
+        "escalated_alerts": alerts["escalated_alerts"],
         "chv_performance": chv_performance,
         "risk_distribution": risk_distribution
     })
 
-# -------------------- Initialize DB -------------------- #
-init_db()
+@app.route("/api/admin/analytics/regions")
+@requires_login("admin")
+@cached_response(tags=lambda: ["geo"])
+def regional_analytics():
+    # District time series from the geo_stats view; ?district= drills down
+    # to its villages and &village= to one village.
+    try:
+        filters = parse_geo_filters(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            analytics = fetch_geo_series(cur, filters)
+
+    return jsonify({"success": True, **analytics})
+
+@app.route("/api/admin/export/readings.<fmt>")
+@requires_login("admin")
+def export_readings(fmt):
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": "Unsupported format"}), 404
+    if fmt == "parquet" and not parquet_available():
+        return jsonify({"success": False, "message": "Parquet export requires pyarrow"}), 501
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid filter"}), 400
+
+    if not export_slots.acquire(blocking=False):
+        return jsonify({"success": False, "message": "Too many exports running, please retry"}), 429
+    response = Response(stream_with_context(export_stream(fmt, filters)), mimetype=EXPORT_FORMATS[fmt])
+    response.call_on_close(export_slots.release)
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=arch-readings-{datetime.now().strftime('%Y%m%d')}.{fmt}")
+    return response
+
+@app.route("/api/admin/db-pool")
+@requires_login("admin")
+def db_pool_metrics():
+    return jsonify({"success": True, "pool": pool_stats()})
+
+@app.route("/api/admin/advice-cache")
+@requires_login("admin")
+def advice_cache_metrics():
+    return jsonify({"success": True, "cache": cache_stats()})
+
+@app.route("/api/admin/response-cache")
+@requires_login("admin")
+def response_cache_metrics():
+    return jsonify({"success": True, "cache": response_cache_stats()})
+
+@app.route("/api/admin/query-stats")
+@requires_login("admin")
+def query_stats():
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    return jsonify({"success": True, "statements": statement_stats(limit)})
+
+@app.route("/api/admin/auth")
+@requires_login("admin")
+def auth_metrics():
+    return jsonify({"success": True, "auth": auth_stats()})
+
+@app.route("/api/admin/users/<int:user_id>/revoke-sessions", methods=["POST"])
+@requires_login("admin")
+def revoke_user_sessions(user_id):
+    if not revoke_sessions(user_id):
+        return jsonify({"success": False, "message": "Not found"}), 404
+    return jsonify({"success": True})
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if not metrics_authorized(current_user):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    pool = pool_stats()
+    responses = response_cache_stats()
+    gauges = [
+        ("arch_db_pool_size", "Open connections in this worker's pool.", pool.get("size", 0)),
+        ("arch_db_pool_in_use", "Pooled connections checked out.", pool.get("in_use", 0)),
+        ("arch_db_pool_waiting", "Requests waiting for a connection.", pool.get("requests_waiting", 0)),
+        ("arch_db_pool_timeouts", "Connection requests that timed out.", pool.get("timeouts", 0)),
+        ("arch_response_cache_hits", "Response cache hits.", responses["hits"]),
+        ("arch_response_cache_misses", "Response cache misses.", responses["misses"]),
+    ]
+    return Response(render_metrics(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({"success": False, "message": "Database busy, please retry"}), 503
 
 if __name__ == "__main__":
+    # Development server: initialize and process alerts in-process for
+    # convenience.
+    init_db()
+    start_alert_worker()
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
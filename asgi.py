@@ -0,0 +1,335 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+import psycopg
+from psycopg_pool import PoolTimeout
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app
+from advice import (ADVICE_QUEUE_SIZE, ADVICE_RETRIES, ADVICE_RETRY_BACKOFF, advice_update,
+                    ai_advice_enabled, cached_ai_advice, generate_ai_advice_async)
+from auth import session_principal
+from alert_stream import (ALERT_CHANNEL, ALERT_STREAM_HEARTBEAT, ALERT_STREAM_MAX_SECONDS,
+                          ALERT_STREAM_QUEUE_SIZE, LATEST_EVENT_ID_SQL, RECONNECT_BACKOFF, decode_events,
+                          scope_events, sse_event, sse_item)
+from cache import invalidate
+from db import DATABASE_URL, close_async_pool, get_async_db_connection, open_async_pool
+from features import RECORD_FEATURES_SQL, features_params
+from metrics import http_requests, track
+from readings import (ENQUEUE_ALERT_SQL, INSERT_ASSESSMENT_SQL, INSERT_READING_SQL,
+                      SET_ADVICE_STATUS_SQL, alert_params, assess_reading, assessment_params,
+                      invalidation_tags, reading_params)
+from rollups import reading_rollup_statements
+
+# Async serving mode:
+#   gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+# The reading submission, advice polling and alert stream routes run on the
+# event loop with an async connection pool and OpenAI client, so a slow
+# OpenAI call or query no longer pins a thread. Every other route and page
+# is the unchanged Flask app, mounted below them and run in a thread pool.
+WSGI_THREADS = 16
+
+
+# -------------------- Session and instrumentation -------------------- #
+_session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+
+
+def flask_session(request):
+    # Reads the signed cookie Flask set at login, so both halves of the app
+    # share one session.
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie or _session_serializer is None:
+        return {}
+    try:
+        return _session_serializer.loads(
+            cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+async def authorized_user(request, *roles):
+    # The live principal behind the Flask session if it has one of roles
+    # (any role when none are given), else None. The principal lookup is the
+    # same cached one the Flask routes use; a miss queries the database, so
+    # it runs in a thread.
+    session = flask_session(request)
+    if "user_id" not in session:
+        return None
+    principal = await asyncio.to_thread(session_principal, session)
+    if principal is None or (roles and principal["role"] not in roles):
+        return None
+    return principal
+
+
+def _unauthorized():
+    return JSONResponse({"success": False, "message": "Unauthorized"}, status_code=401)
+
+
+def instrumented(route):
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            start = time.perf_counter()
+            with track(route):
+                response = await handler(request)
+            http_requests.observe(time.perf_counter() - start, request.method, route,
+                                  str(response.status_code))
+            return response
+        return wrapper
+    return decorator
+
+
+# -------------------- Background advice tasks -------------------- #
+# The asyncio counterpart of advice.py's thread pool: jobs are tasks on the
+# loop, bounded by the same AI_ADVICE_QUEUE_SIZE. Waiting on OpenAI costs
+# no thread, so every queued job runs at once.
+_advice_tasks = set()
+
+
+def enqueue_ai_advice_async(assessment_id, glucose, medication_taken, stress_level, symptoms, risk_level):
+    if not ai_advice_enabled() or len(_advice_tasks) >= ADVICE_QUEUE_SIZE:
+        return False
+    task = asyncio.create_task(_advice_task(assessment_id, glucose, medication_taken,
+                                            stress_level, symptoms, risk_level))
+    _advice_tasks.add(task)
+    task.add_done_callback(_advice_tasks.discard)
+    return True
+
+
+async def _advice_task(assessment_id, glucose, medication_taken, stress_level, symptoms, risk_level):
+    try:
+        with track("job:advice"):
+            advice = None
+            for attempt in range(ADVICE_RETRIES + 1):
+                try:
+                    advice = await generate_ai_advice_async(glucose, medication_taken, stress_level,
+                                                            symptoms, risk_level)
+                    break
+                except Exception as e:
+                    print(f"AI advice attempt {attempt + 1} failed for assessment {assessment_id}: {e}")
+                    if attempt < ADVICE_RETRIES:
+                        await asyncio.sleep(ADVICE_RETRY_BACKOFF * (2 ** attempt))
+            async with get_async_db_connection() as conn:
+                cur = conn.cursor()
+                await cur.execute(*advice_update(assessment_id, advice, "ready" if advice else "failed"))
+                row = await cur.fetchone()
+                await conn.commit()
+        if row and advice:
+            await asyncio.to_thread(invalidate, f"patient:{row['patient_id']}")
+    except Exception as e:
+        print(f"AI advice job error for assessment {assessment_id}: {e}")
+
+
+# -------------------- Alert stream -------------------- #
+_CLOSE = object()
+
+
+class AsyncAlertBroker:
+    # Event-loop version of alert_stream.AlertBroker: one LISTEN connection
+    # per process, fanned out to asyncio queues.
+    def __init__(self):
+        self.subscribers = {}
+        self.task = None
+
+    def subscribe(self, role, user_id):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._listen())
+        q = asyncio.Queue(ALERT_STREAM_QUEUE_SIZE)
+        self.subscribers[q] = (role, user_id)
+        return q
+
+    def unsubscribe(self, q):
+        self.subscribers.pop(q, None)
+
+    def _put(self, q, item):
+        try:
+            q.put_nowait(item)
+        except asyncio.QueueFull:
+            # A stalled client is dropped; it resyncs on reconnect.
+            self.unsubscribe(q)
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait(_CLOSE)
+
+    async def _listen(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {ALERT_CHANNEL}")
+                    async for notify in conn.notifies():
+                        try:
+                            events = decode_events(notify.payload)
+                            if events:
+                                for q, (role, user_id) in list(self.subscribers.items()):
+                                    for item in scope_events(events, role, user_id):
+                                        self._put(q, item)
+                        except (ValueError, KeyError) as e:
+                            print(f"Alert stream warning, bad payload: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Alert listener error, reconnecting: {e}")
+                for q in list(self.subscribers):
+                    self._put(q, {"resync": True})
+                await asyncio.sleep(RECONNECT_BACKOFF)
+
+    async def stop(self):
+        for q in list(self.subscribers):
+            self._put(q, _CLOSE)
+        self.subscribers.clear()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+broker = AsyncAlertBroker()
+
+
+async def _latest_event_id():
+    async with get_async_db_connection() as conn:
+        cur = conn.cursor()
+        await cur.execute(LATEST_EVENT_ID_SQL)
+        return (await cur.fetchone())["last_id"]
+
+
+async def _alert_events(role, user_id, last_event_id):
+    q = broker.subscribe(role, user_id)
+    try:
+        last_id = await _latest_event_id()
+        yield b"retry: 3000\n\n"
+        yield sse_event("ready", {"last_event_id": last_id}, last_id)
+        if last_event_id is not None and last_event_id != last_id:
+            yield sse_event("resync", {})
+
+        deadline = time.monotonic() + ALERT_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                item = await asyncio.wait_for(q.get(), ALERT_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if item is _CLOSE:
+                break
+            if item.get("resync"):
+                yield sse_event("resync", {}, await _latest_event_id())
+            else:
+                yield sse_item(item)
+    finally:
+        broker.unsubscribe(q)
+
+
+# -------------------- Routes -------------------- #
+@instrumented("/api/glucose-reading")
+async def add_glucose_reading(request):
+    user = await authorized_user(request)
+    if user is None:
+        return _unauthorized()
+
+    data = await request.json()
+    async with get_async_db_connection() as conn:
+        cur = conn.cursor()
+        await cur.execute(INSERT_READING_SQL, reading_params(data, user["id"]))
+        reading_id = (await cur.fetchone())["id"]
+
+        await cur.execute(RECORD_FEATURES_SQL, features_params(data))
+        risk_data = assess_reading(data, await cur.fetchall())
+
+        advice_status = "pending" if ai_advice_enabled() else "default"
+        if advice_status == "pending":
+            cached = await asyncio.to_thread(cached_ai_advice, data.get("glucose_level"),
+                                             data.get("medication_taken"), data.get("stress_level"),
+                                             data.get("symptoms"), risk_data["risk_level"])
+            if cached is not None:
+                risk_data["advice"] = cached
+                advice_status = "ready"
+        await cur.execute(INSERT_ASSESSMENT_SQL, assessment_params(reading_id, data, risk_data, advice_status))
+        assessment = await cur.fetchone()
+
+        if risk_data["risk_level"] == "High":
+            await cur.execute(ENQUEUE_ALERT_SQL, alert_params(data, assessment["id"], user["id"]))
+
+        for statement, params in reading_rollup_statements(user["id"], data.get("patient_id"),
+                                                           risk_data["risk_level"]):
+            await cur.execute(statement, params)
+
+        await conn.commit()
+
+        if advice_status == "pending" and not enqueue_ai_advice_async(
+                assessment["id"], float(data.get("glucose_level")), data.get("medication_taken"),
+                data.get("stress_level"), data.get("symptoms"), risk_data["risk_level"]):
+            advice_status = "default"
+            await cur.execute(SET_ADVICE_STATUS_SQL, (advice_status, assessment["id"]))
+            await conn.commit()
+
+    await asyncio.to_thread(invalidate, *invalidation_tags(data, user["id"]))
+    risk_data["assessment_id"] = assessment["id"]
+    risk_data["advice_status"] = advice_status
+    return JSONResponse({"success": True, "risk_assessment": risk_data})
+
+
+@instrumented("/api/risk-assessment/<int:assessment_id>/advice")
+async def get_risk_advice(request):
+    if await authorized_user(request) is None:
+        return _unauthorized()
+    async with get_async_db_connection() as conn:
+        cur = conn.cursor()
+        await cur.execute("SELECT ai_advice, advice_status FROM risk_assessments WHERE id = %s",
+                          (request.path_params["assessment_id"],))
+        row = await cur.fetchone()
+    if not row:
+        return JSONResponse({"success": False, "message": "Not found"}, status_code=404)
+    return JSONResponse({"success": True, "status": row["advice_status"], "advice": row["ai_advice"]})
+
+
+async def stream_alerts(request):
+    user = await authorized_user(request, "chv", "admin")
+    if user is None:
+        return _unauthorized()
+    try:
+        last_event_id = int(request.headers["last-event-id"])
+    except (KeyError, ValueError):
+        last_event_id = None
+    return StreamingResponse(_alert_events(user["role"], user["id"], last_event_id),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def handle_pool_timeout(request, exc):
+    return JSONResponse({"success": False, "message": "Database busy, please retry"}, status_code=503)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await open_async_pool()
+    try:
+        yield
+    finally:
+        await broker.stop()
+        if _advice_tasks:
+            await asyncio.wait(set(_advice_tasks), timeout=30)
+        await close_async_pool()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/glucose-reading", add_glucose_reading, methods=["POST"]),
+        Route("/api/risk-assessment/{assessment_id:int}/advice", get_risk_advice),
+        Route("/api/alerts/stream", stream_alerts),
+        Mount("/", WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    exception_handlers={PoolTimeout: handle_pool_timeout},
+    lifespan=lifespan,
+)
@@ -0,0 +1,219 @@
+import os
+import time
+import secrets
+import threading
+from collections import OrderedDict
+from functools import lru_cache, wraps
+
+from flask import g, jsonify, redirect, session, url_for
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import backend as cache_backend, invalidate
+from db import get_db_connection
+
+# Hash for new and upgraded passwords, in werkzeug's "method:params" form.
+# Stored hashes using anything else are re-hashed at the next login, so the
+# cost can be raised or lowered without a password reset.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+AUTH_PRINCIPAL_TTL = float(os.environ.get("AUTH_PRINCIPAL_TTL", 30))
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.environ.get("AUTH_PRINCIPAL_CACHE_SIZE", 4096))
+SESSION_SECRET_FILE = os.environ.get("SESSION_SECRET_FILE")
+
+PRINCIPAL_COLUMNS = "id, username, full_name, role, district, session_version, is_active"
+
+
+# -------------------- Signing key -------------------- #
+def load_secret_key(instance_path):
+    # SESSION_SECRET wins. Otherwise the first worker to start writes a
+    # random key to a file the others read, so every worker on the host
+    # signs sessions with the same key and it survives restarts. Hosts
+    # behind one load balancer must share SESSION_SECRET.
+    secret = os.environ.get("SESSION_SECRET")
+    if secret:
+        return secret
+    path = SESSION_SECRET_FILE or os.path.join(instance_path, "session_secret")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    # A worker racing the creator can briefly see an empty file.
+    for _ in range(100):
+        with open(path) as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+        time.sleep(0.01)
+    raise RuntimeError(f"Session secret file {path} is empty")
+
+
+# -------------------- Passwords -------------------- #
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+@lru_cache(maxsize=None)
+def _configured_prefix():
+    # werkzeug fills in defaults ("pbkdf2:sha256" becomes
+    # "pbkdf2:sha256:1000000"), so compare against a real hash's prefix.
+    return hash_password("").split("$", 1)[0]
+
+
+@lru_cache(maxsize=None)
+def _dummy_hash():
+    return hash_password(secrets.token_hex(16))
+
+
+def needs_rehash(password_hash):
+    prefix = password_hash.split("$", 1)[0]
+    return prefix != PASSWORD_HASH_METHOD and prefix != _configured_prefix()
+
+
+def authenticate(username, password):
+    # Returns the user row, or None. Unknown and disabled users still pay
+    # for one hash check so response time does not reveal valid usernames.
+    password = password or ""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {PRINCIPAL_COLUMNS}, password_hash FROM users WHERE username = %s", (username,))
+        user = cur.fetchone()
+        if user is None or not user["is_active"]:
+            check_password_hash(_dummy_hash(), password)
+            cur.close()
+            return None
+        if not check_password_hash(user["password_hash"], password):
+            cur.close()
+            return None
+        if needs_rehash(user["password_hash"]):
+            cur.execute("UPDATE users SET password_hash = %s WHERE id = %s",
+                        (hash_password(password), user["id"]))
+            conn.commit()
+        cur.close()
+    principal = {k: v for k, v in user.items() if k != "password_hash"}
+    _remember(principal, _user_version(principal["id"]))
+    return principal
+
+
+def login_user(user):
+    session.clear()
+    session["user_id"] = user["id"]
+    session["username"] = user["username"]
+    session["full_name"] = user["full_name"]
+    session["role"] = user["role"]
+    session["session_version"] = user["session_version"]
+
+
+# -------------------- Principal cache -------------------- #
+# Every authenticated request needs the user's role and revocation state.
+# They are cached per worker for AUTH_PRINCIPAL_TTL and keyed by a
+# "user:<id>" version in the response cache backend, so a revocation
+# reaches every worker as soon as its invalidation does (see cache.py).
+_principals = OrderedDict()
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "revocations": 0}
+
+
+def _user_version(user_id):
+    try:
+        return cache_backend.tag_versions([f"user:{user_id}"])[0]
+    except Exception:
+        return None
+
+
+def _remember(principal, version):
+    with _lock:
+        _principals[principal["id"]] = (principal, version, time.monotonic() + AUTH_PRINCIPAL_TTL)
+        _principals.move_to_end(principal["id"])
+        while len(_principals) > AUTH_PRINCIPAL_CACHE_SIZE:
+            _principals.popitem(last=False)
+
+
+def _forget(user_id):
+    with _lock:
+        _principals.pop(user_id, None)
+
+
+def get_principal(user_id):
+    version = _user_version(user_id)
+    with _lock:
+        entry = _principals.get(user_id)
+        if entry is not None and entry[1] == version and time.monotonic() < entry[2]:
+            _counters["hits"] += 1
+            return entry[0]
+        _counters["misses"] += 1
+
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {PRINCIPAL_COLUMNS} FROM users WHERE id = %s", (user_id,))
+        principal = cur.fetchone()
+        cur.close()
+    if principal is None:
+        _forget(user_id)
+        return None
+    _remember(principal, version)
+    return principal
+
+
+def session_principal(data):
+    # The user behind a session mapping, or None if it was never logged in,
+    # the account is disabled, or its sessions were revoked since login.
+    user_id = data.get("user_id")
+    if user_id is None:
+        return None
+    principal = get_principal(user_id)
+    if (principal is None or not principal["is_active"]
+            or principal["session_version"] != data.get("session_version", 0)):
+        return None
+    return principal
+
+
+def current_user():
+    if "user" not in g:
+        g.user = session_principal(session)
+        if g.user is None and "user_id" in session:
+            session.clear()
+    return g.user
+
+
+def revoke_sessions(user_id):
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET session_version = session_version + 1 WHERE id = %s RETURNING id",
+                    (user_id,))
+        found = cur.fetchone() is not None
+        conn.commit()
+        cur.close()
+    _forget(user_id)
+    invalidate(f"user:{user_id}")
+    with _lock:
+        _counters["revocations"] += 1
+    return found
+
+
+def auth_stats():
+    with _lock:
+        stats = dict(_counters)
+        stats["cached_principals"] = len(_principals)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0
+    stats["password_hash_method"] = PASSWORD_HASH_METHOD
+    return stats
+
+
+# -------------------- Decorators -------------------- #
+def requires_login(*roles, page=False):
+    # API views answer 401 JSON; pages (page=True) redirect to the login page.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user = current_user()
+            if user is None or (roles and user["role"] not in roles):
+                if page:
+                    return redirect(url_for("index"))
+                return jsonify({"success": False, "message": "Unauthorized"}), 401
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,81 @@
+# Requests/sec on the login and authenticated API paths.
+#   python bench/auth_paths.py                 # hash methods only, no database
+#   DATABASE_URL=... python bench/auth_paths.py --app
+#
+# The first table is one core's login ceiling per hash method (one verify
+# per login). With --app, logins and a query-free admin API call go through
+# the Flask test client, the latter with the principal cache on and off.
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from werkzeug.security import check_password_hash, generate_password_hash  # noqa: E402
+
+import auth  # noqa: E402
+
+METHODS = ["scrypt:32768:8:1", "scrypt:16384:8:1", "pbkdf2:sha256:600000", "pbkdf2:sha256:100000"]
+
+
+def rate(fn, seconds):
+    fn()  # warm-up
+    n, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        n += 1
+    return n / (time.perf_counter() - start)
+
+
+def bench_hashes(methods, seconds):
+    print(f"{'method':<24} {'logins/s/core':>14} {'ms/login':>9}")
+    for method in methods:
+        stored = generate_password_hash("admin123", method=method)
+        per_sec = rate(lambda: check_password_hash(stored, "admin123"), seconds)
+        print(f"{method:<24} {per_sec:>14.1f} {1000 / per_sec:>9.1f}")
+
+
+def bench_app(args):
+    from app import app
+
+    client = app.test_client()
+    credentials = {"username": args.admin_user, "password": args.admin_password}
+
+    def login():
+        response = client.post("/login", json=credentials)
+        assert response.status_code == 200, response.status_code
+
+    def api():
+        response = client.get("/api/admin/auth")
+        assert response.status_code == 200, response.status_code
+
+    print(f"\nPASSWORD_HASH_METHOD={auth.PASSWORD_HASH_METHOD}")
+    print(f"login:                 {rate(login, args.seconds):8.1f} req/s")
+    login()
+    print(f"API, principal cached: {rate(api, args.seconds):8.1f} req/s")
+    ttl = auth.AUTH_PRINCIPAL_TTL
+    auth.AUTH_PRINCIPAL_TTL = 0
+    try:
+        print(f"API, uncached:         {rate(api, args.seconds):8.1f} req/s")
+    finally:
+        auth.AUTH_PRINCIPAL_TTL = ttl
+    print(f"principal cache:       {auth.auth_stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login and API request rates by auth configuration")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--methods", nargs="+", default=METHODS)
+    parser.add_argument("--app", action="store_true", help="also run the Flask paths (needs DATABASE_URL)")
+    parser.add_argument("--admin-user", default="admin")
+    parser.add_argument("--admin-password", default="admin123")
+    args = parser.parse_args()
+
+    bench_hashes(args.methods, args.seconds)
+    if args.app:
+        bench_app(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Bytes on the wire and serialization CPU for the dashboard payloads.
+#   python bench/payloads.py [n_readings]
+#
+# Synthetic rows shaped like /api/patient/<id>/readings and the chart
+# series are encoded with Flask's default JSON provider and with the orjson
+# provider, as full rows, with the patient dashboard's ?fields= and as
+# columns, then compressed the way compress_response would. No database
+# needed.
+import os
+import sys
+import gzip
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from payloads import COMPRESS_BROTLI_QUALITY, COMPRESS_GZIP_LEVEL, OrjsonProvider, brotli, columnar, orjson  # noqa: E402
+from timeseries import READING_FIELDS  # noqa: E402
+
+ADVICE = ("Your glucose is high. Take your medication at the same time each day, drink water, eat "
+          "small regular meals with vegetables and beans, and check again tomorrow morning. Visit "
+          "the health centre if you feel dizzy, confused or very thirsty.")
+DASHBOARD_FIELDS = ["glucose_level", "risk_level", "ai_advice", "medication_taken", "stress_level", "symptoms"]
+
+
+def synthetic_readings(n, seed=42):
+    rng = np.random.default_rng(seed)
+    now = datetime.now().replace(microsecond=0)
+    rows = []
+    for i in range(n):
+        glucose = round(min(max(float(rng.normal(170, 60)), 40.0), 500.0), 1)
+        rows.append({
+            "id": 100000 + i, "client_uuid": uuid.UUID(int=int(rng.integers(2**62))), "patient_id": 42,
+            "chv_id": 7, "glucose_level": glucose,
+            "reading_time": now - timedelta(hours=6 * i, microseconds=int(rng.integers(1_000_000))),
+            "medication_taken": bool(rng.random() < 0.7), "diet_description": "Rice and beans",
+            "stress_level": "Medium", "food_availability": "Sometimes", "symptoms": None, "notes": None,
+            "risk_level": "High" if glucose > 250 else "Medium" if glucose > 180 else "Low",
+            "risk_score": float(rng.integers(0, 100)), "ai_advice": ADVICE,
+        })
+    return rows
+
+
+def timed(fn, repeat=20):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = fn()
+    return body, (time.perf_counter() - start) / repeat * 1000
+
+
+def report(label, payload, providers):
+    for name, provider in providers:
+        body, ms = timed(lambda: provider.dumps(payload).encode("utf-8"))
+        gz, gz_ms = timed(lambda: gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0))
+        br = f"{len(brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)):>9,}" if brotli else f"{'-':>9}"
+        print(f"{label:<26} {name:<8} {len(body):>10,} {len(gz):>9,} {br} {ms:>8.2f} {gz_ms:>8.2f}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    app = Flask(__name__)
+    providers = [("flask", DefaultJSONProvider(app))]
+    if orjson is not None:
+        providers.append(("orjson", OrjsonProvider(app)))
+    else:
+        print("orjson not installed; only Flask's encoder is measured")
+
+    rows = synthetic_readings(n)
+    narrow = [{k: r[k] for k in ["id", "reading_time"] + DASHBOARD_FIELDS} for r in rows]
+    series = [{"t": r["reading_time"], "glucose": r["glucose_level"]} for r in reversed(rows)]
+
+    print(f"{n} readings; sizes in bytes, times in ms per response")
+    print(f"{'payload':<26} {'encoder':<8} {'raw':>10} {'gzip':>9} {'brotli':>9} {'encode':>8} {'gzip':>8}")
+    report("readings, all fields", {"readings": rows}, providers)
+    report("readings, ?fields=", {"readings": narrow}, providers)
+    report("readings, columns", {"readings": columnar(rows, list(READING_FIELDS))}, providers)
+    report("series, rows", {"series": series}, providers)
+    report("series, columns", {"series": columnar(series, ["t", "glucose"])}, providers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Per-reading cost of the vectorized risk engine versus the scalar path.
+#   python bench/risk_scoring.py [n_readings]
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from risk import score_batch, score_reading  # noqa: E402
+
+
+def synthetic_readings(n, seed=42):
+    rng = np.random.default_rng(seed)
+    return {
+        "glucose": rng.normal(160, 60, n).clip(30, 500),
+        "medication_taken": rng.random(n) < 0.7,
+        "stress_level": rng.choice(np.array(["None", "Low", "Medium", "High", "Very High"], dtype=object), n),
+        "recent_count": rng.integers(1, 6, n),
+        "recent_high": rng.integers(0, 6, n),
+    }
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    data = synthetic_readings(n)
+    data["recent_high"] = np.minimum(data["recent_high"], data["recent_count"])
+
+    score_batch(*(v[:1000] for v in data.values()))  # warm-up
+    start = time.perf_counter()
+    scored = score_batch(**data)
+    batch_seconds = time.perf_counter() - start
+
+    scalar_n = min(n, 100_000)
+    start = time.perf_counter()
+    for i in range(scalar_n):
+        recent = [200.0] * int(data["recent_high"][i]) + [100.0] * int(data["recent_count"][i] - data["recent_high"][i])
+        score_reading(data["glucose"][i], data["medication_taken"][i], data["stress_level"][i], recent)
+    scalar_seconds = time.perf_counter() - start
+
+    levels, counts = np.unique(scored["risk_level"], return_counts=True)
+    print(f"readings:          {n:,}")
+    print(f"vectorized total:  {batch_seconds * 1000:.1f} ms")
+    print(f"vectorized/read:   {batch_seconds / n * 1e9:.1f} ns")
+    print(f"score_reading:     {scalar_seconds / scalar_n * 1e9:.1f} ns/read (online path, over {scalar_n:,})")
+    print(f"speedup:           {(scalar_seconds / scalar_n) / (batch_seconds / n):.0f}x")
+    print("distribution:      " + ", ".join(f"{l}={c:,}" for l, c in zip(levels, counts)))
+
+
+if __name__ == "__main__":
+    main()
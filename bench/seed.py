@@ -0,0 +1,216 @@
+# Seeds a local Postgres with synthetic CHVs, patients and readings.
+#   DATABASE_URL=postgresql://localhost/arch_bench python bench/seed.py --readings 1000000
+#
+# Rows are loaded with COPY and risk is scored with the vectorized engine,
+# so even 10M readings avoid per-row INSERTs. Every seeded CHV logs in as
+# bench_chv_<user id> / BENCH_PASSWORD, which is how bench/workload.py finds
+# them.
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from alerts import rebuild_open_alerts  # noqa: E402
+from auth import hash_password  # noqa: E402
+from db import get_db_connection  # noqa: E402
+from features import rebuild_features  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from partitions import ensure_partitions  # noqa: E402
+from risk import HYPER_THRESHOLD, RECENT_WINDOW, WARNING_JSON, score_batch  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from search import normalize_name  # noqa: E402
+
+BENCH_PASSWORD = "bench123"
+
+FIRST_NAMES = ["Ngono", "Mbarga", "Fotso", "Tchamba", "Nkemdirim", "Ewane", "Njoya", "Fouda",
+               "Kamga", "Atangana", "Béatrice", "Hélène", "Aïcha", "Jean-Pierre", "Emmanuel",
+               "Clémentine", "Ousmane", "Marthe", "Célestin", "Ndongo"]
+LAST_NAMES = ["Essomba", "Tchinda", "Mvondo", "Nguemo", "Ebogo", "Mbappé", "Kengne", "Nana",
+              "Owona", "Tagne", "Djoumessi", "Abena", "Mballa", "Zambo", "Eyébé"]
+DISTRICTS = {
+    "Bafoussam": ["Tamdja", "Kouogouo", "Banengo", "Djeleng"],
+    "Dschang": ["Foréké", "Fongo-Tongo", "Keleng"],
+    "Bamenda": ["Nkwen", "Mankon", "Bali"],
+    "Garoua": ["Pitoa", "Lagdo", "Ngong"],
+    "Bertoua": ["Mandjou", "Kano", "Nkolbikon"],
+}
+STRESS_LEVELS = np.array(["None", "Low", "Medium", "High", "Very High"], dtype=object)
+FOOD = np.array(["Good", "Moderate", "Poor"], dtype=object)
+SYMPTOMS = np.array(["", "thirst", "dizziness", "fatigue", "frequent urination", "blurred vision, thirst"],
+                    dtype=object)
+
+
+def _next_id(cur, table):
+    cur.execute(f"SELECT COALESCE(MAX(id), 0) AS max_id FROM {table}")
+    return cur.fetchone()["max_id"] + 1
+
+
+def _sync_sequence(cur, table):
+    cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+
+
+def seed_users(cur, n_chvs, rng):
+    password_hash = hash_password(BENCH_PASSWORD)
+    districts = list(DISTRICTS)
+    start = _next_id(cur, "users")
+    with cur.copy("COPY users (id, username, password_hash, full_name, role, district) FROM STDIN") as copy:
+        for i in range(n_chvs):
+            copy.write_row((start + i, f"bench_chv_{start + i}", password_hash, f"Bench CHV {i}", "chv",
+                            districts[int(rng.integers(len(districts)))]))
+    _sync_sequence(cur, "users")
+    return np.arange(start, start + n_chvs)
+
+
+def seed_patients(cur, n_patients, chv_ids, rng):
+    districts = list(DISTRICTS)
+    start = _next_id(cur, "patients")
+    today = datetime.now().strftime("%Y%m%d")
+    with cur.copy("COPY patients (id, patient_id, full_name, age, gender, village, district, "
+                  "diabetes_type, registered_by, search_name) FROM STDIN") as copy:
+        for i in range(n_patients):
+            district = districts[int(rng.integers(len(districts)))]
+            name = f"{FIRST_NAMES[int(rng.integers(len(FIRST_NAMES)))]} {LAST_NAMES[int(rng.integers(len(LAST_NAMES)))]}"
+            copy.write_row((start + i, f"ARCH-{today}-{start + i:06X}", name, int(rng.integers(25, 85)),
+                            "F" if rng.random() < 0.55 else "M",
+                            DISTRICTS[district][int(rng.integers(len(DISTRICTS[district])))], district,
+                            "Type 2" if rng.random() < 0.9 else "Type 1",
+                            int(chv_ids[int(rng.integers(len(chv_ids)))]), normalize_name(name)))
+    _sync_sequence(cur, "patients")
+    return np.arange(start, start + n_patients)
+
+
+def _recent_windows(patient, glucose):
+    # Rows are sorted by (patient, time): per-row count of the patient's
+    # last RECENT_WINDOW readings and how many were above the threshold.
+    n = len(patient)
+    index = np.arange(n)
+    group_start = np.maximum.accumulate(np.where(np.r_[True, patient[1:] != patient[:-1]], index, 0))
+    window_start = np.maximum(index - RECENT_WINDOW + 1, group_start)
+    high_cumsum = np.r_[0, np.cumsum(glucose > HYPER_THRESHOLD)]
+    return index - window_start + 1, high_cumsum[index + 1] - high_cumsum[window_start]
+
+
+def seed_readings(cur, patient_ids, chv_ids, n_readings, days, rng, chunk_patients=20000):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    per_patient = max(1, n_readings // len(patient_ids))
+    reading_id = _next_id(cur, "glucose_readings")
+    assessment_id = _next_id(cur, "risk_assessments")
+    total = 0
+
+    for offset in range(0, len(patient_ids), chunk_patients):
+        block = patient_ids[offset:offset + chunk_patients]
+        counts = rng.poisson(per_patient, len(block)).clip(1)
+        patient = np.repeat(block, counts)
+        n = len(patient)
+        seconds_ago = rng.uniform(0, days * 86400, n)
+        order = np.lexsort((-seconds_ago, patient))  # per patient, oldest first
+        patient, seconds_ago = patient[order], seconds_ago[order]
+
+        # A per-patient baseline makes some patients persistently high.
+        baseline = rng.normal(150, 45, len(block)).clip(80, 320)
+        glucose = (np.repeat(baseline, counts)[order] + rng.normal(0, 35, n)).clip(35, 550).round(1)
+        medication = rng.random(n) < 0.72
+        stress = STRESS_LEVELS[rng.integers(len(STRESS_LEVELS), size=n)]
+        food = FOOD[rng.integers(len(FOOD), size=n)]
+        symptoms = SYMPTOMS[rng.integers(len(SYMPTOMS), size=n)]
+        chv = chv_ids[rng.integers(len(chv_ids), size=n)]
+        times = [now - timedelta(seconds=float(s)) for s in seconds_ago]
+
+        recent_count, recent_high = _recent_windows(patient, glucose)
+        scored = score_batch(glucose, medication, stress, recent_count, recent_high)
+        warnings = WARNING_JSON[scored["warning_mask"]]
+
+        with cur.copy("COPY glucose_readings (id, patient_id, chv_id, glucose_level, reading_time, "
+                      "medication_taken, stress_level, food_availability, symptoms) FROM STDIN") as copy:
+            for i in range(n):
+                copy.write_row((reading_id + i, int(patient[i]), int(chv[i]), float(glucose[i]), times[i],
+                                bool(medication[i]), stress[i], food[i], symptoms[i] or None))
+        with cur.copy("COPY risk_assessments (id, reading_id, patient_id, risk_level, risk_score, "
+                      "ai_advice, warning_flags, referral_recommended, created_at) FROM STDIN") as copy:
+            for i in range(n):
+                copy.write_row((assessment_id + i, reading_id + i, int(patient[i]), scored["risk_level"][i],
+                                float(scored["risk_score"][i]), None, warnings[i],
+                                bool(scored["referral_needed"][i]), times[i]))
+        high = np.flatnonzero(scored["level_code"] == 2)
+        # Loaded as resolved; open_recent_alerts() reopens the last week's.
+        with cur.copy("COPY alerts (patient_id, risk_assessment_id, alert_type, message, status, created_at, "
+                      "last_seen_at, notified_at, resolved_at) FROM STDIN") as copy:
+            for i in high:
+                copy.write_row((int(patient[i]), assessment_id + int(i), "high_risk",
+                                f"High-risk patient detected. Glucose: {glucose[i]} mg/dL",
+                                "resolved", times[i], times[i], times[i], times[i]))
+
+        reading_id += n
+        assessment_id += n
+        total += n
+        print(f"  {total:,} readings")
+
+    _sync_sequence(cur, "glucose_readings")
+    _sync_sequence(cur, "risk_assessments")
+    return total
+
+
+def open_recent_alerts(cur):
+    # One open alert per patient with high readings in the last week, as the
+    # alert worker would have left it.
+    cur.execute("""
+        WITH recent AS (
+            SELECT patient_id, MAX(id) AS id, COUNT(*) AS n, MIN(created_at) AS first_seen
+            FROM alerts
+            WHERE created_at >= NOW() - INTERVAL '7 days'
+              AND patient_id NOT IN (SELECT patient_id FROM alerts WHERE status IN ('pending', 'escalated'))
+            GROUP BY patient_id
+        )
+        UPDATE alerts a
+        SET status = 'pending', resolved_at = NULL, occurrences = r.n, created_at = r.first_seen
+        FROM recent r
+        WHERE a.id = r.id
+    """)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed synthetic benchmark data")
+    parser.add_argument("--readings", type=int, default=100_000)
+    parser.add_argument("--readings-per-patient", type=int, default=50)
+    parser.add_argument("--patients-per-chv", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n_patients = max(1, args.readings // args.readings_per_patient)
+    n_chvs = max(1, n_patients // args.patients_per_chv)
+    started = time.perf_counter()
+
+    with get_db_connection() as conn:
+        run_migrations(conn)
+        cur = conn.cursor()
+        print(f"Seeding {n_chvs:,} CHVs, {n_patients:,} patients, ~{args.readings:,} readings")
+        chv_ids = seed_users(cur, n_chvs, rng)
+        patient_ids = seed_patients(cur, n_patients, chv_ids, rng)
+        # One partition per seeded month, so COPY does not fill DEFAULT.
+        ensure_partitions(cur, since=datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=args.days))
+        conn.commit()
+        total = seed_readings(cur, patient_ids, chv_ids, args.readings, args.days, rng)
+        conn.commit()
+        print("Rebuilding rollups")
+        rebuild_rollups(cur)
+        rebuild_features(cur)
+        open_recent_alerts(cur)
+        rebuild_open_alerts(cur)
+        conn.commit()
+        cur.execute("ANALYZE")
+        conn.commit()
+        cur.close()
+
+    print(f"Seeded {total:,} readings in {time.perf_counter() - started:.1f}s; "
+          f"CHV logins bench_chv_<{chv_ids[0]}..{chv_ids[-1]}> / {BENCH_PASSWORD}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Worker boot time and memory: what each gunicorn worker (or each replica
+# on autoscale) pays before serving its first request.
+#   python bench/startup.py                  # import app, as workers now do
+#   DATABASE_URL=... python bench/startup.py --legacy
+#
+# --legacy adds what the import used to do on every boot: init_db() (schema
+# checks and seed-user hashes) and constructing the OpenAI client. Each run
+# is a fresh interpreter; medians are reported.
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+stages = {"import": time.perf_counter() - start}
+if "--legacy" in sys.argv:
+    t = time.perf_counter()
+    app.init_db()
+    stages["init_db"] = time.perf_counter() - t
+    t = time.perf_counter()
+    try:
+        from openai import OpenAI
+        OpenAI(api_key="unused")
+    except ImportError:
+        pass
+    stages["openai"] = time.perf_counter() - t
+stages["total"] = time.perf_counter() - start
+# ru_maxrss is in KiB on Linux.
+stages["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(stages))
+"""
+
+
+def boot(legacy):
+    argv = [sys.executable, "-c", CHILD] + (["--legacy"] if legacy else [])
+    out = subprocess.run(argv, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker boot time and peak memory")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--legacy", action="store_true",
+                        help="also run init_db and build the OpenAI client, as every boot used to")
+    args = parser.parse_args()
+
+    modes = [("lazy", False)] + ([("legacy", True)] if args.legacy else [])
+    print(f"{'mode':<8} {'stage':<12} {'median':>10}")
+    for name, legacy in modes:
+        runs = [boot(legacy) for _ in range(args.runs)]
+        for stage in runs[0]:
+            value = statistics.median(r[stage] for r in runs)
+            shown = f"{value:.0f} MB" if stage == "max_rss_mb" else f"{value * 1000:.0f} ms"
+            print(f"{name:<8} {stage:<12} {shown:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+# Replays the dashboards' fetch patterns against a running server and
+# reports latency percentiles, throughput and queries per request.
+#   python bench/seed.py --readings 1000000
+#   gunicorn app:app &
+#   python bench/workload.py --url http://127.0.0.1:8000 --mix chv --users 20 --duration 60
+#
+# DATABASE_URL must point at the same database as the server: it is used to
+# pick seeded CHVs and patients, and to read pg_stat_statements (when the
+# extension is installed) for the queries-per-request figures.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db import get_db_connection  # noqa: E402
+from seed import BENCH_PASSWORD  # noqa: E402
+
+STRESS_LEVELS = ["None", "Low", "Medium", "High", "Very High"]
+
+
+# -------------------- Flows -------------------- #
+# One flow per page, issuing the same requests its template does on load.
+def chv_dashboard(client, data, rng):
+    client.get("/api/chv/stats", "chv/stats")
+
+
+def patient_search(client, data, rng):
+    name = rng.choice(data["patients"])["search_name"]
+    client.get(f"/api/search-patients?q={name[:rng.randint(2, 5)]}", "search-patients")
+
+
+def patient_dashboard(client, data, rng):
+    patient_id = rng.choice(data["patients"])["id"]
+    days = rng.choice([7, 14, 30, 90])
+    client.get(f"/api/patient/{patient_id}", "patient")
+    client.get(f"/api/patient/{patient_id}/readings/series?days={days}", "readings/series")
+    client.get(f"/api/patient/{patient_id}/readings?days={days}&limit=10", "readings")
+
+
+def glucose_input(client, data, rng):
+    patient_id = rng.choice(data["patients"])["id"]
+    client.get(f"/api/patient/{patient_id}", "patient")
+    result = client.post("/api/glucose-reading", "glucose-reading", {
+        "patient_id": patient_id,
+        "glucose_level": round(rng.gauss(160, 55), 1),
+        "medication_taken": rng.random() < 0.72,
+        "stress_level": rng.choice(STRESS_LEVELS),
+        "food_availability": rng.choice(["Good", "Moderate", "Poor"]),
+        "symptoms": rng.choice(["", "thirst", "fatigue"]),
+    })
+    # The page's first advice poll.
+    assessment = (result or {}).get("risk_assessment") or {}
+    if assessment.get("advice_status") == "pending":
+        client.get(f"/api/risk-assessment/{assessment['assessment_id']}/advice", "advice")
+
+
+def admin_dashboard(client, data, rng):
+    client.get("/api/admin/stats", "admin/stats")
+
+
+FLOWS = {
+    "chv_dashboard": (chv_dashboard, "chv"),
+    "patient_search": (patient_search, "chv"),
+    "patient_dashboard": (patient_dashboard, "chv"),
+    "glucose_input": (glucose_input, "chv"),
+    "admin_dashboard": (admin_dashboard, "admin"),
+}
+
+MIXES = {
+    "chv": {"chv_dashboard": 30, "patient_search": 25, "patient_dashboard": 25, "glucose_input": 20},
+    "read-heavy": {"chv_dashboard": 30, "patient_search": 30, "patient_dashboard": 40},
+    "write-heavy": {"glucose_input": 70, "chv_dashboard": 15, "patient_dashboard": 15},
+    "admin": {"admin_dashboard": 100},
+    "mixed": {"chv_dashboard": 28, "patient_search": 24, "patient_dashboard": 24, "glucose_input": 19,
+              "admin_dashboard": 5},
+}
+
+
+# -------------------- HTTP client -------------------- #
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.enabled = False
+        self.lock = threading.Lock()
+
+    def record(self, label, seconds, ok):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.latencies[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+
+class Client:
+    # One browser session: its own cookies and, like a browser honouring
+    # Cache-Control: no-cache, an ETag per URL for revalidation.
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.etags = {}
+        self.requests = 0
+
+    def _send(self, method, path, label, payload=None):
+        headers = {}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if method == "GET" and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                status, data, etag = response.status, response.read(), response.headers.get("ETag")
+        except urllib.error.HTTPError as e:
+            status, data, etag = e.code, e.read(), None
+        except OSError:
+            status, data, etag = 0, b"", None
+        self.recorder.record(label, time.perf_counter() - start, status in (200, 304))
+        self.requests += 1
+
+        if etag:
+            self.etags[path] = etag
+        if status == 200 and data:
+            try:
+                return json.loads(data)
+            except ValueError:
+                return None
+        return None
+
+    def get(self, path, label):
+        return self._send("GET", path, label)
+
+    def post(self, path, label, payload):
+        return self._send("POST", path, label, payload)
+
+    def login(self, username, password):
+        result = self.post("/login", "login", {"username": username, "password": password})
+        if not result or not result.get("success"):
+            raise SystemExit(f"Login failed for {username}")
+
+
+# -------------------- Data and query counts -------------------- #
+def load_data(sample_size):
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT username FROM users WHERE username LIKE %s ORDER BY id", ("bench\\_chv\\_%",))
+        chvs = [r["username"] for r in cur.fetchall()]
+        cur.execute("SELECT id, search_name FROM patients ORDER BY random() LIMIT %s", (sample_size,))
+        patients = [r for r in cur.fetchall() if r["search_name"]]
+        cur.close()
+    if not chvs or not patients:
+        raise SystemExit("No seeded data found; run bench/seed.py first")
+    return {"chvs": chvs, "patients": patients}
+
+
+def total_statements():
+    # Statement executions in this database so far, or None when
+    # pg_stat_statements is not installed.
+    try:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT COALESCE(SUM(calls), 0) AS calls FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            """)
+            calls = int(cur.fetchone()["calls"])
+            cur.close()
+            return calls
+    except Exception:
+        return None
+
+
+def probe_queries(args, data, mix, recorder, admin):
+    # Runs each flow sequentially so its statement count is not mixed with
+    # other traffic. The probe's own pg_stat_statements read counts as one.
+    rng = random.Random(args.seed)
+    clients = {"chv": Client(args.url, recorder), "admin": Client(args.url, recorder)}
+    clients["chv"].login(data["chvs"][0], BENCH_PASSWORD)
+    if admin:
+        clients["admin"].login(args.admin_user, args.admin_password)
+
+    per_flow = {}
+    for name in mix:
+        flow, role = FLOWS[name]
+        client = clients[role]
+        before_calls, before_requests = total_statements(), client.requests
+        if before_calls is None:
+            return None
+        for _ in range(args.probe_runs):
+            flow(client, data, rng)
+        after_calls = total_statements() - 1
+        per_flow[name] = round((after_calls - before_calls) / (client.requests - before_requests), 2)
+    return per_flow
+
+
+# -------------------- Runner -------------------- #
+def virtual_user(index, args, data, mix, recorder, deadline, admin):
+    rng = random.Random(args.seed + index)
+    names, weights = zip(*mix.items())
+    clients = {}
+    clients["chv"] = Client(args.url, recorder)
+    clients["chv"].login(data["chvs"][index % len(data["chvs"])], BENCH_PASSWORD)
+    if admin:
+        clients["admin"] = Client(args.url, recorder)
+        clients["admin"].login(args.admin_user, args.admin_password)
+
+    while time.monotonic() < deadline:
+        flow, role = FLOWS[rng.choices(names, weights)[0]]
+        flow(clients[role], data, rng)
+        if args.think_ms:
+            time.sleep(rng.expovariate(1000 / args.think_ms))
+
+
+def summarize(recorder, elapsed):
+    rows = {}
+    for label, values in sorted(recorder.latencies.items()):
+        ms = np.array(values) * 1000
+        rows[label] = {
+            "count": len(ms),
+            "errors": recorder.errors[label],
+            "rps": round(len(ms) / elapsed, 1),
+            "p50_ms": round(float(np.percentile(ms, 50)), 1),
+            "p95_ms": round(float(np.percentile(ms, 95)), 1),
+            "p99_ms": round(float(np.percentile(ms, 99)), 1),
+            "max_ms": round(float(ms.max()), 1),
+        }
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay dashboard workloads against a running server")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="chv")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of unmeasured load first")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between flows per user")
+    parser.add_argument("--probe-runs", type=int, default=10, help="sequential runs per flow for query counts")
+    parser.add_argument("--patients", type=int, default=5000, help="patients sampled as request targets")
+    parser.add_argument("--admin-user", default="admin")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    mix = MIXES[args.mix]
+    admin = any(FLOWS[name][1] == "admin" for name in mix)
+    data = load_data(args.patients)
+    recorder = Recorder()
+
+    queries = probe_queries(args, data, mix, recorder, admin) if args.probe_runs else None
+
+    start = time.monotonic()
+    deadline = start + args.warmup + args.duration
+    threads = [threading.Thread(target=virtual_user, args=(i, args, data, mix, recorder, deadline, admin),
+                                daemon=True)
+               for i in range(args.users)]
+    for t in threads:
+        t.start()
+    time.sleep(args.warmup)
+    calls_before = total_statements()
+    recorder.enabled = True
+    measured_start = time.monotonic()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - measured_start
+    recorder.enabled = False
+    calls_after = total_statements()
+
+    endpoints = summarize(recorder, elapsed)
+    total = sum(r["count"] for r in endpoints.values())
+    report = {
+        "mix": args.mix,
+        "users": args.users,
+        "duration_s": round(elapsed, 1),
+        "requests": total,
+        "errors": sum(r["errors"] for r in endpoints.values()),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0,
+        "queries_per_request": (round((calls_after - calls_before - 1) / total, 2)
+                                if total and calls_before is not None and calls_after is not None else None),
+        "queries_per_request_by_flow": queries,
+        "endpoints": endpoints,
+    }
+
+    print(f"mix={args.mix} users={args.users} duration={report['duration_s']}s "
+          f"requests={total} errors={report['errors']} throughput={report['throughput_rps']} req/s")
+    print(f"{'endpoint':<18}{'count':>8}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for label, r in endpoints.items():
+        print(f"{label:<18}{r['count']:>8}{r['errors']:>6}{r['rps']:>9}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+    if report["queries_per_request"] is None:
+        print("queries/request: n/a (CREATE EXTENSION pg_stat_statements to enable)")
+    else:
+        print(f"queries/request: {report['queries_per_request']} under load")
+        for name, value in (queries or {}).items():
+            print(f"  {name:<18}{value}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
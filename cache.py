@@ -0,0 +1,255 @@
+import os
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import psycopg
+from flask import g, request, jsonify, make_response
+
+from db import DATABASE_URL, get_db_connection
+
+# Response cache for read APIs. Entries are keyed by route, query string and
+# (optionally) user, plus the current version of each invalidation tag, so
+# bumping a tag's version makes every dependent entry unreachable at once.
+#
+# Without REDIS_URL each process keeps its own cache and tag versions.
+# invalidate() then also sends the tags with NOTIFY on CACHE_CHANNEL, and a
+# LISTEN thread in every process that reads the cache applies them, so
+# invalidations from other gunicorn workers, the alert worker and the geo
+# refresh arrive within moments. If that connection drops, every version is
+# reset once it is back, since invalidations sent meanwhile were missed.
+# With REDIS_URL the cache and versions are shared and no NOTIFY is sent.
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 2048))
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHE_CHANNEL = "arch_cache_tags"
+RECONNECT_BACKOFF = 2.0
+
+# pg_notify payloads must stay under 8000 bytes.
+NOTIFY_MAX_BYTES = 7000
+
+
+class LocalBackend:
+    shared = False
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        # Bumped by reset(); part of every version, so nothing cached
+        # before a reset matches after it.
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.listener = None
+        self.listener_pid = None
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def tag_versions(self, tags):
+        self._ensure_listener()
+        with self.lock:
+            return [[self.generation, self.versions.get(tag, 0)] for tag in tags]
+
+    def bump(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def _ensure_listener(self):
+        # Like the alert broker's, the thread does not survive fork(), so
+        # each worker starts its own on first use.
+        if self.listener is not None and self.listener_pid == os.getpid() and self.listener.is_alive():
+            return
+        with self.lock:
+            if self.listener is None or self.listener_pid != os.getpid() or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self._listen, name="cache-listener", daemon=True)
+                self.listener_pid = os.getpid()
+                self.listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CACHE_CHANNEL}")
+                    self.reset()
+                    for notify in conn.notifies():
+                        try:
+                            self.bump(json.loads(notify.payload))
+                        except ValueError as e:
+                            print(f"Response cache warning, bad invalidation payload: {e}")
+            except Exception as e:
+                print(f"Response cache listener error, reconnecting: {e}")
+                time.sleep(RECONNECT_BACKOFF)
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def tag_versions(self, tags):
+        if not tags:
+            return []
+        return [int(v or 0) for v in self.client.mget([f"tag:{t}" for t in tags])]
+
+    def bump(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr(f"tag:{tag}")
+        pipe.execute()
+
+
+backend = LocalBackend(RESPONSE_CACHE_SIZE)
+if REDIS_URL:
+    try:
+        backend = RedisBackend(REDIS_URL)
+    except Exception as e:
+        print(f"Response cache warning, using in-process cache: {e}")
+
+_counters = {"hits": 0, "misses": 0, "not_modified": 0, "stores": 0, "invalidations": 0, "errors": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _publish(tags):
+    # Sends tags to the other processes' listeners, a few hundred at a time.
+    chunks, chunk = [], []
+    for tag in tags:
+        if chunk and len(json.dumps(chunk + [tag])) > NOTIFY_MAX_BYTES:
+            chunks.append(chunk)
+            chunk = []
+        chunk.append(tag)
+    chunks.append(chunk)
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        for chunk in chunks:
+            cur.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, json.dumps(chunk)))
+        conn.commit()
+        cur.close()
+
+
+def invalidate(*tags):
+    # Blocks on a pooled connection without REDIS_URL; async callers run it
+    # in a thread.
+    tags = [t for t in tags if t]
+    if not tags:
+        return
+    try:
+        backend.bump(tags)
+        if not backend.shared:
+            _publish(tags)
+        _count("invalidations")
+    except Exception as e:
+        _count("errors")
+        print(f"Response cache invalidation warning: {e}")
+
+
+def _etag(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def _respond(body, etag):
+    if request.if_none_match.contains_weak(etag):
+        _count("not_modified")
+        response = make_response("", 304)
+    else:
+        response = make_response(body)
+        response.mimetype = "application/json"
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def cached_response(tags, vary_user=False, ttl=None):
+    # tags: callable receiving the view kwargs and returning tag names.
+    # Apply below auth.requires_login, which does the role check and sets
+    # g.user; without it every request is refused, so cached bodies are
+    # never served to an unauthorized caller.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.get("user") is None:
+                return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+            entry_tags = list(tags(**kwargs))
+            try:
+                versions = backend.tag_versions(entry_tags)
+                key = "resp:" + json.dumps([
+                    request.path,
+                    sorted(request.args.items(multi=True)),
+                    g.user["id"] if vary_user else None,
+                    versions,
+                ])
+                cached = backend.get(key)
+            except Exception as e:
+                _count("errors")
+                print(f"Response cache lookup warning: {e}")
+                key, cached = None, None
+
+            if cached is not None:
+                _count("hits")
+                body = cached if isinstance(cached, bytes) else cached.encode("utf-8")
+                return _respond(body, _etag(body))
+
+            _count("misses")
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.mimetype != "application/json":
+                return response
+
+            body = response.get_data()
+            if key is not None:
+                try:
+                    backend.set(key, body, ttl or RESPONSE_CACHE_TTL)
+                    _count("stores")
+                except Exception as e:
+                    _count("errors")
+                    print(f"Response cache store warning: {e}")
+            return _respond(body, _etag(body))
+        return wrapper
+    return decorator
+
+
+def response_cache_stats():
+    with _counters_lock:
+        stats = dict(_counters)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0
+    stats["backend"] = type(backend).__name__
+    return stats
@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+from metrics import InstrumentedAsyncCursor, InstrumentedCursor, record_acquire
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", 300))
+POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", 3600))
+# The async pool serves many concurrent requests from one event loop, so it
+# is sized independently of the per-thread sync pool.
+ASYNC_POOL_MAX_SIZE = int(os.environ.get("DB_ASYNC_POOL_MAX_SIZE", 20))
+# Timestamp columns are naive and filled from CURRENT_TIMESTAMP, which is in
+# the session's TimeZone. Pinning it makes every stored time UTC whatever
+# the server or host is configured with (see payloads.to_utc).
+DB_TIMEZONE = "UTC"
+CONNECT_OPTIONS = f"-c timezone={DB_TIMEZONE}"
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _create_pool():
+    return ConnectionPool(
+        DATABASE_URL,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        timeout=POOL_TIMEOUT,
+        max_idle=POOL_MAX_IDLE,
+        max_lifetime=POOL_MAX_LIFETIME,
+        kwargs={"row_factory": dict_row, "cursor_factory": InstrumentedCursor, "options": CONNECT_OPTIONS},
+        check=ConnectionPool.check_connection,
+        name="arch",
+        open=True,
+    )
+
+
+def get_pool():
+    # A pool inherited across fork() shares sockets with the parent and has no
+    # worker threads, so every process builds its own on first use.
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = _create_pool()
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def reset_pool():
+    # Called from gunicorn's post_fork hook: forget any pool copied from the
+    # master without closing the parent's connections.
+    global _pool, _pool_pid
+    with _pool_lock:
+        _pool = None
+        _pool_pid = None
+
+
+def close_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+        _pool_pid = None
+
+
+@contextmanager
+def get_db_connection():
+    pool = get_pool()
+    start = time.perf_counter()
+    with pool.connection() as conn:
+        record_acquire(time.perf_counter() - start)
+        yield conn
+
+
+# -------------------- Async pool (ASGI mode) -------------------- #
+_async_pool = None
+
+
+async def open_async_pool():
+    # Called from the ASGI app's lifespan, inside its event loop.
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(
+            DATABASE_URL,
+            min_size=POOL_MIN_SIZE,
+            max_size=ASYNC_POOL_MAX_SIZE,
+            timeout=POOL_TIMEOUT,
+            max_idle=POOL_MAX_IDLE,
+            max_lifetime=POOL_MAX_LIFETIME,
+            kwargs={"row_factory": dict_row, "cursor_factory": InstrumentedAsyncCursor,
+                    "options": CONNECT_OPTIONS},
+            check=AsyncConnectionPool.check_connection,
+            name="arch-async",
+            open=False,
+        )
+        await _async_pool.open()
+    return _async_pool
+
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+@asynccontextmanager
+async def get_async_db_connection():
+    start = time.perf_counter()
+    async with _async_pool.connection() as conn:
+        record_acquire(time.perf_counter() - start)
+        yield conn
+
+
+def pool_stats():
+    if _pool is None or _pool_pid != os.getpid():
+        return {"open": False}
+    stats = _pool.get_stats()
+    size = stats.get("pool_size", 0)
+    available = stats.get("pool_available", 0)
+    requests_num = stats.get("requests_num", 0)
+    wait_ms = stats.get("requests_wait_ms", 0)
+    return {
+        "open": True,
+        "pid": _pool_pid,
+        "min_size": stats.get("pool_min", POOL_MIN_SIZE),
+        "max_size": stats.get("pool_max", POOL_MAX_SIZE),
+        "size": size,
+        "available": available,
+        "in_use": size - available,
+        "requests_waiting": stats.get("requests_waiting", 0),
+        "requests_num": requests_num,
+        "requests_queued": stats.get("requests_queued", 0),
+        "requests_wait_ms": wait_ms,
+        "avg_wait_ms": round(wait_ms / requests_num, 3) if requests_num else 0,
+        "timeouts": stats.get("requests_errors", 0),
+        "connections_num": stats.get("connections_num", 0),
+        "connections_errors": stats.get("connections_errors", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+        "returns_bad": stats.get("returns_bad", 0),
+    }
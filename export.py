@@ -0,0 +1,175 @@
+import os
+import io
+import json
+import threading
+from datetime import date
+
+from psycopg import sql
+
+from db import get_db_connection
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 5000))
+EXPORT_MAX_CONCURRENT = int(os.environ.get("EXPORT_MAX_CONCURRENT", 2))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Patient names and phone numbers are deliberately left out: exports are
+# for planning, and the ARCH patient code is enough to join back.
+EXPORT_COLUMNS = [
+    ("reading_id", "gr.id"),
+    ("reading_time", "gr.reading_time"),
+    ("patient_code", "p.patient_id"),
+    ("district", "p.district"),
+    ("village", "p.village"),
+    ("chv_id", "gr.chv_id"),
+    ("glucose_level", "gr.glucose_level"),
+    ("medication_taken", "gr.medication_taken"),
+    ("stress_level", "gr.stress_level"),
+    ("food_availability", "gr.food_availability"),
+    ("symptoms", "gr.symptoms"),
+    ("risk_level", "ra.risk_level"),
+    ("risk_score", "ra.risk_score"),
+    ("referral_recommended", "ra.referral_recommended"),
+]
+
+# Each export holds a pooled connection for its whole duration, so the
+# number running at once per worker is capped.
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+def parse_filters(args):
+    filters = {}
+    if args.get("district"):
+        filters["district"] = args["district"]
+    if args.get("chv_id"):
+        filters["chv_id"] = int(args["chv_id"])
+    if args.get("start"):
+        filters["start"] = date.fromisoformat(args["start"])
+    if args.get("end"):
+        filters["end"] = date.fromisoformat(args["end"])
+    return filters
+
+
+def build_export_query(filters):
+    # Values are composed as literals so the same statement works for both
+    # COPY (which cannot take bind parameters) and regular cursors.
+    conditions = [sql.SQL("TRUE")]
+    if "district" in filters:
+        conditions.append(sql.SQL("p.district = {}").format(sql.Literal(filters["district"])))
+    if "chv_id" in filters:
+        conditions.append(sql.SQL("gr.chv_id = {}").format(sql.Literal(filters["chv_id"])))
+    if "start" in filters:
+        conditions.append(sql.SQL("gr.reading_time >= {}").format(sql.Literal(filters["start"])))
+    if "end" in filters:
+        conditions.append(sql.SQL("gr.reading_time < {}::date + 1").format(sql.Literal(filters["end"])))
+
+    columns = sql.SQL(", ").join(
+        sql.SQL("{} AS {}").format(sql.SQL(expr), sql.Identifier(name)) for name, expr in EXPORT_COLUMNS)
+    return sql.SQL("""
+        SELECT {columns}
+        FROM glucose_readings gr
+        JOIN patients p ON p.id = gr.patient_id
+        LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id AND ra.created_at >= gr.reading_time
+        WHERE {conditions}
+        ORDER BY gr.reading_time, gr.id
+    """).format(columns=columns, conditions=sql.SQL(" AND ").join(conditions))
+
+
+def stream_csv(query):
+    # COPY ... TO STDOUT: Postgres formats the CSV and we relay its chunks.
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        with cur.copy(sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(query)) as copy:
+            for chunk in copy:
+                yield bytes(chunk)
+        cur.close()
+
+
+def _stream_rows(query):
+    with get_db_connection() as conn:
+        with conn.cursor(name="export") as cur:
+            cur.itersize = EXPORT_CHUNK_ROWS
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                yield rows
+
+
+def stream_ndjson(query):
+    for rows in _stream_rows(query):
+        yield "".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only sink so ParquetWriter output can be yielded as it is produced.
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def stream_parquet(query):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("reading_id", pa.int64()),
+        ("reading_time", pa.timestamp("us")),
+        ("patient_code", pa.string()),
+        ("district", pa.string()),
+        ("village", pa.string()),
+        ("chv_id", pa.int64()),
+        ("glucose_level", pa.float64()),
+        ("medication_taken", pa.bool_()),
+        ("stress_level", pa.string()),
+        ("food_availability", pa.string()),
+        ("symptoms", pa.string()),
+        ("risk_level", pa.string()),
+        ("risk_score", pa.float64()),
+        ("referral_recommended", pa.bool_()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    # One row group per fetched chunk keeps memory bounded.
+    for rows in _stream_rows(query):
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_stream(fmt, filters):
+    query = build_export_query(filters)
+    stream = {"csv": stream_csv, "ndjson": stream_ndjson, "parquet": stream_parquet}[fmt](query)
+    for chunk in stream:
+        if chunk:
+            yield chunk
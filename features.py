@@ -0,0 +1,206 @@
+import sys
+import math
+
+from db import get_db_connection
+from risk import HYPER_THRESHOLD, HYPO_THRESHOLD, RECENT_WINDOW
+
+# Per-patient glucose features, maintained in the same transaction as each
+# reading insert like the dashboard rollups. patient_features holds one row
+# per patient (lifetime sums, the latest RECENT_WINDOW levels for risk
+# scoring, and the last level for episode detection); patient_daily_features
+# holds one row per patient and day, so any window up to FEATURE_MAX_DAYS
+# reads at most that many small rows however many readings a patient has.
+#
+# An episode is a run of consecutive hypo (or hyper) readings and is counted
+# on its first reading. Readings synced out of order are compared with the
+# latest reading rather than their true predecessor, so episode counts can
+# drift slightly until `python features.py --rebuild`.
+FEATURE_WINDOWS = (7, 30, 90)
+FEATURE_MAX_DAYS = 365
+
+COUNTER_COLUMNS = ("reading_count", "glucose_sum", "glucose_sum_sq", "in_range_count", "hypo_count",
+                   "hyper_count", "hypo_episodes", "hyper_episodes", "medication_known",
+                   "medication_taken_count")
+
+_COUNTER_LIST = ", ".join(COUNTER_COLUMNS)
+_COUNTER_VALUES = ("1, g, g * g, in_range, hypo, hyper, hypo_episode, hyper_episode, "
+                   "(m IS NOT NULL)::int, COALESCE(m, FALSE)::int")
+
+# Records one reading and returns the patient's RECENT_WINDOW levels up to
+# and including this one (newest first) as glucose_level rows, which is
+# what readings.assess_reading scores. recent_levels only follows in-order
+# readings, so a backdated one is scored from the RECENT_WINDOW stored
+# readings at or before its time (itself included). sync._score_batch builds
+# the same window; tests/test_sync.py checks the two agree.
+RECORD_FEATURES_SQL = f"""
+    WITH prev AS (
+        SELECT last_glucose, last_reading_time FROM patient_features WHERE patient_id = %(patient_id)s
+    ), r AS (
+        SELECT %(glucose)s::float8 AS g, %(medication_taken)s::bool AS m,
+               COALESCE(%(reading_time)s::timestamp, CURRENT_TIMESTAMP) AS t,
+               (SELECT last_glucose FROM prev) AS last
+    ), ordered AS (
+        SELECT COALESCE(r.t >= (SELECT last_reading_time FROM prev), TRUE) AS in_order FROM r
+    ), flags AS (
+        SELECT g, m, t,
+               (g < %(hypo)s)::int AS hypo, (g > %(hyper)s)::int AS hyper,
+               (g BETWEEN %(hypo)s AND %(hyper)s)::int AS in_range,
+               (g < %(hypo)s AND NOT COALESCE(last < %(hypo)s, FALSE))::int AS hypo_episode,
+               (g > %(hyper)s AND NOT COALESCE(last > %(hyper)s, FALSE))::int AS hyper_episode
+        FROM r
+    ), daily AS (
+        INSERT INTO patient_daily_features (patient_id, day, {_COUNTER_LIST})
+        SELECT %(patient_id)s, t::date, {_COUNTER_VALUES} FROM flags
+        ON CONFLICT (patient_id, day) DO UPDATE SET
+            {", ".join(f"{c} = patient_daily_features.{c} + EXCLUDED.{c}" for c in COUNTER_COLUMNS)}
+    ), f AS (
+        INSERT INTO patient_features (patient_id, {_COUNTER_LIST}, last_glucose, last_reading_time,
+                                      recent_levels, updated_at)
+        SELECT %(patient_id)s, {_COUNTER_VALUES}, g, t, ARRAY[g], CURRENT_TIMESTAMP FROM flags
+        ON CONFLICT (patient_id) DO UPDATE SET
+            {", ".join(f"{c} = patient_features.{c} + EXCLUDED.{c}" for c in COUNTER_COLUMNS)},
+            last_glucose = CASE WHEN EXCLUDED.last_reading_time >= patient_features.last_reading_time
+                                THEN EXCLUDED.last_glucose ELSE patient_features.last_glucose END,
+            last_reading_time = GREATEST(patient_features.last_reading_time, EXCLUDED.last_reading_time),
+            recent_levels = CASE WHEN EXCLUDED.last_reading_time >= patient_features.last_reading_time
+                                 THEN (EXCLUDED.recent_levels || patient_features.recent_levels)[1:%(window)s::int]
+                                 ELSE patient_features.recent_levels END,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING recent_levels
+    )
+    SELECT unnest(recent_levels) AS glucose_level FROM f WHERE (SELECT in_order FROM ordered)
+    UNION ALL
+    SELECT glucose_level FROM (
+        SELECT glucose_level FROM glucose_readings
+        WHERE patient_id = %(patient_id)s AND reading_time <= (SELECT t FROM r)
+        ORDER BY reading_time DESC
+        LIMIT %(window)s
+    ) earlier
+    WHERE NOT (SELECT in_order FROM ordered)
+"""
+
+
+def features_params(data, reading_time=None):
+    return {"patient_id": data.get("patient_id"), "glucose": float(data.get("glucose_level")),
+            "medication_taken": data.get("medication_taken"), "reading_time": reading_time,
+            "hypo": HYPO_THRESHOLD, "hyper": HYPER_THRESHOLD, "window": RECENT_WINDOW}
+
+
+def record_features(cur, entries):
+    # Batch form for synced readings: entries are (patient_id, glucose,
+    # medication_taken, reading_time). Applied oldest first per patient so
+    # episodes and the recent window follow reading order.
+    params = [features_params({"patient_id": p, "glucose_level": g, "medication_taken": m}, t)
+              for p, g, m, t in sorted(entries, key=lambda e: (e[0], e[3]))]
+    if params:
+        cur.executemany(RECORD_FEATURES_SQL, params)
+
+
+def rebuild_features(cur):
+    # Full recomputation from raw history; used to backfill and to repair
+    # drift. Not on any request path.
+    params = {"hypo": HYPO_THRESHOLD, "hyper": HYPER_THRESHOLD, "window": RECENT_WINDOW}
+    cur.execute("TRUNCATE patient_features, patient_daily_features")
+    cur.execute(f"""
+        INSERT INTO patient_daily_features (patient_id, day, {_COUNTER_LIST})
+        SELECT patient_id, t::date, COUNT(*), SUM(g), SUM(g * g), SUM(in_range), SUM(hypo), SUM(hyper),
+               SUM(hypo_episode), SUM(hyper_episode), COUNT(m), COUNT(*) FILTER (WHERE m)
+        FROM (
+            SELECT patient_id, reading_time AS t, glucose_level AS g, medication_taken AS m,
+                   (glucose_level < %(hypo)s)::int AS hypo, (glucose_level > %(hyper)s)::int AS hyper,
+                   (glucose_level BETWEEN %(hypo)s AND %(hyper)s)::int AS in_range,
+                   (glucose_level < %(hypo)s AND NOT COALESCE(LAG(glucose_level) OVER w < %(hypo)s, FALSE))::int
+                       AS hypo_episode,
+                   (glucose_level > %(hyper)s AND NOT COALESCE(LAG(glucose_level) OVER w > %(hyper)s, FALSE))::int
+                       AS hyper_episode
+            FROM glucose_readings
+            WHERE patient_id IS NOT NULL
+            WINDOW w AS (PARTITION BY patient_id ORDER BY reading_time, id)
+        ) r
+        GROUP BY 1, 2
+    """, params)
+    cur.execute(f"""
+        INSERT INTO patient_features (patient_id, {_COUNTER_LIST}, last_glucose, last_reading_time,
+                                      recent_levels, updated_at)
+        SELECT d.patient_id, {", ".join(f"SUM({c})" for c in COUNTER_COLUMNS)},
+               r.recent_levels[1], r.last_reading_time, r.recent_levels, CURRENT_TIMESTAMP
+        FROM patient_daily_features d
+        JOIN (
+            SELECT patient_id, array_agg(glucose_level ORDER BY rn) AS recent_levels,
+                   MAX(reading_time) AS last_reading_time
+            FROM (
+                SELECT patient_id, glucose_level, reading_time,
+                       row_number() OVER (PARTITION BY patient_id ORDER BY reading_time DESC, id DESC) AS rn
+                FROM glucose_readings
+                WHERE patient_id IS NOT NULL
+            ) x
+            WHERE rn <= %(window)s
+            GROUP BY patient_id
+        ) r ON r.patient_id = d.patient_id
+        GROUP BY d.patient_id, r.recent_levels, r.last_reading_time
+    """, params)
+
+
+def summarize(row):
+    # Derived features from a row of counters (any window).
+    n = row["reading_count"] or 0
+    if not n:
+        return {"readings": 0, "mean": None, "sd": None, "cv": None, "time_in_range": None,
+                "hypo_readings": 0, "hyper_readings": 0, "hypo_episodes": 0, "hyper_episodes": 0,
+                "adherence_rate": None}
+    mean = row["glucose_sum"] / n
+    sd = math.sqrt(max(0.0, (row["glucose_sum_sq"] - n * mean * mean) / (n - 1))) if n > 1 else None
+    return {
+        "readings": n,
+        "mean": round(mean, 1),
+        "sd": round(sd, 1) if sd is not None else None,
+        "cv": round(100 * sd / mean, 1) if sd is not None and mean else None,
+        # Share of readings in range; spot checks stand in for continuous
+        # time.
+        "time_in_range": round(100 * row["in_range_count"] / n, 1),
+        "hypo_readings": row["hypo_count"],
+        "hyper_readings": row["hyper_count"],
+        "hypo_episodes": row["hypo_episodes"],
+        "hyper_episodes": row["hyper_episodes"],
+        "adherence_rate": (round(100 * row["medication_taken_count"] / row["medication_known"], 1)
+                           if row["medication_known"] else None),
+    }
+
+
+def fetch_features(cur, patient_id, windows=FEATURE_WINDOWS):
+    # Returns None for a patient without readings.
+    cur.execute(f"""
+        SELECT {_COUNTER_LIST}, last_glucose, last_reading_time, recent_levels, updated_at
+        FROM patient_features WHERE patient_id = %s
+    """, (patient_id,))
+    lifetime = cur.fetchone()
+    if lifetime is None:
+        return None
+    cur.execute(f"""
+        SELECT w.days, {", ".join(f"COALESCE(SUM(d.{c}), 0) AS {c}" for c in COUNTER_COLUMNS)}
+        FROM unnest(%s::int[]) AS w(days)
+        LEFT JOIN patient_daily_features d
+               ON d.patient_id = %s AND d.day > CURRENT_DATE - w.days AND d.day <= CURRENT_DATE
+        GROUP BY w.days
+        ORDER BY w.days
+    """, (list(windows), patient_id))
+    return {
+        "last_glucose": lifetime["last_glucose"],
+        "last_reading_time": lifetime["last_reading_time"],
+        "recent_levels": lifetime["recent_levels"],
+        "lifetime": summarize(lifetime),
+        "windows": {f"{row['days']}d": summarize(row) for row in cur.fetchall()},
+        "updated_at": lifetime["updated_at"],
+    }
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv:
+        print("Usage: python features.py --rebuild")
+        sys.exit(2)
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        rebuild_features(cur)
+        conn.commit()
+        cur.close()
+    print("Patient features rebuilt")
@@ -0,0 +1,153 @@
+import time
+from datetime import date, timedelta
+
+from psycopg import sql
+
+from db import get_db_connection
+from cache import invalidate
+
+# District and village trends for regional planners, served from the
+# geo_stats materialized view (migration 13) instead of the live reading
+# tables. The view holds one row per grain (day, week, month), bucket,
+# district and village; patients are placed by their registered district
+# and village. Active patients are distinct per village and bucket, so they
+# add up across villages but not across buckets. Months archived by
+# partitions.py are kept in geo_stats_archive (migration 19), which the view
+# adds in.
+#
+# REFRESH ... CONCURRENTLY recomputes the whole view but swaps in only the
+# changed rows, so dashboards keep reading while it runs. Schedule it from
+# cron, e.g. every 15 minutes:
+#   python geo.py
+GEO_GRAINS = ("day", "week", "month")
+GEO_DEFAULT_DAYS = 90
+GEO_MAX_DAYS = 731
+GEO_REFRESH_LOCK_ID = 74210003
+
+COUNT_COLUMNS = ("reading_count", "high_count", "medium_count", "low_count", "referral_count",
+                 "active_patients")
+
+
+def refresh_geo_stats(cur):
+    # Returns the refresh time in ms, or None when another refresh holds
+    # the lock. Runs in the caller's transaction.
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (GEO_REFRESH_LOCK_ID,))
+    if not cur.fetchone()["locked"]:
+        return None
+    start = time.perf_counter()
+    cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY geo_stats")
+    duration_ms = int((time.perf_counter() - start) * 1000)
+    cur.execute("""
+        INSERT INTO matview_refreshes (name, refreshed_at, duration_ms)
+        VALUES ('geo_stats', CURRENT_TIMESTAMP, %s)
+        ON CONFLICT (name) DO UPDATE
+        SET refreshed_at = EXCLUDED.refreshed_at, duration_ms = EXCLUDED.duration_ms
+    """, (duration_ms,))
+    return duration_ms
+
+
+def archive_geo_stats(cur, partition):
+    # Adds one glucose_readings partition's counts to geo_stats_archive
+    # before partitions.py drops it, in the same transaction.
+    cur.execute(sql.SQL("""
+        INSERT INTO geo_stats_archive (grain, bucket, district, village, {columns})
+        SELECT g.grain, date_trunc(g.grain, gr.reading_time)::date,
+               COALESCE(p.district, 'Unknown'), COALESCE(p.village, 'Unknown'),
+               COUNT(*),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'High'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Medium'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Low'),
+               COUNT(*) FILTER (WHERE ra.referral_recommended),
+               COUNT(DISTINCT gr.patient_id)
+        FROM {partition} gr
+        JOIN patients p ON p.id = gr.patient_id
+        LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id AND ra.created_at >= gr.reading_time
+        CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS g(grain)
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (grain, bucket, district, village) DO UPDATE SET {updates}
+    """).format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, COUNT_COLUMNS)),
+        partition=sql.Identifier(partition),
+        updates=sql.SQL(", ").join(sql.SQL("{c} = geo_stats_archive.{c} + EXCLUDED.{c}").format(c=sql.Identifier(c))
+                                   for c in COUNT_COLUMNS)))
+
+
+def parse_geo_filters(args):
+    # Raises ValueError for anything malformed or out of range.
+    grain = args.get("grain", "week")
+    if grain not in GEO_GRAINS:
+        raise ValueError(f"grain must be one of {', '.join(GEO_GRAINS)}")
+    end = date.fromisoformat(args["end"]) if args.get("end") else date.today()
+    start = date.fromisoformat(args["start"]) if args.get("start") else end - timedelta(days=GEO_DEFAULT_DAYS - 1)
+    if start > end or (end - start).days >= GEO_MAX_DAYS:
+        raise ValueError(f"start must be on or before end, at most {GEO_MAX_DAYS} days apart")
+    filters = {"grain": grain, "start": start, "end": end}
+    if args.get("district"):
+        filters["district"] = args["district"]
+    if args.get("village"):
+        if "district" not in filters:
+            raise ValueError("village requires district")
+        filters["village"] = args["village"]
+    return filters
+
+
+def _rates(row):
+    readings = row["reading_count"]
+    return {**row, "high_risk_rate": round(100 * row["high_count"] / readings, 1) if readings else None}
+
+
+def fetch_geo_series(cur, filters):
+    # Per-region time series over filters' range: districts by default,
+    # the villages of one district when it is given (drill-down). Buckets
+    # are labelled by their first day and include the partial buckets at
+    # either end of the range.
+    level = "village" if "district" in filters else "district"
+    conditions = ["grain = %(grain)s", "bucket >= date_trunc(%(grain)s, %(start)s::timestamp)::date",
+                  "bucket <= %(end)s"]
+    if "district" in filters:
+        conditions.append("district = %(district)s")
+    if "village" in filters:
+        conditions.append("village = %(village)s")
+    cur.execute(f"""
+        SELECT {level} AS region, bucket, {", ".join(f"SUM({c})::int AS {c}" for c in COUNT_COLUMNS)}
+        FROM geo_stats
+        WHERE {" AND ".join(conditions)}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """, filters)
+
+    regions = {}
+    for row in cur.fetchall():
+        region = regions.setdefault(row.pop("region"), [])
+        region.append(_rates(row))
+    result = []
+    for name, series in regions.items():
+        # Active patients are not additive across buckets, so the totals
+        # leave them out.
+        totals = {c: sum(point[c] for point in series) for c in COUNT_COLUMNS if c != "active_patients"}
+        result.append({level: name, "totals": _rates(totals), "series": series})
+    result.sort(key=lambda r: r["totals"]["reading_count"], reverse=True)
+
+    cur.execute("SELECT refreshed_at, duration_ms FROM matview_refreshes WHERE name = 'geo_stats'")
+    refresh = cur.fetchone()
+    return {
+        "level": level,
+        "grain": filters["grain"],
+        "start": filters["start"],
+        "end": filters["end"],
+        "refreshed_at": refresh["refreshed_at"] if refresh else None,
+        "regions": result,
+    }
+
+
+if __name__ == "__main__":
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        duration_ms = refresh_geo_stats(cur)
+        conn.commit()
+        cur.close()
+    invalidate("geo")
+    if duration_ms is None:
+        print("geo_stats refresh already running")
+    else:
+        print(f"geo_stats refreshed in {duration_ms} ms")
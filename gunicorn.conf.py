@@ -0,0 +1,25 @@
+import os
+
+import advice
+import alert_stream
+import db
+
+# Alert streams hold a thread for as long as a dashboard is open, so workers
+# are threaded instead of gunicorn's one-request-at-a-time sync default.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+
+# The app is imported once in the master and forked, so workers boot
+# without re-importing it and share its pages. Safe because the database
+# pool, advice queue and alert broker are created lazily per process.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+
+def post_fork(server, worker):
+    db.reset_pool()
+
+
+def worker_exit(server, worker):
+    alert_stream.shutdown_alert_stream()
+    advice.shutdown_advice_queue(wait=True)
+    db.close_pool()
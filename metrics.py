@@ -0,0 +1,318 @@
+import os
+import re
+import time
+import random
+import cProfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import psycopg
+from flask import g, request
+
+# Request, query and external-call instrumentation, exported in the
+# Prometheus text format at /metrics. Like the response cache, metrics live
+# in each gunicorn worker; a scrape sees the worker that answered it, so
+# scrape often or aggregate by rate() rather than comparing raw counters.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 500))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/arch-profiles")
+STATEMENT_STATS_SIZE = 500
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (f'{bound:g}',))} {n}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+http_requests = Histogram("arch_http_request_duration_seconds", "Request handling time by route.",
+                          ("method", "route", "status"))
+request_queries = Histogram("arch_http_request_db_queries", "Database statements executed per request.",
+                            ("route",), COUNT_BUCKETS)
+db_queries = Histogram("arch_db_query_duration_seconds", "Database statement execution time.",
+                       ("route",), QUERY_BUCKETS)
+db_acquire = Histogram("arch_db_connection_acquire_seconds", "Time waiting for a pooled connection.",
+                       ("route",), QUERY_BUCKETS)
+n_plus_one = Counter("arch_db_n_plus_one_total",
+                     "Requests that repeated one statement at least N_PLUS_ONE_THRESHOLD times.", ("route",))
+external_calls = Histogram("arch_external_request_duration_seconds", "Latency of calls to external APIs.",
+                           ("service", "outcome"))
+profiles = Counter("arch_profiles_total", "Requests captured by the profiler.", ("route",))
+
+REGISTRY = [http_requests, request_queries, db_queries, db_acquire, n_plus_one, external_calls, profiles]
+
+
+# -------------------- Per-request tracking -------------------- #
+class RequestStats:
+    def __init__(self, route):
+        self.route = route
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.acquire_seconds = 0.0
+        self.statements = defaultdict(int)
+
+
+_current = ContextVar("arch_request_stats", default=None)
+
+_statement_stats = {}
+_statement_lock = threading.Lock()
+
+
+def _statement_key(query, conn):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = query.as_string(conn)
+    return " ".join(query.split())
+
+
+def record_query(query, conn, seconds):
+    stats = _current.get()
+    route = stats.route if stats else "-"
+    db_queries.observe(seconds, route)
+    key = _statement_key(query, conn)
+    if stats:
+        stats.queries += 1
+        stats.query_seconds += seconds
+        stats.statements[key] += 1
+    with _statement_lock:
+        entry = _statement_stats.get(key)
+        if entry is None and len(_statement_stats) < STATEMENT_STATS_SIZE:
+            entry = _statement_stats[key] = {"calls": 0, "total_ms": 0.0, "max_ms": 0.0}
+        if entry is not None:
+            entry["calls"] += 1
+            entry["total_ms"] += seconds * 1000
+            entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        print(f"Slow query ({seconds * 1000:.0f} ms, route {route}): {key[:300]}")
+
+
+def record_acquire(seconds):
+    stats = _current.get()
+    db_acquire.observe(seconds, stats.route if stats else "-")
+    if stats:
+        stats.acquire_seconds += seconds
+
+
+class InstrumentedCursor(psycopg.Cursor):
+    # Installed as the pool's cursor_factory, so every client-side cursor
+    # is timed. Named (server-side) cursors used by exports are not.
+    def execute(self, query, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, *args, **kwargs)
+        finally:
+            record_query(query, self.connection, time.perf_counter() - start)
+
+    def executemany(self, query, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, *args, **kwargs)
+        finally:
+            record_query(query, self.connection, time.perf_counter() - start)
+
+
+class InstrumentedAsyncCursor(psycopg.AsyncCursor):
+    # cursor_factory of the async pool used by asgi.py.
+    async def execute(self, query, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, *args, **kwargs)
+        finally:
+            record_query(query, self.connection, time.perf_counter() - start)
+
+
+@contextmanager
+def track(route):
+    # Attributes queries to a route outside Flask's request hooks, e.g. a
+    # background job.
+    token = _current.set(RequestStats(route))
+    try:
+        yield
+    finally:
+        _finish(_current.get())
+        _current.reset(token)
+
+
+def _finish(stats):
+    request_queries.observe(stats.queries, stats.route)
+    repeated = [(n, key) for key, n in stats.statements.items() if n >= N_PLUS_ONE_THRESHOLD]
+    if repeated:
+        n_plus_one.inc(stats.route)
+        n, key = max(repeated)
+        print(f"Possible N+1 on {stats.route}: {n} executions of {key[:300]}")
+
+
+@contextmanager
+def external_call(service):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        external_calls.observe(time.perf_counter() - start, service, outcome)
+
+
+# -------------------- Profiler -------------------- #
+# cProfile cannot run two profilers at once, so concurrent requests asking
+# for a profile are served unprofiled.
+_profile_lock = threading.Lock()
+
+
+def _is_admin(current_user):
+    # current_user resolves the request's principal (auth.current_user), so
+    # a demoted or revoked admin loses access at once.
+    user = current_user()
+    return user is not None and user["role"] == "admin"
+
+
+def _wants_profile(current_user):
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    asked = request.headers.get("X-Profile") == "1" or request.args.get("_profile") == "1"
+    return asked and _is_admin(current_user)
+
+
+def _dump_profile(profiler, route):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{slug}.prof"
+    path = os.path.join(PROFILE_DIR, name)
+    profiler.dump_stats(path)
+    profiles.inc(route)
+    return name
+
+
+# -------------------- Flask hooks -------------------- #
+def instrument_app(app, current_user):
+    @app.before_request
+    def _start_request():
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        g.metrics_token = _current.set(RequestStats(route))
+        g.metrics_start = time.perf_counter()
+        g.profiler = None
+        if _wants_profile(current_user) and _profile_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _end_request(response):
+        stats = _current.get()
+        if stats is None or "metrics_start" not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        if g.profiler is not None:
+            g.profiler.disable()
+            try:
+                response.headers["X-Profile-Id"] = _dump_profile(g.profiler, stats.route)
+            finally:
+                g.profiler = None
+                _profile_lock.release()
+
+        http_requests.observe(elapsed, request.method, stats.route, str(response.status_code))
+        response.headers["Server-Timing"] = (
+            f'db;dur={stats.query_seconds * 1000:.1f};desc="{stats.queries} queries", '
+            f"db-acquire;dur={stats.acquire_seconds * 1000:.1f}, app;dur={elapsed * 1000:.1f}")
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exc):
+        # Runs after streamed bodies finish too; errors that skipped
+        # after_request still release the profiler here.
+        if getattr(g, "profiler", None) is not None:
+            g.profiler.disable()
+            g.profiler = None
+            _profile_lock.release()
+        token = g.pop("metrics_token", None)
+        stats = _current.get()
+        if token is not None and stats is not None:
+            _finish(stats)
+            try:
+                _current.reset(token)
+            except ValueError:
+                # A streamed body can finish in a different context.
+                _current.set(None)
+
+
+# -------------------- Export -------------------- #
+def metrics_authorized(current_user):
+    if METRICS_TOKEN:
+        return request.headers.get("Authorization") == f"Bearer {METRICS_TOKEN}"
+    return _is_admin(current_user)
+
+
+def render_metrics(gauges=()):
+    # gauges: (name, help, value) tuples sampled at scrape time.
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, help, value in gauges:
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value:g}"])
+    return "\n".join(lines) + "\n"
+
+
+def statement_stats(limit=50):
+    with _statement_lock:
+        rows = [dict(statement=key, **entry) for key, entry in _statement_stats.items()]
+    for row in rows:
+        row["avg_ms"] = round(row["total_ms"] / row["calls"], 3)
+        row["total_ms"] = round(row["total_ms"], 3)
+        row["max_ms"] = round(row["max_ms"], 3)
+    return sorted(rows, key=lambda r: r["total_ms"], reverse=True)[:limit]
@@ -0,0 +1,826 @@
+import re
+import sys
+import unicodedata
+from datetime import date
+
+from psycopg import sql
+
+from db import get_db_connection
+
+# Arbitrary key for pg_advisory_lock so concurrently booting workers apply
+# migrations one at a time.
+MIGRATION_LOCK_ID = 74210001
+
+# -------------------- Data steps -------------------- #
+# Callables used by the migrations below. Each is a frozen copy of the code
+# as it was when its migration was written, so later changes to search,
+# partitions and the rest never change what an old migration does on a
+# fresh install. Never edit one; a new migration gets its own.
+def _v5_normalize_name(text):
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    return " ".join(text.split())
+
+
+def _v5_backfill_search_names(cur):
+    cur.execute("SELECT id, full_name FROM patients WHERE search_name IS NULL")
+    rows = cur.fetchall()
+    cur.executemany("UPDATE patients SET search_name = %s WHERE id = %s",
+                    [(_v5_normalize_name(r["full_name"]), r["id"]) for r in rows])
+
+
+def _v11_add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _v11_partition_history_tables(cur):
+    # Rebuilds glucose_readings and risk_assessments as tables partitioned
+    # by month and copies their rows across. Primary keys on a partitioned
+    # table must include the partition key, so (id) becomes (id, <key>) and
+    # the foreign keys pointing at the old ids are dropped; the ids are still
+    # unique, as they come from the same sequences. Monthly partitions cover
+    # the oldest row's month through three months ahead; partitions.py
+    # creates later ones.
+    tables = {"glucose_readings": "reading_time", "risk_assessments": "created_at"}
+    cur.execute("ALTER TABLE risk_assessments DROP CONSTRAINT IF EXISTS risk_assessments_reading_id_fkey")
+    cur.execute("ALTER TABLE alerts DROP CONSTRAINT IF EXISTS alerts_risk_assessment_id_fkey")
+    since = None
+    for table, key in tables.items():
+        old = sql.Identifier(f"{table}_unpartitioned")
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), old))
+        cur.execute(sql.SQL("SELECT MIN({})::date AS first FROM {}").format(sql.Identifier(key), old))
+        first = cur.fetchone()["first"]
+        if first and (since is None or first < since):
+            since = first
+        cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE ({})").format(
+            sql.Identifier(table), old, sql.Identifier(key)))
+        cur.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN {} SET NOT NULL").format(
+            sql.Identifier(table), sql.Identifier(key)))
+        cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} DEFAULT").format(
+            sql.Identifier(f"{table}_default"), sql.Identifier(table)))
+
+    this_month = date.today().replace(day=1)
+    month = min(this_month, since.replace(day=1)) if since else this_month
+    while month <= _v11_add_months(this_month, 3):
+        upper = _v11_add_months(month, 1)
+        for table in tables:
+            cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(
+                sql.Identifier(f"{table}_y{month.year:04d}m{month.month:02d}"), sql.Identifier(table),
+                sql.Literal(month.isoformat()), sql.Literal(upper.isoformat())))
+        month = upper
+
+    for table in tables:
+        old = f"{table}_unpartitioned"
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id') AS seq", (old,))
+        sequence = cur.fetchone()["seq"]
+        cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM {}").format(sql.Identifier(table), sql.Identifier(old)))
+        # The id default still calls the old sequence; keep it when the old
+        # table goes.
+        cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+        cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(old)))
+        cur.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY {}.id").format(sql.SQL(sequence), sql.Identifier(table)))
+
+
+# Migrations run in order, each in its own transaction, and are recorded in
+# schema_migrations. A step is either SQL or a callable taking the cursor.
+# Never edit an applied migration; append a new one.
+MIGRATIONS = [
+    (1, "base_schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(255) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            full_name VARCHAR(255) NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            email VARCHAR(255),
+            phone VARCHAR(50),
+            district VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS patients (
+            id SERIAL PRIMARY KEY,
+            patient_id VARCHAR(50) UNIQUE NOT NULL,
+            full_name VARCHAR(255) NOT NULL,
+            age INTEGER,
+            gender VARCHAR(10),
+            village VARCHAR(255),
+            district VARCHAR(255),
+            phone VARCHAR(50),
+            emergency_contact VARCHAR(50),
+            diabetes_type VARCHAR(20),
+            diagnosis_date DATE,
+            registered_by INTEGER REFERENCES users(id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS glucose_readings (
+            id SERIAL PRIMARY KEY,
+            patient_id INTEGER REFERENCES patients(id),
+            chv_id INTEGER REFERENCES users(id),
+            glucose_level FLOAT NOT NULL,
+            reading_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            medication_taken BOOLEAN,
+            diet_description TEXT,
+            stress_level VARCHAR(50),
+            food_availability VARCHAR(50),
+            symptoms TEXT,
+            notes TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS risk_assessments (
+            id SERIAL PRIMARY KEY,
+            reading_id INTEGER REFERENCES glucose_readings(id),
+            patient_id INTEGER REFERENCES patients(id),
+            risk_level VARCHAR(20) NOT NULL,
+            risk_score FLOAT,
+            ai_advice TEXT,
+            warning_flags TEXT,
+            referral_recommended BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS alerts (
+            id SERIAL PRIMARY KEY,
+            patient_id INTEGER REFERENCES patients(id),
+            risk_assessment_id INTEGER REFERENCES risk_assessments(id),
+            alert_type VARCHAR(50),
+            message TEXT,
+            status VARCHAR(20) DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            resolved_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS visit_summaries (
+            id SERIAL PRIMARY KEY,
+            patient_id INTEGER REFERENCES patients(id),
+            chv_id INTEGER REFERENCES users(id),
+            visit_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            summary TEXT,
+            recommendations TEXT,
+            follow_up_date DATE
+        )
+        """,
+    ]),
+    (2, "ai_advice_queue_and_cache", [
+        "ALTER TABLE risk_assessments ADD COLUMN IF NOT EXISTS advice_status VARCHAR(20) DEFAULT 'default'",
+        """
+        CREATE TABLE IF NOT EXISTS ai_advice_cache (
+            fingerprint CHAR(64) PRIMARY KEY,
+            inputs JSONB NOT NULL,
+            advice TEXT NOT NULL,
+            hit_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_hit_at TIMESTAMP
+        )
+        """,
+    ]),
+    (3, "hot_path_indexes", [
+        # Last-N readings per patient and the patient readings window.
+        "CREATE INDEX IF NOT EXISTS idx_glucose_readings_patient_time ON glucose_readings (patient_id, reading_time DESC)",
+        # CHV dashboard counts and high-risk list.
+        "CREATE INDEX IF NOT EXISTS idx_glucose_readings_chv_time ON glucose_readings (chv_id, reading_time)",
+        # Admin 30-day window.
+        "CREATE INDEX IF NOT EXISTS idx_glucose_readings_time ON glucose_readings (reading_time)",
+        "CREATE INDEX IF NOT EXISTS idx_risk_assessments_reading ON risk_assessments (reading_id)",
+        "CREATE INDEX IF NOT EXISTS idx_risk_assessments_created ON risk_assessments (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_status_created ON alerts (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_patient ON alerts (patient_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)",
+    ]),
+    (4, "patient_search_trigram", [
+        # pg_trgm needs CREATE privilege on the database; without it the
+        # search keeps working, just without trigram acceleration.
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        EXCEPTION WHEN insufficient_privilege THEN
+            RAISE NOTICE 'pg_trgm unavailable, skipping trigram indexes';
+        END
+        $$
+        """,
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                EXECUTE 'CREATE INDEX IF NOT EXISTS idx_patients_full_name_trgm ON patients USING gin (full_name gin_trgm_ops)';
+                EXECUTE 'CREATE INDEX IF NOT EXISTS idx_patients_patient_id_trgm ON patients USING gin (patient_id gin_trgm_ops)';
+            END IF;
+        END
+        $$
+        """,
+    ]),
+    (5, "patient_search_name", [
+        "ALTER TABLE patients ADD COLUMN IF NOT EXISTS search_name VARCHAR(255)",
+        _v5_backfill_search_names,
+        "CREATE INDEX IF NOT EXISTS idx_patients_search_name_prefix ON patients (search_name text_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_patient_id_prefix ON patients (patient_id text_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_district ON patients (district)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_registered_by ON patients (registered_by)",
+        # The folded search_name replaces full_name as the trigram target.
+        "DROP INDEX IF EXISTS idx_patients_full_name_trgm",
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                EXECUTE 'CREATE INDEX IF NOT EXISTS idx_patients_search_name_trgm ON patients USING gin (search_name gin_trgm_ops)';
+            END IF;
+        END
+        $$
+        """,
+    ]),
+    (6, "dashboard_rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS daily_chv_stats (
+            day DATE NOT NULL,
+            chv_id INTEGER NOT NULL REFERENCES users(id),
+            reading_count INTEGER NOT NULL DEFAULT 0,
+            high_count INTEGER NOT NULL DEFAULT 0,
+            medium_count INTEGER NOT NULL DEFAULT 0,
+            low_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, chv_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_daily_chv_stats_chv ON daily_chv_stats (chv_id, day)",
+        """
+        CREATE TABLE IF NOT EXISTS daily_district_stats (
+            day DATE NOT NULL,
+            district VARCHAR(255) NOT NULL,
+            reading_count INTEGER NOT NULL DEFAULT 0,
+            high_count INTEGER NOT NULL DEFAULT 0,
+            medium_count INTEGER NOT NULL DEFAULT 0,
+            low_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, district)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chv_patients (
+            chv_id INTEGER NOT NULL REFERENCES users(id),
+            patient_id INTEGER NOT NULL REFERENCES patients(id),
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chv_id, patient_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chv_totals (
+            chv_id INTEGER PRIMARY KEY REFERENCES users(id),
+            reading_count INTEGER NOT NULL DEFAULT 0,
+            patient_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # Backfill from existing history.
+        "TRUNCATE daily_chv_stats, daily_district_stats, chv_patients, chv_totals",
+        """
+        INSERT INTO daily_chv_stats (day, chv_id, reading_count, high_count, medium_count, low_count)
+        SELECT gr.reading_time::date, gr.chv_id, COUNT(*),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'High'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Medium'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Low')
+        FROM glucose_readings gr
+        LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id
+        WHERE gr.chv_id IS NOT NULL
+        GROUP BY 1, 2
+        """,
+        """
+        INSERT INTO daily_district_stats (day, district, reading_count, high_count, medium_count, low_count)
+        SELECT gr.reading_time::date, COALESCE(p.district, 'Unknown'), COUNT(*),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'High'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Medium'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Low')
+        FROM glucose_readings gr
+        JOIN patients p ON p.id = gr.patient_id
+        LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id
+        GROUP BY 1, 2
+        """,
+        """
+        INSERT INTO chv_patients (chv_id, patient_id, first_seen)
+        SELECT chv_id, patient_id, MIN(reading_time)
+        FROM glucose_readings
+        WHERE chv_id IS NOT NULL AND patient_id IS NOT NULL
+        GROUP BY chv_id, patient_id
+        """,
+        """
+        INSERT INTO chv_totals (chv_id, reading_count, patient_count)
+        SELECT s.chv_id, s.reading_count, COALESCE(cp.patient_count, 0)
+        FROM (SELECT chv_id, SUM(reading_count) AS reading_count
+              FROM daily_chv_stats GROUP BY chv_id) s
+        LEFT JOIN (SELECT chv_id, COUNT(*) AS patient_count
+                   FROM chv_patients GROUP BY chv_id) cp ON cp.chv_id = s.chv_id
+        """,
+    ]),
+    (7, "offline_sync_client_uuid", [
+        "ALTER TABLE glucose_readings ADD COLUMN IF NOT EXISTS client_uuid UUID",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_glucose_readings_client_uuid ON glucose_readings (client_uuid)",
+    ]),
+    (8, "readings_series_covering_index", [
+        # Lets chart series queries run as index-only scans.
+        "CREATE INDEX IF NOT EXISTS idx_glucose_readings_patient_time_cov ON glucose_readings (patient_id, reading_time DESC) INCLUDE (glucose_level)",
+        "DROP INDEX IF EXISTS idx_glucose_readings_patient_time",
+    ]),
+    (9, "alert_notify_trigger", [
+        # Every new alert is announced on the arch_alerts channel (delivered
+        # at commit) with what the dashboards need to update in place: the
+        # high-risk list row, the CHVs who see the patient, and whether it is
+        # the patient's only pending alert of the week (the CHV count is of
+        # distinct patients).
+        """
+        CREATE OR REPLACE FUNCTION alert_event(alert_id INTEGER) RETURNS json AS $$
+            SELECT json_build_object(
+                'alert_id', a.id,
+                'chv_id', gr.chv_id,
+                'chv_ids', ARRAY(SELECT cp.chv_id FROM chv_patients cp WHERE cp.patient_id = a.patient_id),
+                'new_high_risk_patient', NOT EXISTS (
+                    SELECT 1 FROM alerts other
+                    WHERE other.patient_id = a.patient_id AND other.id <> a.id
+                      AND other.status = 'pending' AND other.created_at >= NOW() - INTERVAL '7 days'),
+                'patient', json_build_object(
+                    'id', p.id, 'patient_id', p.patient_id, 'full_name', p.full_name,
+                    'village', p.village, 'risk_level', ra.risk_level,
+                    'glucose_level', gr.glucose_level, 'reading_time', gr.reading_time))
+            FROM alerts a
+            JOIN patients p ON p.id = a.patient_id
+            LEFT JOIN risk_assessments ra ON ra.id = a.risk_assessment_id
+            LEFT JOIN glucose_readings gr ON gr.id = ra.reading_id
+            WHERE a.id = alert_id
+        $$ LANGUAGE sql STABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION notify_alert() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('arch_alerts', alert_event(NEW.id)::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS alerts_notify ON alerts",
+        "CREATE TRIGGER alerts_notify AFTER INSERT ON alerts FOR EACH ROW EXECUTE FUNCTION notify_alert()",
+    ]),
+    (10, "user_session_revocation", [
+        # Sessions carry the session_version they were issued under; bumping
+        # it (or clearing is_active) ends every session of that user.
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS session_version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE",
+    ]),
+    (11, "monthly_partitions", [
+        # Copies all history once; on a large database run it in a
+        # maintenance window.
+        _v11_partition_history_tables,
+        "ALTER TABLE glucose_readings ADD CONSTRAINT glucose_readings_pkey PRIMARY KEY (id, reading_time)",
+        "ALTER TABLE risk_assessments ADD CONSTRAINT risk_assessments_pkey PRIMARY KEY (id, created_at)",
+        "ALTER TABLE glucose_readings ADD FOREIGN KEY (patient_id) REFERENCES patients(id)",
+        "ALTER TABLE glucose_readings ADD FOREIGN KEY (chv_id) REFERENCES users(id)",
+        "ALTER TABLE risk_assessments ADD FOREIGN KEY (patient_id) REFERENCES patients(id)",
+        "CREATE INDEX idx_glucose_readings_patient_time_cov ON glucose_readings (patient_id, reading_time DESC) INCLUDE (glucose_level)",
+        "CREATE INDEX idx_glucose_readings_chv_time ON glucose_readings (chv_id, reading_time)",
+        "CREATE INDEX idx_glucose_readings_time ON glucose_readings (reading_time)",
+        # Unique indexes must include the partition key; sync.py looks up
+        # client_uuid first, and the index still serves that lookup.
+        "CREATE UNIQUE INDEX idx_glucose_readings_client_uuid ON glucose_readings (client_uuid, reading_time)",
+        "CREATE INDEX idx_risk_assessments_reading ON risk_assessments (reading_id)",
+        "CREATE INDEX idx_risk_assessments_created ON risk_assessments (created_at)",
+    ]),
+    (12, "patient_features", [
+        """
+        CREATE TABLE IF NOT EXISTS patient_features (
+            patient_id INTEGER PRIMARY KEY REFERENCES patients(id),
+            reading_count INTEGER NOT NULL DEFAULT 0,
+            glucose_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            glucose_sum_sq DOUBLE PRECISION NOT NULL DEFAULT 0,
+            in_range_count INTEGER NOT NULL DEFAULT 0,
+            hypo_count INTEGER NOT NULL DEFAULT 0,
+            hyper_count INTEGER NOT NULL DEFAULT 0,
+            hypo_episodes INTEGER NOT NULL DEFAULT 0,
+            hyper_episodes INTEGER NOT NULL DEFAULT 0,
+            medication_known INTEGER NOT NULL DEFAULT 0,
+            medication_taken_count INTEGER NOT NULL DEFAULT 0,
+            last_glucose DOUBLE PRECISION,
+            last_reading_time TIMESTAMP,
+            recent_levels DOUBLE PRECISION[] NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS patient_daily_features (
+            patient_id INTEGER NOT NULL REFERENCES patients(id),
+            day DATE NOT NULL,
+            reading_count INTEGER NOT NULL DEFAULT 0,
+            glucose_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            glucose_sum_sq DOUBLE PRECISION NOT NULL DEFAULT 0,
+            in_range_count INTEGER NOT NULL DEFAULT 0,
+            hypo_count INTEGER NOT NULL DEFAULT 0,
+            hyper_count INTEGER NOT NULL DEFAULT 0,
+            hypo_episodes INTEGER NOT NULL DEFAULT 0,
+            hyper_episodes INTEGER NOT NULL DEFAULT 0,
+            medication_known INTEGER NOT NULL DEFAULT 0,
+            medication_taken_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (patient_id, day)
+        )
+        """,
+        # Backfill from existing history; thresholds are 70 / 180 mg/dL and
+        # the recent window is 5 readings.
+        "TRUNCATE patient_features, patient_daily_features",
+        """
+        INSERT INTO patient_daily_features (patient_id, day, reading_count, glucose_sum, glucose_sum_sq,
+                                            in_range_count, hypo_count, hyper_count, hypo_episodes,
+                                            hyper_episodes, medication_known, medication_taken_count)
+        SELECT patient_id, t::date, COUNT(*), SUM(g), SUM(g * g), SUM(in_range), SUM(hypo), SUM(hyper),
+               SUM(hypo_episode), SUM(hyper_episode), COUNT(m), COUNT(*) FILTER (WHERE m)
+        FROM (
+            SELECT patient_id, reading_time AS t, glucose_level AS g, medication_taken AS m,
+                   (glucose_level < 70)::int AS hypo, (glucose_level > 180)::int AS hyper,
+                   (glucose_level BETWEEN 70 AND 180)::int AS in_range,
+                   (glucose_level < 70 AND NOT COALESCE(LAG(glucose_level) OVER w < 70, FALSE))::int
+                       AS hypo_episode,
+                   (glucose_level > 180 AND NOT COALESCE(LAG(glucose_level) OVER w > 180, FALSE))::int
+                       AS hyper_episode
+            FROM glucose_readings
+            WHERE patient_id IS NOT NULL
+            WINDOW w AS (PARTITION BY patient_id ORDER BY reading_time, id)
+        ) r
+        GROUP BY 1, 2
+        """,
+        """
+        INSERT INTO patient_features (patient_id, reading_count, glucose_sum, glucose_sum_sq, in_range_count,
+                                      hypo_count, hyper_count, hypo_episodes, hyper_episodes,
+                                      medication_known, medication_taken_count, last_glucose,
+                                      last_reading_time, recent_levels, updated_at)
+        SELECT d.patient_id, SUM(d.reading_count), SUM(d.glucose_sum), SUM(d.glucose_sum_sq),
+               SUM(d.in_range_count), SUM(d.hypo_count), SUM(d.hyper_count), SUM(d.hypo_episodes),
+               SUM(d.hyper_episodes), SUM(d.medication_known), SUM(d.medication_taken_count),
+               r.recent_levels[1], r.last_reading_time, r.recent_levels, CURRENT_TIMESTAMP
+        FROM patient_daily_features d
+        JOIN (
+            SELECT patient_id, array_agg(glucose_level ORDER BY rn) AS recent_levels,
+                   MAX(reading_time) AS last_reading_time
+            FROM (
+                SELECT patient_id, glucose_level, reading_time,
+                       row_number() OVER (PARTITION BY patient_id ORDER BY reading_time DESC, id DESC) AS rn
+                FROM glucose_readings
+                WHERE patient_id IS NOT NULL
+            ) x
+            WHERE rn <= 5
+            GROUP BY patient_id
+        ) r ON r.patient_id = d.patient_id
+        GROUP BY d.patient_id, r.recent_levels, r.last_reading_time
+        """,
+    ]),
+    (13, "geo_stats_view", [
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS geo_stats AS
+        SELECT g.grain, date_trunc(g.grain, r.reading_time)::date AS bucket, r.district, r.village,
+               COUNT(*) AS reading_count,
+               COUNT(*) FILTER (WHERE r.risk_level = 'High') AS high_count,
+               COUNT(*) FILTER (WHERE r.risk_level = 'Medium') AS medium_count,
+               COUNT(*) FILTER (WHERE r.risk_level = 'Low') AS low_count,
+               COUNT(*) FILTER (WHERE r.referral) AS referral_count,
+               COUNT(DISTINCT r.patient_id) AS active_patients
+        FROM (
+            SELECT gr.reading_time, gr.patient_id, ra.risk_level,
+                   COALESCE(p.district, 'Unknown') AS district, COALESCE(p.village, 'Unknown') AS village,
+                   COALESCE(ra.referral_recommended, FALSE) AS referral
+            FROM glucose_readings gr
+            JOIN patients p ON p.id = gr.patient_id
+            LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id AND ra.created_at >= gr.reading_time
+        ) r
+        CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS g(grain)
+        GROUP BY 1, 2, 3, 4
+        """,
+        # REFRESH ... CONCURRENTLY needs a unique index covering every row.
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_geo_stats_key ON geo_stats (grain, bucket, district, village)",
+        "CREATE INDEX IF NOT EXISTS idx_geo_stats_district ON geo_stats (grain, district, bucket)",
+        """
+        CREATE TABLE IF NOT EXISTS matview_refreshes (
+            name VARCHAR(255) PRIMARY KEY,
+            refreshed_at TIMESTAMP NOT NULL,
+            duration_ms INTEGER
+        )
+        """,
+        "INSERT INTO matview_refreshes (name, refreshed_at) VALUES ('geo_stats', CURRENT_TIMESTAMP) ON CONFLICT DO NOTHING",
+    ]),
+    (14, "alert_queue", [
+        "ALTER TABLE alerts ADD COLUMN IF NOT EXISTS occurrences INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE alerts ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP",
+        "ALTER TABLE alerts ADD COLUMN IF NOT EXISTS notified_at TIMESTAMP",
+        "ALTER TABLE alerts ADD COLUMN IF NOT EXISTS escalated_at TIMESTAMP",
+        "UPDATE alerts SET last_seen_at = created_at, notified_at = created_at",
+        # Dashboards only ever counted the last week's pending alerts; older
+        # ones are closed rather than escalated all at once.
+        """
+        UPDATE alerts SET status = 'expired', resolved_at = CURRENT_TIMESTAMP
+        WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - INTERVAL '7 days'
+        """,
+        # Fold each patient's remaining pending alerts into their latest.
+        """
+        WITH ranked AS (
+            SELECT id, row_number() OVER w AS rn, COUNT(*) OVER (PARTITION BY patient_id) AS n,
+                   MIN(created_at) OVER (PARTITION BY patient_id) AS first_seen
+            FROM alerts
+            WHERE status = 'pending'
+            WINDOW w AS (PARTITION BY patient_id ORDER BY created_at DESC, id DESC)
+        ), merged AS (
+            UPDATE alerts a SET status = 'merged', resolved_at = CURRENT_TIMESTAMP
+            FROM ranked r WHERE a.id = r.id AND r.rn > 1
+        )
+        UPDATE alerts a SET occurrences = r.n, last_seen_at = a.created_at, created_at = r.first_seen
+        FROM ranked r WHERE a.id = r.id AND r.rn = 1
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_open_patient ON alerts (patient_id) WHERE status IN ('pending', 'escalated')",
+        """
+        CREATE TABLE IF NOT EXISTS alert_queue (
+            id BIGSERIAL PRIMARY KEY,
+            patient_id INTEGER NOT NULL REFERENCES patients(id),
+            risk_assessment_id INTEGER,
+            chv_id INTEGER REFERENCES users(id),
+            message TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Wakes the alert worker; notifications are folded per transaction.
+        """
+        CREATE OR REPLACE FUNCTION notify_alert_queue() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('arch_alert_queue', '');
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "CREATE TRIGGER alert_queue_notify AFTER INSERT ON alert_queue FOR EACH STATEMENT EXECUTE FUNCTION notify_alert_queue()",
+        # The worker announces alerts itself, in batches.
+        "DROP TRIGGER IF EXISTS alerts_notify ON alerts",
+        """
+        CREATE TABLE IF NOT EXISTS chv_open_alerts (
+            chv_id INTEGER PRIMARY KEY REFERENCES users(id),
+            open_count INTEGER NOT NULL DEFAULT 0,
+            escalated_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        INSERT INTO chv_open_alerts (chv_id, open_count, escalated_count)
+        SELECT cp.chv_id, COUNT(*), COUNT(*) FILTER (WHERE a.status = 'escalated')
+        FROM alerts a
+        JOIN chv_patients cp ON cp.patient_id = a.patient_id
+        WHERE a.status IN ('pending', 'escalated')
+        GROUP BY cp.chv_id
+        """,
+    ]),
+    (15, "sync_client_uuids", [
+        # Offline sync deduplicates on client_uuid alone. glucose_readings
+        # cannot have a unique index on it since migration 11 (unique keys
+        # must include reading_time), so each UUID is claimed here.
+        """
+        CREATE TABLE IF NOT EXISTS sync_client_uuids (
+            client_uuid UUID PRIMARY KEY,
+            reading_id INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        INSERT INTO sync_client_uuids (client_uuid, reading_id)
+        SELECT DISTINCT ON (client_uuid) client_uuid, id
+        FROM glucose_readings
+        WHERE client_uuid IS NOT NULL
+        ORDER BY client_uuid, id
+        ON CONFLICT (client_uuid) DO NOTHING
+        """,
+    ]),
+    (16, "alert_queue_reading_time", [
+        # Synced readings were queued with created_at set to their reading
+        # time, which the alert worker took as the alert's age. The reading
+        # time gets its own column; created_at is when it was queued.
+        "ALTER TABLE alert_queue ADD COLUMN IF NOT EXISTS reading_time TIMESTAMP",
+        "UPDATE alert_queue SET reading_time = created_at",
+        "ALTER TABLE alert_queue ALTER COLUMN reading_time SET DEFAULT CURRENT_TIMESTAMP",
+        "ALTER TABLE alert_queue ALTER COLUMN reading_time SET NOT NULL",
+    ]),
+    (17, "alert_event_ids", [
+        # Alert stream events are numbered from one counter row rather than
+        # by alert id, which reminders, escalations and resolutions reuse.
+        # The row stays locked until the numbering transaction commits, so
+        # ids become visible in order and last_event_id is never ahead of an
+        # uncommitted event.
+        """
+        CREATE TABLE IF NOT EXISTS alert_event_counter (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            last_event_id BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        # Starts past the alert ids streams used as event ids until now.
+        """
+        INSERT INTO alert_event_counter (id, last_event_id)
+        SELECT TRUE, COALESCE(MAX(id), 0) FROM alerts
+        ON CONFLICT (id) DO NOTHING
+        """,
+        # With one open alert per patient, the worker's event kind says
+        # whether it is new; the old flag is dropped, and so is the trigger
+        # function migration 14 stopped using.
+        """
+        CREATE OR REPLACE FUNCTION alert_event(alert_id INTEGER) RETURNS json AS $$
+            SELECT json_build_object(
+                'alert_id', a.id,
+                'chv_id', gr.chv_id,
+                'chv_ids', ARRAY(SELECT cp.chv_id FROM chv_patients cp WHERE cp.patient_id = a.patient_id),
+                'patient', json_build_object(
+                    'id', p.id, 'patient_id', p.patient_id, 'full_name', p.full_name,
+                    'village', p.village, 'risk_level', ra.risk_level,
+                    'glucose_level', gr.glucose_level, 'reading_time', gr.reading_time))
+            FROM alerts a
+            JOIN patients p ON p.id = a.patient_id
+            LEFT JOIN risk_assessments ra ON ra.id = a.risk_assessment_id
+            LEFT JOIN glucose_readings gr ON gr.id = ra.reading_id
+            WHERE a.id = alert_id
+        $$ LANGUAGE sql STABLE
+        """,
+        "DROP FUNCTION IF EXISTS notify_alert()",
+    ]),
+    (18, "drop_daily_district_stats", [
+        # Never read: district analytics come from geo_stats (migration 13).
+        "DROP TABLE IF EXISTS daily_district_stats",
+    ]),
+    (19, "geo_stats_archive", [
+        # Counts for months archived by partitions.py, so geo_stats keeps
+        # them after their readings are dropped.
+        """
+        CREATE TABLE IF NOT EXISTS geo_stats_archive (
+            grain VARCHAR(10) NOT NULL,
+            bucket DATE NOT NULL,
+            district VARCHAR(255) NOT NULL,
+            village VARCHAR(255) NOT NULL,
+            reading_count BIGINT NOT NULL,
+            high_count BIGINT NOT NULL,
+            medium_count BIGINT NOT NULL,
+            low_count BIGINT NOT NULL,
+            referral_count BIGINT NOT NULL,
+            active_patients BIGINT NOT NULL,
+            PRIMARY KEY (grain, bucket, district, village)
+        )
+        """,
+        "DROP MATERIALIZED VIEW IF EXISTS geo_stats",
+        # A week straddling an archived month is summed from both halves,
+        # so a patient active in both counts twice in its active_patients.
+        """
+        CREATE MATERIALIZED VIEW geo_stats AS
+        SELECT grain, bucket, district, village,
+               SUM(reading_count)::bigint AS reading_count, SUM(high_count)::bigint AS high_count,
+               SUM(medium_count)::bigint AS medium_count, SUM(low_count)::bigint AS low_count,
+               SUM(referral_count)::bigint AS referral_count, SUM(active_patients)::bigint AS active_patients
+        FROM (
+            SELECT g.grain, date_trunc(g.grain, r.reading_time)::date AS bucket, r.district, r.village,
+                   COUNT(*) AS reading_count,
+                   COUNT(*) FILTER (WHERE r.risk_level = 'High') AS high_count,
+                   COUNT(*) FILTER (WHERE r.risk_level = 'Medium') AS medium_count,
+                   COUNT(*) FILTER (WHERE r.risk_level = 'Low') AS low_count,
+                   COUNT(*) FILTER (WHERE r.referral) AS referral_count,
+                   COUNT(DISTINCT r.patient_id) AS active_patients
+            FROM (
+                SELECT gr.reading_time, gr.patient_id, ra.risk_level,
+                       COALESCE(p.district, 'Unknown') AS district, COALESCE(p.village, 'Unknown') AS village,
+                       COALESCE(ra.referral_recommended, FALSE) AS referral
+                FROM glucose_readings gr
+                JOIN patients p ON p.id = gr.patient_id
+                LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id AND ra.created_at >= gr.reading_time
+            ) r
+            CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS g(grain)
+            GROUP BY 1, 2, 3, 4
+            UNION ALL
+            SELECT grain, bucket, district, village, reading_count, high_count, medium_count, low_count,
+                   referral_count, active_patients
+            FROM geo_stats_archive
+        ) s
+        GROUP BY 1, 2, 3, 4
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_geo_stats_key ON geo_stats (grain, bucket, district, village)",
+        "CREATE INDEX IF NOT EXISTS idx_geo_stats_district ON geo_stats (grain, district, bucket)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _applied_versions(cur):
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row["version"] for row in cur.fetchall()}
+
+
+def run_migrations(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    # Fast path for an up-to-date schema: no advisory lock.
+    if LATEST_VERSION in _applied_versions(cur):
+        conn.commit()
+        cur.close()
+        return []
+
+    applied_now = []
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    conn.commit()
+    try:
+        applied = _applied_versions(cur)
+        conn.commit()
+        for version, name, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            with conn.transaction():
+                for statement in statements:
+                    if callable(statement):
+                        statement(cur)
+                    else:
+                        cur.execute(statement)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                            (version, name))
+            print(f"Applied migration {version}: {name}")
+            applied_now.append(version)
+    finally:
+        conn.rollback()
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+        cur.close()
+    return applied_now
+
+
+# -------------------- Index usage checks -------------------- #
+# Hot-path queries and the index each one must use. Checked by
+# tests/test_migrations.py, or by hand after schema changes:
+#   python migrations.py --check-indexes
+INDEX_CHECKS = [
+    ("recent readings per patient", """
+        SELECT glucose_level, reading_time FROM glucose_readings
+        WHERE patient_id = 1 ORDER BY reading_time DESC LIMIT 5
+    """, "idx_glucose_readings_patient_time_cov"),
+    ("patient readings window", """
+        SELECT gr.id FROM glucose_readings gr
+        WHERE gr.patient_id = 1 AND gr.reading_time >= NOW() - INTERVAL '30 days'
+    """, "idx_glucose_readings_patient_time_cov"),
+    ("chv readings", """
+        SELECT COUNT(*) FROM glucose_readings
+        WHERE chv_id = 1 AND reading_time >= CURRENT_DATE
+    """, "idx_glucose_readings_chv_time"),
+    ("assessment by reading", """
+        SELECT risk_level FROM risk_assessments WHERE reading_id = 1
+    """, "idx_risk_assessments_reading"),
+    ("patient name prefix", """
+        SELECT id FROM patients WHERE search_name LIKE 'ngo%'
+    """, "idx_patients_search_name_prefix"),
+    ("alerts due for escalation", """
+        SELECT id FROM alerts
+        WHERE status = 'pending' AND created_at < NOW() - INTERVAL '48 hours'
+    """, "idx_alerts_status_created"),
+    ("open alerts", """
+        SELECT COUNT(*) FROM alerts WHERE status IN ('pending', 'escalated')
+    """, "idx_alerts_open_patient"),
+]
+
+
+def check_index_usage(conn):
+    # Seq scans are disabled so small development tables still show which
+    # index the planner would pick at scale.
+    cur = conn.cursor()
+    failures = []
+    with conn.transaction():
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for label, query, index_name in INDEX_CHECKS:
+            cur.execute("EXPLAIN " + query)
+            plan = "\n".join(list(row.values())[0] for row in cur.fetchall())
+            # On partitioned tables the plan names each partition's own
+            # index, attached to the parent index.
+            cur.execute("""
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(%s)
+            """, (index_name,))
+            names = [index_name] + [row["relname"] for row in cur.fetchall()]
+            # Whole names only, so idx_x cannot pass on idx_x_prefix.
+            if not any(re.search(rf"\b{re.escape(name)}\b", plan) for name in names):
+                failures.append((label, index_name, plan))
+    cur.close()
+    return failures
+
+
+if __name__ == "__main__":
+    with get_db_connection() as conn:
+        applied = run_migrations(conn)
+        print(f"Schema at version {LATEST_VERSION} ({len(applied)} applied)")
+        if "--check-indexes" in sys.argv:
+            failures = check_index_usage(conn)
+            for label, index_name, plan in failures:
+                print(f"FAIL {label}: expected {index_name}\n{plan}")
+            if failures:
+                sys.exit(1)
+            print(f"All {len(INDEX_CHECKS)} index checks passed")
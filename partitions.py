@@ -0,0 +1,173 @@
+import os
+import re
+import sys
+import gzip
+from datetime import date, datetime
+
+from psycopg import sql
+
+from db import get_db_connection
+from geo import archive_geo_stats
+
+# glucose_readings and risk_assessments are range-partitioned by month
+# (migration 11), so time-windowed queries only touch the months they cover
+# and each month's indexes stay small. Partitions are created ahead of time
+# by ensure_partitions(); anything outside them lands in the DEFAULT
+# partition and is moved into its month on the next run. Months older than
+# PARTITION_RETENTION_MONTHS are archived to gzipped CSV and dropped; their
+# regional counts move to geo_stats_archive first, and chv_patients (which
+# alert streams and resolve rights use) is never rebuilt from raw rows, so
+# neither loses the month.
+#
+# Run daily from cron:
+#   python partitions.py            # create upcoming partitions
+#   python partitions.py --archive  # ... and archive expired ones
+PARTITIONED_TABLES = {"glucose_readings": "reading_time", "risk_assessments": "created_at"}
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", 3))
+PARTITION_RETENTION_MONTHS = int(os.environ.get("PARTITION_RETENTION_MONTHS", 24))
+PARTITION_ARCHIVE_DIR = os.environ.get("PARTITION_ARCHIVE_DIR", "archive")
+PARTITION_LOCK_ID = 74210002
+
+_PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_months(cur, table):
+    # [(month, partition name)] of the monthly partitions attached to table.
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (table,))
+    partitions = []
+    for row in cur.fetchall():
+        match = _PARTITION_NAME.search(row["relname"])
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), row["relname"]))
+    return sorted(partitions)
+
+
+def _create_partition(cur, table, key, month, move_rows):
+    name = sql.Identifier(partition_name(table, month))
+    parent = sql.Identifier(table)
+    lo, hi = sql.Literal(month.isoformat()), sql.Literal(_add_months(month, 1).isoformat())
+    if not move_rows:
+        cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(
+            name, parent, lo, hi))
+        return
+    # Rows for this month already sit in the DEFAULT partition, which would
+    # make the plain CREATE fail; move them into the new table first.
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+        name, parent))
+    cur.execute(sql.SQL("""
+        WITH moved AS (DELETE FROM {default} WHERE {key} >= {lo} AND {key} < {hi} RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved
+    """).format(default=sql.Identifier(f"{table}_default"), key=sql.Identifier(key), lo=lo, hi=hi, name=name))
+    cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})").format(
+        parent, name, lo, hi))
+
+
+def ensure_partitions(cur, since=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    # Creates the partitions from this month (or since's month, when
+    # earlier) through months_ahead, plus one for every month that has
+    # rows in a DEFAULT partition. Returns the names created. Runs in the
+    # caller's transaction.
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+    this_month = _month_start(date.today())
+    first = min(this_month, _month_start(since)) if since else this_month
+    created = []
+    for table, key in PARTITIONED_TABLES.items():
+        cur.execute(sql.SQL("SELECT DISTINCT date_trunc('month', {})::date AS month FROM {}").format(
+            sql.Identifier(key), sql.Identifier(f"{table}_default")))
+        stray = {row["month"] for row in cur.fetchall()}
+        existing = {month for month, _ in partition_months(cur, table)}
+        wanted = set(stray)
+        month = first
+        while month <= _add_months(this_month, months_ahead):
+            wanted.add(month)
+            month = _add_months(month, 1)
+        for month in sorted(wanted - existing):
+            _create_partition(cur, table, key, month, month in stray)
+            created.append(partition_name(table, month))
+    return created
+
+
+def _archive_partition(conn, table, name, archive_dir):
+    # The file is written and fsynced before the partition is dropped, so
+    # an interrupted run at worst leaves a duplicate archive behind.
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.{datetime.now().strftime('%Y%m%dT%H%M%S')}.csv.gz")
+    cur = conn.cursor()
+    try:
+        with conn.transaction():
+            # Readers are unaffected; a backdated write into this month
+            # waits, so nothing is added after the copy.
+            cur.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(sql.Identifier(name)))
+            with open(path + ".tmp", "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as out:
+                    with cur.copy(sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+                            sql.Identifier(name))) as copy:
+                        for chunk in copy:
+                            out.write(chunk)
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(path + ".tmp", path)
+            # DETACH takes a brief exclusive lock on the parent; give up
+            # rather than queue every request behind a long query.
+            if table == "glucose_readings":
+                archive_geo_stats(cur, name)
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                sql.Identifier(table), sql.Identifier(name)))
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+    except Exception:
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        raise
+    finally:
+        cur.close()
+    return path
+
+
+def archive_partitions(conn, retention_months=PARTITION_RETENTION_MONTHS,
+                       archive_dir=PARTITION_ARCHIVE_DIR, dry_run=False):
+    # Archives every monthly partition that ends before the retention
+    # window, glucose_readings first so the geo counts still see its
+    # assessments. Dashboard rollups keep their counts for archived months,
+    # but `python rollups.py --rebuild` afterwards only recounts what is
+    # left (chv_patients excepted).
+    cutoff = _add_months(_month_start(date.today()), -retention_months)
+    cur = conn.cursor()
+    expired = [(table, name) for table in PARTITIONED_TABLES
+               for month, name in partition_months(cur, table) if month < cutoff]
+    conn.commit()
+    cur.close()
+    archived = []
+    for table, name in expired:
+        path = None if dry_run else _archive_partition(conn, table, name, archive_dir)
+        archived.append((name, path))
+    return archived
+
+
+if __name__ == "__main__":
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        created = ensure_partitions(cur)
+        conn.commit()
+        cur.close()
+        for name in created:
+            print(f"Created partition {name}")
+        if "--archive" in sys.argv:
+            for name, path in archive_partitions(conn, dry_run="--dry-run" in sys.argv):
+                print(f"Archived {name} to {path}" if path else f"Would archive {name}")
@@ -0,0 +1,68 @@
+import json
+
+from advice import get_default_advice
+from risk import score_reading
+
+# Statements and parameters for recording one glucose reading. The WSGI
+# route in app.py and the async route in asgi.py both build on these, so the
+# two serving modes store identical rows.
+INSERT_READING_SQL = """
+    INSERT INTO glucose_readings (patient_id, chv_id, glucose_level, medication_taken,
+                                  diet_description, stress_level, food_availability, symptoms, notes)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING id
+"""
+
+INSERT_ASSESSMENT_SQL = """
+    INSERT INTO risk_assessments (reading_id, patient_id, risk_level, risk_score,
+                                  ai_advice, warning_flags, referral_recommended, advice_status)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING id
+"""
+
+# High-risk readings are queued for the alert worker (alerts.py), which
+# deduplicates them into the patient's open alert.
+ENQUEUE_ALERT_SQL = """
+    INSERT INTO alert_queue (patient_id, risk_assessment_id, chv_id, message)
+    VALUES (%s, %s, %s, %s)
+"""
+
+SET_ADVICE_STATUS_SQL = "UPDATE risk_assessments SET advice_status = %s WHERE id = %s"
+
+
+def reading_params(data, chv_id):
+    return (data.get("patient_id"), chv_id, data.get("glucose_level"),
+            data.get("medication_taken"), data.get("diet_description"),
+            data.get("stress_level"), data.get("food_availability"),
+            data.get("symptoms"), data.get("notes"))
+
+
+def assess_reading(data, recent_readings):
+    # recent_readings: rows from features.RECORD_FEATURES_SQL, including
+    # this reading.
+    glucose = float(data.get("glucose_level"))
+    risk_data = score_reading(glucose, data.get("medication_taken"), data.get("stress_level"),
+                              [r["glucose_level"] for r in recent_readings])
+    # AI advice is produced off the request path by the advice queue.
+    risk_data["advice"] = get_default_advice(glucose, risk_data["risk_level"])
+    return risk_data
+
+
+def assessment_params(reading_id, data, risk_data, advice_status):
+    return (reading_id, data.get("patient_id"), risk_data["risk_level"],
+            risk_data["risk_score"], risk_data["advice"],
+            json.dumps(risk_data["warnings"]), risk_data["referral_needed"], advice_status)
+
+
+def alert_message(glucose_level):
+    return f"High-risk patient detected. Glucose: {glucose_level} mg/dL"
+
+
+def alert_params(data, assessment_id, chv_id):
+    return (data.get("patient_id"), assessment_id, chv_id, alert_message(data.get("glucose_level")))
+
+
+def invalidation_tags(data, chv_id):
+    # Alert counts change when the alert worker processes the queue, which
+    # invalidates "alerts" itself.
+    return (f"patient:{data.get('patient_id')}", f"chv:{chv_id}", "admin")
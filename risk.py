@@ -0,0 +1,155 @@
+import sys
+import json
+
+import numpy as np
+
+# Rule-based risk scoring shared by the single-reading endpoint, batch sync
+# and historical re-scoring. All rules live in score_batch; the scalar
+# score_reading is a length-1 call so the paths can never diverge.
+RECENT_WINDOW = 5
+
+HYPO_THRESHOLD = 70
+HYPER_THRESHOLD = 180
+SEVERE_HYPER_THRESHOLD = 250
+HIGH_STRESS_LEVELS = ["High", "Very High"]
+HIGH_RISK_SCORE = 70
+MEDIUM_RISK_SCORE = 40
+
+RISK_LEVELS = np.array(["Low", "Medium", "High"])
+
+# Warning bits, in the order the messages are reported.
+WARN_HYPO = 1
+WARN_SEVERE_HYPER = 2
+WARN_HYPER = 4
+WARN_NO_MEDICATION = 8
+WARN_CONSISTENT_HIGH = 16
+WARNING_MESSAGES = [
+    (WARN_HYPO, "Hypoglycemia detected"),
+    (WARN_SEVERE_HYPER, "Severe hyperglycemia"),
+    (WARN_HYPER, "Hyperglycemia detected"),
+    (WARN_NO_MEDICATION, "Medication not taken"),
+    (WARN_CONSISTENT_HIGH, "Consistently high readings"),
+]
+
+
+def decode_warnings(mask):
+    return [message for bit, message in WARNING_MESSAGES if mask & bit]
+
+
+# warning_flags column values for every possible bitmask.
+WARNING_JSON = np.array([json.dumps(decode_warnings(mask)) for mask in range(32)], dtype=object)
+
+
+def score_batch(glucose, medication_taken, stress_level, recent_count, recent_high):
+    # glucose, medication_taken, stress_level: one entry per reading.
+    # recent_count / recent_high: how many of the patient's last RECENT_WINDOW
+    # readings (including this one) exist / are above HYPER_THRESHOLD.
+    glucose = np.asarray(glucose, dtype=np.float64)
+    medication_taken = np.asarray(medication_taken, dtype=bool)
+    stressed = np.isin(np.asarray(stress_level, dtype=object), HIGH_STRESS_LEVELS)
+    recent_count = np.asarray(recent_count, dtype=np.int32)
+    recent_high = np.asarray(recent_high, dtype=np.int32)
+
+    hypo = glucose < HYPO_THRESHOLD
+    severe = ~hypo & (glucose > SEVERE_HYPER_THRESHOLD)
+    hyper = ~hypo & ~severe & (glucose > HYPER_THRESHOLD)
+    no_medication = ~medication_taken
+    consistent_high = (recent_count >= 3) & (recent_high >= 3)
+
+    risk_score = (40 * hypo + 50 * severe + 30 * hyper + 20 * no_medication
+                  + 15 * stressed + 25 * consistent_high).astype(np.int32)
+    level_code = (risk_score >= MEDIUM_RISK_SCORE).astype(np.int8) + (risk_score >= HIGH_RISK_SCORE)
+    warning_mask = (WARN_HYPO * hypo | WARN_SEVERE_HYPER * severe | WARN_HYPER * hyper
+                    | WARN_NO_MEDICATION * no_medication
+                    | WARN_CONSISTENT_HIGH * consistent_high).astype(np.int8)
+
+    return {
+        "risk_score": risk_score,
+        "level_code": level_code,
+        "risk_level": RISK_LEVELS[level_code],
+        "warning_mask": warning_mask,
+        "referral_needed": level_code == 2,
+    }
+
+
+def score_reading(glucose, medication_taken, stress_level, recent_levels):
+    # recent_levels: glucose values of the patient's latest readings,
+    # newest first, including this one.
+    recent_levels = recent_levels[:RECENT_WINDOW]
+    scored = score_batch([float(glucose)], [bool(medication_taken)], [stress_level],
+                         [len(recent_levels)],
+                         [sum(1 for level in recent_levels if level > HYPER_THRESHOLD)])
+    return {
+        "risk_level": str(scored["risk_level"][0]),
+        "risk_score": int(scored["risk_score"][0]),
+        "warnings": decode_warnings(int(scored["warning_mask"][0])),
+        "referral_needed": bool(scored["referral_needed"][0])
+    }
+
+
+# -------------------- Historical re-scoring -------------------- #
+def rescore_history(conn, batch_size=50000):
+    # Re-applies the current rules to every stored assessment, e.g. after a
+    # threshold change. The window function reproduces the "last five
+    # readings" each assessment saw; a WITH HOLD cursor lets each chunk
+    # commit independently.
+    updated = 0
+    with conn.cursor(name="risk_rescore", withhold=True) as source:
+        source.itersize = batch_size
+        source.execute("""
+            SELECT ra.id, w.glucose_level, w.medication_taken, w.stress_level,
+                   w.recent_count, w.recent_high
+            FROM (
+                SELECT id, glucose_level, medication_taken, stress_level,
+                       COUNT(*) OVER recent AS recent_count,
+                       COUNT(*) FILTER (WHERE glucose_level > %s) OVER recent AS recent_high
+                FROM glucose_readings
+                WINDOW recent AS (PARTITION BY patient_id ORDER BY reading_time, id
+                                  ROWS BETWEEN %s PRECEDING AND CURRENT ROW)
+            ) w
+            JOIN risk_assessments ra ON ra.reading_id = w.id
+        """, (HYPER_THRESHOLD, RECENT_WINDOW - 1))
+        conn.commit()
+
+        cur = conn.cursor()
+        while True:
+            rows = source.fetchmany(batch_size)
+            if not rows:
+                break
+            scored = score_batch([r["glucose_level"] for r in rows],
+                                 [bool(r["medication_taken"]) for r in rows],
+                                 [r["stress_level"] for r in rows],
+                                 [r["recent_count"] for r in rows],
+                                 [r["recent_high"] for r in rows])
+            cur.execute("""
+                UPDATE risk_assessments ra
+                SET risk_score = x.risk_score, risk_level = x.risk_level,
+                    warning_flags = x.warning_flags, referral_recommended = x.referral
+                FROM unnest(%s::int[], %s::float8[], %s::text[], %s::text[], %s::bool[])
+                     AS x(id, risk_score, risk_level, warning_flags, referral)
+                WHERE ra.id = x.id
+            """, ([r["id"] for r in rows], scored["risk_score"].tolist(),
+                  scored["risk_level"].tolist(), WARNING_JSON[scored["warning_mask"]].tolist(),
+                  scored["referral_needed"].tolist()))
+            conn.commit()
+            updated += len(rows)
+            print(f"Re-scored {updated} assessments")
+        cur.close()
+    return updated
+
+
+if __name__ == "__main__":
+    if "--rescore" not in sys.argv:
+        print("Usage: python risk.py --rescore")
+        sys.exit(2)
+    from db import get_db_connection
+    from rollups import rebuild_rollups
+
+    with get_db_connection() as conn:
+        total = rescore_history(conn)
+        # Daily risk-level counts are derived from the assessments.
+        cur = conn.cursor()
+        rebuild_rollups(cur)
+        conn.commit()
+        cur.close()
+    print(f"Done: {total} assessments re-scored, rollups rebuilt")
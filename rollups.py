@@ -0,0 +1,131 @@
+import sys
+from collections import Counter
+
+from db import get_db_connection
+
+# Daily counters maintained in the same transaction as each reading insert,
+# so the dashboards never aggregate raw glucose_readings history.
+RISK_COLUMNS = {"High": "high_count", "Medium": "medium_count", "Low": "low_count"}
+
+
+def reading_rollup_statements(chv_id, patient_id, risk_level, reading_time=None):
+    # (sql, params) pairs, so the async route can run the same upserts.
+    risk_column = RISK_COLUMNS[risk_level]
+    params = {"chv_id": chv_id, "patient_id": patient_id, "reading_time": reading_time}
+    return [
+        (f"""
+            INSERT INTO daily_chv_stats (day, chv_id, reading_count, {risk_column})
+            VALUES (COALESCE(%(reading_time)s::timestamp, CURRENT_TIMESTAMP)::date, %(chv_id)s, 1, 1)
+            ON CONFLICT (day, chv_id) DO UPDATE
+            SET reading_count = daily_chv_stats.reading_count + 1,
+                {risk_column} = daily_chv_stats.{risk_column} + 1
+        """, params),
+        # The patient counts towards chv_totals only the first time this
+        # CHV records a reading for them.
+        ("""
+            WITH new_patient AS (
+                INSERT INTO chv_patients (chv_id, patient_id)
+                VALUES (%(chv_id)s, %(patient_id)s)
+                ON CONFLICT (chv_id, patient_id) DO NOTHING
+                RETURNING patient_id
+            )
+            INSERT INTO chv_totals (chv_id, reading_count, patient_count)
+            VALUES (%(chv_id)s, 1, (SELECT COUNT(*) FROM new_patient))
+            ON CONFLICT (chv_id) DO UPDATE
+            SET reading_count = chv_totals.reading_count + 1,
+                patient_count = chv_totals.patient_count + EXCLUDED.patient_count
+        """, params),
+    ]
+
+
+def record_reading(cur, chv_id, patient_id, risk_level, reading_time=None):
+    for statement, params in reading_rollup_statements(chv_id, patient_id, risk_level, reading_time):
+        cur.execute(statement, params)
+
+
+def record_readings(cur, chv_id, entries):
+    # Batch form of record_reading for synced readings: entries are
+    # (patient_id, risk_level, reading_time) and each rollup row is upserted
+    # once per batch instead of once per reading.
+    if not entries:
+        return
+    patient_ids = sorted({patient_id for patient_id, _, _ in entries})
+
+    by_day = {}
+    for _, risk_level, reading_time in entries:
+        by_day.setdefault(reading_time.date(), Counter())[risk_level] += 1
+
+    cur.executemany("""
+        INSERT INTO daily_chv_stats (day, chv_id, reading_count, high_count, medium_count, low_count)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (day, chv_id) DO UPDATE
+        SET reading_count = daily_chv_stats.reading_count + EXCLUDED.reading_count,
+            high_count = daily_chv_stats.high_count + EXCLUDED.high_count,
+            medium_count = daily_chv_stats.medium_count + EXCLUDED.medium_count,
+            low_count = daily_chv_stats.low_count + EXCLUDED.low_count
+    """, [(day, chv_id, sum(c.values()), c["High"], c["Medium"], c["Low"])
+          for day, c in sorted(by_day.items())])
+
+    cur.execute("""
+        INSERT INTO chv_patients (chv_id, patient_id)
+        SELECT %s, unnest(%s::int[])
+        ON CONFLICT (chv_id, patient_id) DO NOTHING
+        RETURNING patient_id
+    """, (chv_id, patient_ids))
+    new_patients = len(cur.fetchall())
+
+    cur.execute("""
+        INSERT INTO chv_totals (chv_id, reading_count, patient_count)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (chv_id) DO UPDATE
+        SET reading_count = chv_totals.reading_count + EXCLUDED.reading_count,
+            patient_count = chv_totals.patient_count + EXCLUDED.patient_count
+    """, (chv_id, len(entries), new_patients))
+
+
+def rebuild_rollups(cur):
+    # Full recomputation from raw history; used to backfill and to repair
+    # drift (e.g. after manual data fixes). Not on any request path.
+    # chv_patients is topped up rather than truncated: it also holds the
+    # patients a CHV saw only in months partitions.py has archived.
+    cur.execute("TRUNCATE daily_chv_stats, chv_totals")
+    cur.execute("""
+        INSERT INTO daily_chv_stats (day, chv_id, reading_count, high_count, medium_count, low_count)
+        SELECT gr.reading_time::date, gr.chv_id, COUNT(*),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'High'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Medium'),
+               COUNT(*) FILTER (WHERE ra.risk_level = 'Low')
+        FROM glucose_readings gr
+        LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id
+        WHERE gr.chv_id IS NOT NULL
+        GROUP BY 1, 2
+    """)
+    cur.execute("""
+        INSERT INTO chv_patients (chv_id, patient_id, first_seen)
+        SELECT chv_id, patient_id, MIN(reading_time)
+        FROM glucose_readings
+        WHERE chv_id IS NOT NULL AND patient_id IS NOT NULL
+        GROUP BY chv_id, patient_id
+        ON CONFLICT (chv_id, patient_id) DO UPDATE
+        SET first_seen = LEAST(chv_patients.first_seen, EXCLUDED.first_seen)
+    """)
+    cur.execute("""
+        INSERT INTO chv_totals (chv_id, reading_count, patient_count)
+        SELECT s.chv_id, s.reading_count, COALESCE(cp.patient_count, 0)
+        FROM (SELECT chv_id, SUM(reading_count) AS reading_count
+              FROM daily_chv_stats GROUP BY chv_id) s
+        LEFT JOIN (SELECT chv_id, COUNT(*) AS patient_count
+                   FROM chv_patients GROUP BY chv_id) cp ON cp.chv_id = s.chv_id
+    """)
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv:
+        print("Usage: python rollups.py --rebuild")
+        sys.exit(2)
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        rebuild_rollups(cur)
+        conn.commit()
+        cur.close()
+    print("Rollups rebuilt")
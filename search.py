@@ -0,0 +1,127 @@
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+
+PATIENT_ID_RE = re.compile(r"^ARCH-\d{8}-[0-9A-F]{6}$")
+PATIENT_ID_PREFIX_RE = re.compile(r"^ARCH-[0-9A-F-]*$")
+
+PATIENT_COLUMNS = "id, patient_id, full_name, age, gender, village, phone"
+
+_trigram_available = None
+
+
+def normalize_name(text):
+    # Case and accent folding shared by the stored search_name column and
+    # incoming queries ("Ngọc Éyébé" and "ngoc eyebe" match).
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    return " ".join(text.split())
+
+
+def trigram_available(cur):
+    global _trigram_available
+    if _trigram_available is None:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trigram_available = cur.fetchone() is not None
+    return _trigram_available
+
+
+def parse_cursor(cursor):
+    # Cursors are "<score>:<id>" from the previous page's last row. A
+    # malformed one restarts at the first page.
+    if not cursor:
+        return None
+    try:
+        score, row_id = cursor.split(":", 1)
+        score = Decimal(score)
+        if not score.is_finite():
+            return None
+        return score, int(row_id)
+    except (ValueError, InvalidOperation):
+        return None
+
+
+def _scope_clause(scope, user_id, district, params):
+    clauses = []
+    if scope == "mine":
+        clauses.append("registered_by = %(user_id)s")
+        params["user_id"] = user_id
+    elif scope == "district":
+        clauses.append("district = (SELECT district FROM users WHERE id = %(user_id)s)")
+        params["user_id"] = user_id
+    if district:
+        clauses.append("district = %(district)s")
+        params["district"] = district
+    return "".join(f" AND {c}" for c in clauses)
+
+
+def search_patients(cur, query, user_id, scope="all", district=None, cursor=None, limit=SEARCH_PAGE_SIZE):
+    limit = max(1, min(int(limit), SEARCH_MAX_PAGE_SIZE))
+    query = (query or "").strip()
+    params = {"limit": limit + 1}
+    scope_sql = _scope_clause(scope, user_id, district, params)
+
+    # Exact fast path for full patient IDs: a single unique-index lookup.
+    if PATIENT_ID_RE.match(query.upper()):
+        params["patient_id"] = query.upper()
+        cur.execute(f"""
+            SELECT {PATIENT_COLUMNS}, 1 AS score FROM patients
+            WHERE patient_id = %(patient_id)s{scope_sql}
+        """, params)
+        return cur.fetchall(), None
+
+    name = normalize_name(query)
+    if not name:
+        score_sql = "0"
+        where_sql = "TRUE"
+    elif PATIENT_ID_PREFIX_RE.match(query.upper()):
+        params["id_prefix"] = query.upper() + "%"
+        score_sql = "1"
+        where_sql = "patient_id LIKE %(id_prefix)s"
+    else:
+        params["name"] = name
+        params["name_prefix"] = name + "%"
+        params["name_contains"] = "%" + name + "%"
+        params["id_contains"] = "%" + query.upper() + "%"
+        prefix_sql = "(search_name LIKE %(name_prefix)s)::int"
+        if trigram_available(cur):
+            score_sql = f"{prefix_sql} + similarity(search_name, %(name)s)"
+            where_sql = ("(search_name %% %(name)s OR search_name LIKE %(name_contains)s"
+                         " OR patient_id LIKE %(id_contains)s)")
+        else:
+            score_sql = prefix_sql
+            where_sql = "(search_name LIKE %(name_contains)s OR patient_id LIKE %(id_contains)s)"
+
+    keyset_sql = ""
+    after = parse_cursor(cursor)
+    if after:
+        params["after_score"], params["after_id"] = after
+        keyset_sql = "WHERE (score, id) < (%(after_score)s::numeric, %(after_id)s)"
+
+    # Scores are rounded to numeric so the keyset cursor compares exactly.
+    cur.execute(f"""
+        SELECT * FROM (
+            SELECT {PATIENT_COLUMNS}, ROUND(({score_sql})::numeric, 6) AS score
+            FROM patients
+            WHERE {where_sql}{scope_sql}
+        ) ranked
+        {keyset_sql}
+        ORDER BY score DESC, id DESC
+        LIMIT %(limit)s
+    """, params)
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last['score']}:{last['id']}"
+    for row in rows:
+        row["score"] = float(row["score"])
+    return rows, next_cursor
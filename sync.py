@@ -0,0 +1,230 @@
+import json
+import uuid
+from datetime import datetime, timezone
+
+from advice import get_default_advice
+from risk import HYPER_THRESHOLD, RECENT_WINDOW, decode_warnings, score_batch
+from features import record_features
+from readings import alert_message
+from rollups import record_readings
+
+SYNC_MAX_BATCH = 500
+
+READING_FIELDS = ("medication_taken", "diet_description", "stress_level",
+                  "food_availability", "symptoms", "notes")
+
+
+def _parse_item(item):
+    try:
+        client_uuid = str(uuid.UUID(str(item.get("client_uuid"))))
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("client_uuid must be a UUID")
+    try:
+        patient_id = int(item.get("patient_id"))
+        glucose = float(item.get("glucose_level"))
+    except (ValueError, TypeError):
+        raise ValueError("patient_id and glucose_level are required numbers")
+
+    reading_time = item.get("reading_time")
+    if reading_time:
+        try:
+            reading_time = datetime.fromisoformat(str(reading_time).replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError("reading_time must be ISO 8601")
+        if reading_time.tzinfo is not None:
+            # Stored like CURRENT_TIMESTAMP: naive UTC (db.DB_TIMEZONE).
+            reading_time = reading_time.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        reading_time = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    parsed = {"client_uuid": client_uuid, "patient_id": patient_id,
+              "glucose_level": glucose, "reading_time": reading_time}
+    for field in READING_FIELDS:
+        value = item.get(field)
+        if value is not None:
+            value = bool(value) if field == "medication_taken" else str(value)
+        parsed[field] = value
+    return parsed
+
+
+def _recent_history(cur, items):
+    # The RECENT_WINDOW stored readings at or before each item's time, in
+    # one round trip: offline items are usually older than the patient's
+    # latest readings, so probing only the latest would leave their windows
+    # short. Each LATERAL probe uses idx_glucose_readings_patient_time_cov.
+    probes = sorted({(i["patient_id"], i["reading_time"]) for i in items})
+    cur.execute("""
+        SELECT DISTINCT r.id, x.pid AS patient_id, r.glucose_level, r.reading_time
+        FROM unnest(%s::int[], %s::timestamp[]) AS x(pid, t)
+        CROSS JOIN LATERAL (
+            SELECT id, glucose_level, reading_time FROM glucose_readings
+            WHERE patient_id = x.pid AND reading_time <= x.t
+            ORDER BY reading_time DESC
+            LIMIT %s
+        ) r
+    """, ([p for p, _ in probes], [t for _, t in probes], RECENT_WINDOW))
+    history = {}
+    for row in cur.fetchall():
+        history.setdefault(row["patient_id"], []).append((row["reading_time"], row["glucose_level"]))
+    return history
+
+
+def _score_batch(items, history):
+    # Build each reading's "last five" window from the stored and batch
+    # readings at or before it (what RECORD_FEATURES_SQL scores it from),
+    # then score the whole batch in one call.
+    by_patient = {}
+    for item in items:
+        by_patient.setdefault(item["patient_id"], []).append(item)
+    ordered = []
+    recent_count = []
+    recent_high = []
+    for patient_id, patient_items in by_patient.items():
+        timeline = list(history.get(patient_id, []))
+        for item in sorted(patient_items, key=lambda i: i["reading_time"]):
+            timeline.append((item["reading_time"], item["glucose_level"]))
+            recent = sorted((t for t in timeline if t[0] <= item["reading_time"]),
+                            key=lambda t: t[0], reverse=True)[:RECENT_WINDOW]
+            ordered.append(item)
+            recent_count.append(len(recent))
+            recent_high.append(sum(1 for _, level in recent if level > HYPER_THRESHOLD))
+
+    scored = score_batch([i["glucose_level"] for i in ordered],
+                         [bool(i["medication_taken"]) for i in ordered],
+                         [i["stress_level"] for i in ordered],
+                         recent_count, recent_high)
+    for n, item in enumerate(ordered):
+        risk_level = str(scored["risk_level"][n])
+        item["risk"] = {
+            "risk_level": risk_level,
+            "risk_score": int(scored["risk_score"][n]),
+            "warnings": decode_warnings(int(scored["warning_mask"][n])),
+            "referral_needed": bool(scored["referral_needed"][n]),
+            "advice": get_default_advice(item["glucose_level"], risk_level),
+        }
+
+
+def ingest_readings(cur, chv_id, raw_items):
+    results = [None] * len(raw_items)
+    items = []
+    seen = set()
+    for index, raw in enumerate(raw_items):
+        if not isinstance(raw, dict):
+            raw = {}
+        try:
+            item = _parse_item(raw)
+        except ValueError as e:
+            results[index] = {"client_uuid": raw.get("client_uuid"), "status": "error", "message": str(e)}
+            continue
+        if item["client_uuid"] in seen:
+            results[index] = {"client_uuid": item["client_uuid"], "status": "duplicate"}
+            continue
+        seen.add(item["client_uuid"])
+        item["index"] = index
+        items.append(item)
+
+    if items:
+        cur.execute("SELECT id FROM patients WHERE id = ANY(%s)", (sorted({i["patient_id"] for i in items}),))
+        known = {row["id"] for row in cur.fetchall()}
+        for item in [i for i in items if i["patient_id"] not in known]:
+            results[item["index"]] = {"client_uuid": item["client_uuid"], "status": "error",
+                                      "message": "Unknown patient"}
+        items = [i for i in items if i["patient_id"] in known]
+
+    if not items:
+        return results
+
+    # Each client_uuid is claimed in sync_client_uuids before its reading is
+    # written. The table is keyed on client_uuid alone (glucose_readings'
+    # unique keys must include reading_time, which the server fills in for
+    # items sent without one), so a retry or a concurrent sync of the same
+    # queue waits for the first claim to commit and is reported as a
+    # duplicate.
+    cur.execute("""
+        INSERT INTO sync_client_uuids (client_uuid)
+        SELECT unnest(%s::uuid[])
+        ON CONFLICT (client_uuid) DO NOTHING
+        RETURNING client_uuid::text AS client_uuid
+    """, ([i["client_uuid"] for i in items],))
+    claimed = {row["client_uuid"] for row in cur.fetchall()}
+    duplicates = [i for i in items if i["client_uuid"] not in claimed]
+    if duplicates:
+        cur.execute("""
+            SELECT client_uuid::text AS client_uuid, reading_id FROM sync_client_uuids
+            WHERE client_uuid = ANY(%s::uuid[])
+        """, ([i["client_uuid"] for i in duplicates],))
+        existing = {row["client_uuid"]: row["reading_id"] for row in cur.fetchall()}
+        for item in duplicates:
+            results[item["index"]] = {"client_uuid": item["client_uuid"], "status": "duplicate",
+                                      "reading_id": existing.get(item["client_uuid"])}
+    items = [i for i in items if i["client_uuid"] in claimed]
+
+    if not items:
+        return results
+
+    _score_batch(items, _recent_history(cur, items))
+
+    # One INSERT ... SELECT FROM unnest per table keeps the batch at a fixed
+    # number of round trips.
+    cur.execute("""
+        INSERT INTO glucose_readings (client_uuid, patient_id, chv_id, glucose_level, reading_time,
+                                      medication_taken, diet_description, stress_level,
+                                      food_availability, symptoms, notes)
+        SELECT u, p, %s, g, t, m, d, s, f, sy, n
+        FROM unnest(%s::uuid[], %s::int[], %s::float8[], %s::timestamp[], %s::bool[],
+                    %s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+             AS x(u, p, g, t, m, d, s, f, sy, n)
+        RETURNING id, client_uuid::text AS client_uuid
+    """, (chv_id,
+          [i["client_uuid"] for i in items], [i["patient_id"] for i in items],
+          [i["glucose_level"] for i in items], [i["reading_time"] for i in items],
+          [i["medication_taken"] for i in items], [i["diet_description"] for i in items],
+          [i["stress_level"] for i in items], [i["food_availability"] for i in items],
+          [i["symptoms"] for i in items], [i["notes"] for i in items]))
+    inserted = {row["client_uuid"]: row["id"] for row in cur.fetchall()}
+    cur.execute("""
+        UPDATE sync_client_uuids s SET reading_id = x.id
+        FROM unnest(%s::uuid[], %s::int[]) AS x(u, id)
+        WHERE s.client_uuid = x.u
+    """, (list(inserted), list(inserted.values())))
+
+    created = items
+    for item in created:
+        item["reading_id"] = inserted[item["client_uuid"]]
+
+    cur.execute("""
+        INSERT INTO risk_assessments (reading_id, patient_id, risk_level, risk_score,
+                                      ai_advice, warning_flags, referral_recommended, created_at)
+        SELECT * FROM unnest(%s::int[], %s::int[], %s::text[], %s::float8[],
+                             %s::text[], %s::text[], %s::bool[], %s::timestamp[])
+        RETURNING id, reading_id
+    """, ([i["reading_id"] for i in created], [i["patient_id"] for i in created],
+          [i["risk"]["risk_level"] for i in created], [i["risk"]["risk_score"] for i in created],
+          [i["risk"]["advice"] for i in created], [json.dumps(i["risk"]["warnings"]) for i in created],
+          [i["risk"]["referral_needed"] for i in created], [i["reading_time"] for i in created]))
+    assessment_ids = {row["reading_id"]: row["id"] for row in cur.fetchall()}
+
+    high = [i for i in created if i["risk"]["risk_level"] == "High"]
+    if high:
+        cur.execute("""
+            INSERT INTO alert_queue (patient_id, risk_assessment_id, chv_id, message, reading_time)
+            SELECT p, a, %s, m, t
+            FROM unnest(%s::int[], %s::int[], %s::text[], %s::timestamp[]) AS x(p, a, m, t)
+        """, (chv_id, [i["patient_id"] for i in high], [assessment_ids[i["reading_id"]] for i in high],
+              [alert_message(i["glucose_level"]) for i in high], [i["reading_time"] for i in high]))
+
+    record_readings(cur, chv_id, [(i["patient_id"], i["risk"]["risk_level"], i["reading_time"])
+                                  for i in created])
+    record_features(cur, [(i["patient_id"], i["glucose_level"], i["medication_taken"], i["reading_time"])
+                          for i in created])
+
+    for item in created:
+        results[item["index"]] = {
+            "client_uuid": item["client_uuid"],
+            "status": "created",
+            "reading_id": item["reading_id"],
+            "patient_id": item["patient_id"],
+            "risk_assessment": {**item["risk"], "assessment_id": assessment_ids[item["reading_id"]],
+                                "advice_status": "default"},
+        }
+    return results
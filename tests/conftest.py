@@ -0,0 +1,66 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Database tests run against a scratch database created beside
+# DATABASE_URL's, migrated to the latest version and dropped afterwards, so
+# they never touch real data. Without DATABASE_URL they are skipped. The
+# URL is swapped before any app module reads it.
+BASE_DATABASE_URL = os.environ.get("DATABASE_URL")
+SCRATCH_DATABASE = f"arch_test_{os.getpid()}"
+
+if BASE_DATABASE_URL:
+    from psycopg.conninfo import make_conninfo
+    os.environ["DATABASE_URL"] = make_conninfo(BASE_DATABASE_URL, dbname=SCRATCH_DATABASE)
+
+
+@pytest.fixture(scope="session")
+def database():
+    if not BASE_DATABASE_URL:
+        pytest.skip("DATABASE_URL is not set")
+    import psycopg
+    from db import close_pool, get_db_connection
+    from migrations import run_migrations
+
+    with psycopg.connect(BASE_DATABASE_URL, autocommit=True) as admin:
+        admin.execute(f'CREATE DATABASE "{SCRATCH_DATABASE}"')
+    try:
+        with get_db_connection() as conn:
+            run_migrations(conn)
+        yield
+    finally:
+        close_pool()
+        with psycopg.connect(BASE_DATABASE_URL, autocommit=True) as admin:
+            admin.execute(f'DROP DATABASE IF EXISTS "{SCRATCH_DATABASE}" WITH (FORCE)')
+
+
+@pytest.fixture
+def cur(database):
+    # A cursor whose transaction is rolled back after the test.
+    from db import get_db_connection
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            conn.rollback()
+            cur.close()
+
+
+@pytest.fixture
+def chv_patient(cur):
+    # (chv_id, patient_id) of a new CHV and a patient they registered.
+    cur.execute("""
+        INSERT INTO users (username, password_hash, full_name, role, district)
+        VALUES (%s, 'x', 'Test CHV', 'chv', 'Test District') RETURNING id
+    """, (f"chv-{uuid.uuid4().hex[:8]}",))
+    chv_id = cur.fetchone()["id"]
+    cur.execute("""
+        INSERT INTO patients (patient_id, full_name, village, district, registered_by)
+        VALUES (%s, 'Test Patient', 'Test Village', 'Test District', %s) RETURNING id
+    """, (f"P-{uuid.uuid4().hex[:8]}", chv_id))
+    return chv_id, cur.fetchone()["id"]
@@ -0,0 +1,26 @@
+from advice_cache import canonical_inputs, fingerprint, glucose_bucket, normalize_symptoms
+
+
+def test_equivalent_inputs_share_a_fingerprint():
+    a = canonical_inputs(212, True, " high ", "Headache, thirst", "High")
+    b = canonical_inputs(230.5, 1, "High", "thirst and headache; none", "High")
+    assert fingerprint(a) == fingerprint(b)
+
+
+def test_clinically_different_inputs_do_not():
+    base = canonical_inputs(212, True, "High", "headache", "High")
+    assert fingerprint(base) != fingerprint(canonical_inputs(260, True, "High", "headache", "High"))
+    assert fingerprint(base) != fingerprint(canonical_inputs(212, False, "High", "headache", "High"))
+
+
+def test_buckets_follow_risk_thresholds():
+    assert glucose_bucket(69.9) == "54-69"
+    assert glucose_bucket(70) == "70-99"
+    assert glucose_bucket(180) == "140-180"
+    assert glucose_bucket(181) == "181-250"
+    assert glucose_bucket(450) == ">=400"
+
+
+def test_normalize_symptoms_folds_accents_and_drops_none():
+    assert normalize_symptoms("Fièvre et Soif / N/A") == ["fievre", "soif"]
+    assert normalize_symptoms(None) == []
@@ -0,0 +1,28 @@
+from alert_stream import decode_events, scope_events, sse_item
+
+EVENT = {"event_id": 12, "alert_id": 3, "kind": "new", "chv_id": 5, "chv_ids": [5, 6],
+         "patient": {"id": 9, "full_name": "Test Patient"}}
+
+
+def test_admins_see_every_event():
+    [item] = scope_events([EVENT], "admin", 1)
+    assert item["event_id"] == 12 and item["delta"] == {"active_alerts": 1}
+
+
+def test_chvs_see_their_patients_only():
+    [own] = scope_events([EVENT], "chv", 5)
+    assert own["patient"] == EVENT["patient"]
+    [seen] = scope_events([EVENT], "chv", 6)
+    assert seen["patient"] is None and seen["delta"] == {"high_risk_count": 1}
+
+
+def test_unrelated_batches_still_advance_the_event_id():
+    later = {**EVENT, "event_id": 13, "kind": "resolved"}
+    assert scope_events([EVENT, later], "chv", 7) == [{"event_id": 13}]
+    assert sse_item({"event_id": 13}) == b"id: 13\n\n"
+
+
+def test_alert_items_carry_their_event_id():
+    [item] = scope_events(decode_events('{"events": [{"event_id": 12, "alert_id": 3, "kind": "new", '
+                                        '"chv_id": 5, "chv_ids": [5], "patient": {}}]}'), "admin", 1)
+    assert sse_item(item).startswith(b"id: 12\nevent: alert\n")
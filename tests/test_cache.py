@@ -0,0 +1,43 @@
+import cache
+from cache import LocalBackend
+
+
+def _backend(monkeypatch):
+    # No listener thread: these tests only exercise the local versions.
+    backend = LocalBackend(10)
+    monkeypatch.setattr(backend, "_ensure_listener", lambda: None)
+    return backend
+
+
+def test_bump_changes_only_that_tag(monkeypatch):
+    backend = _backend(monkeypatch)
+    before = backend.tag_versions(["patient:1", "patient:2"])
+    backend.bump(["patient:1"])
+    after = backend.tag_versions(["patient:1", "patient:2"])
+    assert after[0] != before[0] and after[1] == before[1]
+
+
+def test_reset_orphans_every_entry(monkeypatch):
+    backend = _backend(monkeypatch)
+    before = backend.tag_versions(["admin"])
+    backend.set("k", b"v", 60)
+    backend.reset()
+    assert backend.get("k") is None
+    assert backend.tag_versions(["admin"]) != before
+
+
+def test_lru_eviction(monkeypatch):
+    backend = _backend(monkeypatch)
+    for i in range(12):
+        backend.set(i, b"v", 60)
+    assert backend.get(0) is None and backend.get(11) == b"v"
+
+
+def test_invalidate_publishes_without_a_shared_backend(monkeypatch):
+    backend = _backend(monkeypatch)
+    published = []
+    monkeypatch.setattr(cache, "backend", backend)
+    monkeypatch.setattr(cache, "_publish", published.append)
+    cache.invalidate("patient:1", None, "admin")
+    assert published == [["patient:1", "admin"]]
+    assert backend.tag_versions(["admin"]) == [[0, 1]]
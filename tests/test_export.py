@@ -0,0 +1,18 @@
+from datetime import date
+
+import pytest
+
+from export import build_export_query, parse_filters
+
+
+def test_parse_filters():
+    assert parse_filters({"district": "North", "chv_id": "4", "start": "2026-01-01", "end": ""}) == \
+        {"district": "North", "chv_id": 4, "start": date(2026, 1, 1)}
+    with pytest.raises(ValueError):
+        parse_filters({"chv_id": "x"})
+
+
+def test_filters_are_composed_as_literals(cur):
+    query = build_export_query({"district": "O'Brien", "chv_id": 4, "end": date(2026, 1, 31)})
+    text = query.as_string(cur.connection)
+    assert "'O''Brien'" in text and "%s" not in text
@@ -0,0 +1,39 @@
+from datetime import date
+
+import pytest
+
+from geo import GEO_DEFAULT_DAYS, fetch_geo_series, parse_geo_filters, refresh_geo_stats
+from sync import ingest_readings
+
+
+def test_default_range_and_drill_down():
+    filters = parse_geo_filters({"end": "2026-03-31", "district": "North"})
+    assert filters["grain"] == "week" and filters["district"] == "North"
+    assert (filters["end"] - filters["start"]).days == GEO_DEFAULT_DAYS - 1
+
+
+@pytest.mark.parametrize("args", [
+    {"grain": "year"},
+    {"start": "2026-04-01", "end": "2026-03-01"},
+    {"start": "2020-01-01", "end": "2026-01-01"},
+    {"village": "Kibera"},
+    {"start": "not a date"},
+])
+def test_rejects_bad_filters(args):
+    with pytest.raises(ValueError):
+        parse_geo_filters(args)
+
+
+def test_series_counts_readings(cur, chv_patient):
+    chv_id, patient_id = chv_patient
+    today = date.today().isoformat()
+    batch = [{"client_uuid": f"00000000-0000-4000-9000-{n:012d}", "patient_id": patient_id,
+              "glucose_level": glucose, "reading_time": f"{today}T0{n}:00:00"}
+             for n, glucose in enumerate([320.0, 110.0])]
+    ingest_readings(cur, chv_id, batch)
+    refresh_geo_stats(cur)
+    result = fetch_geo_series(cur, parse_geo_filters({"grain": "day", "district": "Test District"}))
+    [village] = result["regions"]
+    assert village["village"] == "Test Village"
+    assert village["totals"]["reading_count"] == 2
+    assert village["totals"]["high_risk_rate"] == 50.0
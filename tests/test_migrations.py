@@ -0,0 +1,14 @@
+from db import get_db_connection
+from migrations import LATEST_VERSION, MIGRATIONS, check_index_usage
+
+
+def test_versions_are_sequential():
+    assert [m[0] for m in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+    assert LATEST_VERSION == len(MIGRATIONS)
+
+
+def test_hot_path_queries_use_their_indexes(database):
+    with get_db_connection() as conn:
+        failures = check_index_usage(conn)
+    assert not failures, "\n\n".join(f"{label}: expected {index_name}\n{plan}"
+                                     for label, index_name, plan in failures)
@@ -0,0 +1,46 @@
+from datetime import date
+
+from psycopg import sql
+
+from geo import archive_geo_stats, refresh_geo_stats
+from partitions import _add_months, ensure_partitions, partition_name
+from rollups import rebuild_rollups
+from sync import ingest_readings
+
+
+def _geo_rows(cur):
+    cur.execute("""
+        SELECT grain, bucket, village, reading_count, high_count, medium_count, low_count,
+               referral_count, active_patients
+        FROM geo_stats WHERE district = 'Test District' ORDER BY 1, 2, 3
+    """)
+    return cur.fetchall()
+
+
+def test_archived_month_keeps_geo_stats_and_chv_patients(cur, chv_patient):
+    chv_id, patient_id = chv_patient
+    month = _add_months(date.today().replace(day=1), -30)
+    ensure_partitions(cur, since=month)
+    batch = [{"client_uuid": f"00000000-0000-4000-8000-{n:012d}", "patient_id": patient_id,
+              "glucose_level": glucose, "reading_time": f"{month.isoformat()}T{n + 8:02d}:00:00"}
+             for n, glucose in enumerate([320.0, 110.0, 60.0])]
+    assert all(r["status"] == "created" for r in ingest_readings(cur, chv_id, batch))
+    assert refresh_geo_stats(cur) is not None
+    before = _geo_rows(cur)
+    assert before
+
+    # What partitions.py does to an expired month, minus the CSV.
+    for table in ("glucose_readings", "risk_assessments"):
+        name = partition_name(table, month)
+        if table == "glucose_readings":
+            archive_geo_stats(cur, name)
+        cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(sql.Identifier(table),
+                                                                         sql.Identifier(name)))
+        cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+
+    assert refresh_geo_stats(cur) is not None
+    assert _geo_rows(cur) == before
+
+    rebuild_rollups(cur)
+    cur.execute("SELECT 1 FROM chv_patients WHERE chv_id = %s AND patient_id = %s", (chv_id, patient_id))
+    assert cur.fetchone() is not None
@@ -0,0 +1,30 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask
+
+from payloads import OrjsonProvider, columnar, to_utc
+from sync import _parse_item
+
+
+def test_naive_timestamps_are_utc():
+    assert to_utc(datetime(2026, 3, 1, 7, 30)) == datetime(2026, 3, 1, 7, 30, tzinfo=timezone.utc)
+    nairobi = timezone(timedelta(hours=3))
+    assert to_utc(datetime(2026, 3, 1, 10, 30, tzinfo=nairobi)) == datetime(2026, 3, 1, 7, 30, tzinfo=timezone.utc)
+
+
+def test_row_and_column_layouts_agree():
+    rows = [{"t": datetime(2026, 3, 1, 7, 30, 0, 123456), "glucose": 140.0}]
+    provider = OrjsonProvider(Flask(__name__))
+    encoded = json.loads(provider.dumps({"rows": rows}))["rows"][0]["t"]
+    assert encoded == "2026-03-01T07:30:00+00:00"
+    # The stdlib fallback (used with keyword arguments) writes the same.
+    assert json.loads(provider.dumps({"rows": rows}, sort_keys=True))["rows"][0]["t"] == encoded
+    epoch = columnar(rows, ["t", "glucose"])["values"][0][0]
+    assert datetime.fromtimestamp(epoch, timezone.utc) == datetime.fromisoformat(encoded)
+
+
+def test_synced_times_are_stored_as_naive_utc():
+    item = _parse_item({"client_uuid": "0b9a8c1e-3f5d-4a8e-9c2b-1d2e3f4a5b6c", "patient_id": 1,
+                        "glucose_level": 120, "reading_time": "2026-03-01T10:30:00+03:00"})
+    assert item["reading_time"] == datetime(2026, 3, 1, 7, 30)
@@ -0,0 +1,26 @@
+import numpy as np
+
+from risk import HYPER_THRESHOLD, score_batch, score_reading
+
+
+def test_batch_and_single_scoring_agree():
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        glucose = float(rng.uniform(40, 450))
+        medication = bool(rng.random() < 0.5)
+        stress = ["Low", "Medium", "High", "Very High", None][int(rng.integers(5))]
+        recent = [float(v) for v in rng.uniform(60, 350, int(rng.integers(0, 8)))]
+        single = score_reading(glucose, medication, stress, [glucose] + recent)
+        window = ([glucose] + recent)[:5]
+        batch = score_batch([glucose], [medication], [stress], [len(window)],
+                            [sum(1 for v in window if v > HYPER_THRESHOLD)])
+        assert single["risk_level"] == str(batch["risk_level"][0])
+        assert single["risk_score"] == int(batch["risk_score"][0])
+
+
+def test_rules():
+    assert score_reading(55, True, "Low", [55])["risk_level"] == "Medium"
+    severe = score_reading(300, False, "High", [300, 260, 240])
+    assert severe["risk_level"] == "High" and severe["referral_needed"]
+    assert "Consistently high readings" in severe["warnings"]
+    assert score_reading(110, True, "Low", [110])["risk_level"] == "Low"
@@ -0,0 +1,33 @@
+import uuid
+from datetime import datetime, timedelta
+
+from rollups import rebuild_rollups
+from sync import ingest_readings
+
+
+def _snapshot(cur, chv_id):
+    cur.execute("""
+        SELECT day, reading_count, high_count, medium_count, low_count
+        FROM daily_chv_stats WHERE chv_id = %s ORDER BY day
+    """, (chv_id,))
+    daily = cur.fetchall()
+    cur.execute("SELECT reading_count, patient_count FROM chv_totals WHERE chv_id = %s", (chv_id,))
+    totals = cur.fetchone()
+    cur.execute("SELECT patient_id FROM chv_patients WHERE chv_id = %s ORDER BY patient_id", (chv_id,))
+    return daily, totals, cur.fetchall()
+
+
+def test_incremental_rollups_match_a_rebuild(cur, chv_patient):
+    chv_id, patient_id = chv_patient
+    now = datetime.now().replace(microsecond=0)
+    batch = [
+        {"client_uuid": str(uuid.uuid4()), "patient_id": patient_id, "glucose_level": glucose,
+         "medication_taken": days % 2 == 0, "reading_time": (now - timedelta(days=days)).isoformat()}
+        for days, glucose in [(0, 320.0), (0, 110.0), (1, 60.0), (3, 200.0), (3, 95.0)]
+    ]
+    assert all(r["status"] == "created" for r in ingest_readings(cur, chv_id, batch))
+
+    incremental = _snapshot(cur, chv_id)
+    rebuild_rollups(cur)
+    assert _snapshot(cur, chv_id) == incremental
+    assert incremental[1]["reading_count"] == len(batch)
@@ -0,0 +1,17 @@
+from decimal import Decimal
+
+from search import normalize_name, parse_cursor
+
+
+def test_parse_cursor():
+    assert parse_cursor("1.250000:42") == (Decimal("1.250000"), 42)
+    assert parse_cursor(None) is None
+
+
+def test_malformed_cursor_restarts_at_first_page():
+    for cursor in ["abc:1", "1.5:x", "1.5", "NaN:1", "Infinity:1", ":1"]:
+        assert parse_cursor(cursor) is None, cursor
+
+
+def test_normalize_name_folds_case_and_accents():
+    assert normalize_name("Ngọc  Éyébé") == "ngoc eyebe"
@@ -0,0 +1,48 @@
+import uuid
+from datetime import datetime, timedelta
+
+from features import RECORD_FEATURES_SQL, features_params, record_features
+from readings import assess_reading
+from sync import ingest_readings
+
+
+def _store(cur, chv_id, patient_id, levels):
+    # levels: [(reading_time, glucose_level)], recorded like synced readings.
+    for reading_time, glucose in levels:
+        cur.execute("""
+            INSERT INTO glucose_readings (patient_id, chv_id, glucose_level, medication_taken, reading_time)
+            VALUES (%s, %s, %s, TRUE, %s)
+        """, (patient_id, chv_id, glucose, reading_time))
+    record_features(cur, [(patient_id, glucose, True, t) for t, glucose in levels])
+
+
+def test_backdated_batch_scores_like_the_online_path(cur, chv_patient):
+    chv_id, patient_id = chv_patient
+    now = datetime.now().replace(microsecond=0)
+    # Five high readings twelve to eight days back, then five normal ones:
+    # the backdated readings below sit among the high ones, outside the
+    # patient's latest five.
+    _store(cur, chv_id, patient_id,
+           [(now - timedelta(days=12 - i), 260.0) for i in range(5)]
+           + [(now - timedelta(days=5 - i), 100.0) for i in range(5)])
+
+    # Newest first, to check the batch is put in time order.
+    batch = [
+        {"client_uuid": str(uuid.uuid4()), "patient_id": patient_id, "glucose_level": glucose,
+         "medication_taken": False, "reading_time": (now - timedelta(days=days, hours=12)).isoformat()}
+        for days, glucose in [(2, 120.0), (8, 200.0), (9, 210.0)]
+    ]
+    results = ingest_readings(cur, chv_id, batch)
+    assert [r["status"] for r in results] == ["created"] * 3
+
+    for item, result in zip(batch, results):
+        reading_time = datetime.fromisoformat(item["reading_time"])
+        with cur.connection.transaction(force_rollback=True):
+            cur.execute(RECORD_FEATURES_SQL, features_params(item, reading_time))
+            online = assess_reading(item, cur.fetchall())
+        synced = result["risk_assessment"]
+        assert (synced["risk_level"], synced["risk_score"], synced["warnings"]) == \
+            (online["risk_level"], online["risk_score"], online["warnings"]), item["reading_time"]
+
+    # The backdated readings were scored against the high ones before them.
+    assert "Consistently high readings" in results[1]["risk_assessment"]["warnings"]
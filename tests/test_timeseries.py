@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from timeseries import fetch_series, lttb
+
+
+def test_lttb_keeps_endpoints_and_spikes():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.full(1000, 120.0)
+    y[500] = 400.0
+    selected = lttb(x, y, 50)
+    assert len(selected) == 50
+    assert selected[0] == 0 and selected[-1] == 999
+    assert 500 in selected
+    assert list(selected) == sorted(selected)
+
+
+def test_series_is_bounded_and_summarizes_every_reading(cur, chv_patient):
+    chv_id, patient_id = chv_patient
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    levels = [100.0 + (i % 7) * 10 for i in range(3000)]
+    levels[1234] = 450.0
+    cur.execute("""
+        INSERT INTO glucose_readings (patient_id, chv_id, glucose_level, reading_time)
+        SELECT %s, %s, g, %s - n * INTERVAL '10 minutes'
+        FROM unnest(%s::float8[]) WITH ORDINALITY AS x(g, n)
+    """, (patient_id, chv_id, now, levels))
+
+    summary, series = fetch_series(cur, patient_id, 30, points=100)
+    assert summary["count"] == len(levels)
+    assert summary["max"] == 450.0 and summary["min"] == 100.0
+    assert abs(summary["mean"] - sum(levels) / len(levels)) < 1e-6
+    assert len(series) == 100
+    assert 450.0 in [p["glucose"] for p in series]
+
+    # Small windows come back whole.
+    summary, series = fetch_series(cur, patient_id, 1, points=500)
+    assert len(series) == summary["count"] <= 500
@@ -0,0 +1,191 @@
+from datetime import datetime
+
+import numpy as np
+
+READINGS_PAGE_SIZE = 500
+READINGS_MAX_PAGE_SIZE = 1000
+SERIES_DEFAULT_POINTS = 200
+SERIES_MAX_POINTS = 2000
+BUCKET_UNITS = ("auto", "hour", "day", "week")
+# The LTTB path first reduces the window in SQL to the lowest and highest
+# reading of each of points * LTTB_PREBUCKETS equal time slices, so at most
+# twice that many rows reach Python however long the window is.
+LTTB_PREBUCKETS = 4
+
+# Fields a readings page can be narrowed to with ?fields=; id and
+# reading_time are always included, as the page cursor is built from them.
+READING_FIELDS = {
+    "id": "gr.id",
+    "client_uuid": "gr.client_uuid",
+    "patient_id": "gr.patient_id",
+    "chv_id": "gr.chv_id",
+    "glucose_level": "gr.glucose_level",
+    "reading_time": "gr.reading_time",
+    "medication_taken": "gr.medication_taken",
+    "diet_description": "gr.diet_description",
+    "stress_level": "gr.stress_level",
+    "food_availability": "gr.food_availability",
+    "symptoms": "gr.symptoms",
+    "notes": "gr.notes",
+    "risk_level": "ra.risk_level",
+    "risk_score": "ra.risk_score",
+    "ai_advice": "ra.ai_advice",
+}
+
+
+def parse_reading_cursor(cursor):
+    # Cursors are "<reading_time ISO>|<id>" of the previous page's last row.
+    if not cursor:
+        return None
+    try:
+        reading_time, row_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(reading_time), int(row_id)
+    except ValueError:
+        return None
+
+
+def reading_columns(fields=None):
+    return ["id", "reading_time"] + [f for f in fields or READING_FIELDS if f not in ("id", "reading_time")]
+
+
+def fetch_readings_page(cur, patient_id, days, limit=READINGS_PAGE_SIZE, cursor=None, fields=None):
+    limit = max(1, min(int(limit), READINGS_MAX_PAGE_SIZE))
+    columns = ", ".join(f"{READING_FIELDS[name]} AS {name}" for name in reading_columns(fields))
+    params = {"patient_id": patient_id, "days": days, "limit": limit + 1}
+    keyset_sql = ""
+    after = parse_reading_cursor(cursor)
+    if after:
+        params["after_time"], params["after_id"] = after
+        keyset_sql = "AND (gr.reading_time, gr.id) < (%(after_time)s, %(after_id)s)"
+
+    # An assessment is never created before its reading, and stating that
+    # lets Postgres skip risk_assessments partitions older than the reading.
+    cur.execute(f'''
+        SELECT {columns}
+        FROM glucose_readings gr
+        LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id AND ra.created_at >= gr.reading_time
+        WHERE gr.patient_id = %(patient_id)s
+          AND gr.reading_time >= NOW() - %(days)s * INTERVAL '1 day'
+          {keyset_sql}
+        ORDER BY gr.reading_time DESC, gr.id DESC
+        LIMIT %(limit)s
+    ''', params)
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last['reading_time'].isoformat()}|{last['id']}"
+    return rows, next_cursor
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and,
+    # per bucket, the point forming the largest triangle with the previously
+    # kept point and the next bucket's average. Returns selected indices.
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start = end
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _latest(cur, patient_id, days):
+    cur.execute('''
+        SELECT gr.glucose_level, gr.reading_time, ra.risk_level
+        FROM glucose_readings gr
+        LEFT JOIN risk_assessments ra ON ra.reading_id = gr.id AND ra.created_at >= gr.reading_time
+        WHERE gr.patient_id = %s AND gr.reading_time >= NOW() - %s * INTERVAL '1 day'
+        ORDER BY gr.reading_time DESC
+        LIMIT 1
+    ''', (patient_id, days))
+    return cur.fetchone()
+
+
+def fetch_series(cur, patient_id, days, method="lttb", points=SERIES_DEFAULT_POINTS, bucket="auto"):
+    # Returns (summary, series). The summary covers every reading in the
+    # window even when the series is downsampled.
+    points = max(3, min(int(points), SERIES_MAX_POINTS))
+    latest = _latest(cur, patient_id, days)
+
+    if method == "buckets":
+        if bucket == "auto":
+            bucket = "hour" if days * 24 <= points else "day" if days <= points else "week"
+        cur.execute('''
+            SELECT date_trunc(%s, reading_time) AS t, COUNT(*) AS n,
+                   MIN(glucose_level) AS min, AVG(glucose_level) AS mean, MAX(glucose_level) AS max
+            FROM glucose_readings
+            WHERE patient_id = %s AND reading_time >= NOW() - %s * INTERVAL '1 day'
+            GROUP BY 1
+            ORDER BY 1
+        ''', (bucket, patient_id, days))
+        series = cur.fetchall()
+        count = sum(b["n"] for b in series)
+        summary = {
+            "count": count,
+            "mean": sum(b["mean"] * b["n"] for b in series) / count if count else None,
+            "min": min((b["min"] for b in series), default=None),
+            "max": max((b["max"] for b in series), default=None),
+            "bucket": bucket,
+            "latest": latest,
+        }
+        return summary, series
+
+    # Only the two charted columns are read, so the covering index on
+    # (patient_id, reading_time) INCLUDE (glucose_level) serves the scan.
+    # Slice extremes keep the spikes LTTB would pick; windows with at most
+    # `points` readings come back whole. The summary is over every reading.
+    cur.execute('''
+        WITH bounds AS (
+            SELECT (NOW() - %(days)s * INTERVAL '1 day')::timestamp AS since,
+                   GREATEST(%(days)s, 1) * 86400.0 / %(slices)s AS width
+        ), ranked AS (
+            SELECT gr.reading_time, gr.glucose_level,
+                   row_number() OVER slice_low AS low_rank,
+                   row_number() OVER slice_high AS high_rank,
+                   COUNT(*) OVER () AS n, AVG(gr.glucose_level) OVER () AS mean,
+                   MIN(gr.glucose_level) OVER () AS min, MAX(gr.glucose_level) OVER () AS max
+            FROM glucose_readings gr, bounds b
+            WHERE gr.patient_id = %(patient_id)s AND gr.reading_time >= NOW() - %(days)s * INTERVAL '1 day'
+            WINDOW slice AS (PARTITION BY floor(extract(epoch FROM gr.reading_time - b.since) / b.width)),
+                   slice_low AS (slice ORDER BY gr.glucose_level, gr.reading_time),
+                   slice_high AS (slice ORDER BY gr.glucose_level DESC, gr.reading_time)
+        )
+        SELECT reading_time, glucose_level, n, mean, min, max
+        FROM ranked
+        WHERE low_rank = 1 OR high_rank = 1 OR n <= %(points)s
+        ORDER BY reading_time
+    ''', {"patient_id": patient_id, "days": days, "points": points, "slices": points * LTTB_PREBUCKETS})
+    rows = cur.fetchall()
+    first = rows[0] if rows else None
+    summary = {
+        "count": first["n"] if first else 0,
+        "mean": float(first["mean"]) if first else None,
+        "min": float(first["min"]) if first else None,
+        "max": float(first["max"]) if first else None,
+        "latest": latest,
+    }
+    if len(rows) <= points:
+        indices = range(len(rows))
+    else:
+        x = np.array([r["reading_time"].timestamp() for r in rows])
+        y = np.array([r["glucose_level"] for r in rows], dtype=np.float64)
+        indices = lttb(x, y, points)
+    return summary, [{"t": rows[i]["reading_time"], "glucose": rows[i]["glucose_level"]} for i in indices]